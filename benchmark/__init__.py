@@ -0,0 +1 @@
+# Benchmark package 
\ No newline at end of file
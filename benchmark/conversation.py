@@ -0,0 +1,310 @@
+"""
+Benchmark hội thoại: chạy lại các kịch bản hội thoại nhiều lượt qua
+handle_message/handle_location với Update giả, dữ liệu Overpass mẫu và LLM giả
+có độ trễ cấu hình được. Không cần kết nối mạng.
+
+    python -m benchmark.conversation --users 1 10 100 1000 --llm-latency 0.005
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+# Thêm thư mục gốc vào sys.path để import các module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Cơ sở dữ liệu tạm và khóa API giả phải được thiết lập trước khi import bot
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="food-chatbot-bench-"), "bench.db"))
+os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+
+from telegram import InlineKeyboardMarkup
+from benchmark.fixtures import HOAN_KIEM, overpass_payload
+
+# Kịch bản hội thoại: ("text", nội dung), ("location", (vĩ độ, kinh độ)) hoặc
+# ("callback", tiêu chí cần bật/tắt hoặc "ok") trên bàn phím chọn tiêu chí gần nhất
+SCRIPTS: Dict[str, List[Tuple[str, Any]]] = {
+    "button_flow": [
+        ("command", "start"),
+        ("text", "Gợi ý món ăn"),
+        ("text", "Tôi muốn ăn đồ nướng cay"),
+        ("text", "thêm hải sản"),
+        ("text", "Xác nhận"),
+        ("location", HOAN_KIEM),
+        ("text", "Cảm ơn bạn nhé"),
+    ],
+    "returning_flow": [
+        ("text", "Gợi ý món ăn"),
+        ("text", "nướng cay"),
+        ("text", "Xác nhận"),
+        ("location", HOAN_KIEM),
+        ("text", "Gợi ý món ăn"),
+        ("text", "Như lần trước"),
+        ("location", HOAN_KIEM),
+    ],
+    "chips_flow": [
+        ("text", "Gợi ý món ăn"),
+        ("text", "Tôi muốn ăn đồ nướng"),
+        ("callback", "hải sản"),
+        ("callback", "cay"),
+        ("callback", "ok"),
+        ("location", HOAN_KIEM),
+    ],
+    "intent_flow": [
+        ("text", "Tìm giúp tôi quán ăn hải sản gần đây"),
+        ("text", "Xác nhận"),
+        ("location", HOAN_KIEM),
+    ],
+}
+
+class FakeMessage:
+    """Tin nhắn Telegram giả, ghi lại các câu trả lời"""
+    
+    def __init__(self, text: Optional[str] = None, location: Optional[Tuple[float, float]] = None):
+        self.text = text
+        self.location = SimpleNamespace(latitude=location[0], longitude=location[1]) if location else None
+        self.replies: List[str] = []
+        self.reply_markup: Any = None
+        self.is_accessible = True
+    
+    async def reply_text(self, text: str, **kwargs: Any) -> None:
+        self.replies.append(text)
+        if kwargs.get("reply_markup") is not None:
+            self.reply_markup = kwargs["reply_markup"]
+
+class FakeCallbackQuery:
+    """Lần nhấn nút inline giả trên tin nhắn message"""
+    
+    def __init__(self, data: str, message: FakeMessage):
+        self.data = data
+        self.message = message
+    
+    async def answer(self, text: Optional[str] = None) -> None:
+        return None
+    
+    async def edit_message_text(self, text: str, parse_mode: Optional[str] = None, reply_markup: Any = None) -> None:
+        self.message.text = text
+        self.message.reply_markup = reply_markup
+    
+    async def edit_message_reply_markup(self, reply_markup: Any = None) -> None:
+        self.message.reply_markup = reply_markup
+
+class FakeChat:
+    """Cuộc trò chuyện Telegram giả"""
+    
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+    
+    async def send_chat_action(self, action: str) -> None:
+        return None
+
+class FakeUpdate:
+    """Update Telegram giả với các thuộc tính mà handler sử dụng"""
+    
+    def __init__(self, user_id: int, message: FakeMessage, callback_query: Optional[FakeCallbackQuery] = None):
+        self.effective_user = SimpleNamespace(id=user_id, first_name=f"User{user_id}")
+        self.effective_chat = FakeChat(user_id)
+        self.message = None if callback_query else message
+        self.effective_message = message
+        self.callback_query = callback_query
+
+class FakeContext:
+    """Context giả của python-telegram-bot, mỗi người dùng có user_data riêng"""
+    
+    def __init__(self):
+        self.user_data: Dict[str, Any] = {}
+
+class FakeLLM:
+    """LLM giả trả lời cố định theo loại prompt, có độ trễ cấu hình được"""
+    
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+    
+    def _answer(self, system_message: str, user_message: str) -> str:
+        if "ý định" in system_message:
+            # Chỉ xét phần tin nhắn của người dùng nằm trong dấu nháy
+            quoted = user_message.split("'")[1] if "'" in user_message else user_message
+            return "yes" if any(word in quoted.lower() for word in ("món", "quán")) else "no"
+        if "trích xuất các tiêu chí" in system_message:
+            return "nướng\ncay"
+        if "gợi ý tiêu chí" in system_message:
+            return "hải sản\nbình dân"
+        if "xác nhận" in system_message:
+            return "Bạn muốn tìm món nướng, cay. Đây là những món đậm vị, hợp ăn tối."
+        if "phân tích hội thoại" in system_message:
+            return '{"mentioned_foods": [], "mentioned_criteria": ["nướng", "cay"], "user_preferences": [], "conversation_stage": "SUGGESTING"}'
+        if "tóm tắt hội thoại" in system_message:
+            return '{"summary": "Người dùng tìm quán nướng cay.", "mentioned_foods": [], "mentioned_criteria": ["nướng", "cay"], "user_preferences": {}}'
+        if "xếp hạng" in system_message:
+            return "2\n0\n1"
+        if "gợi ý món ăn" in system_message:
+            return "1. Bò nướng lá lốt\n2. Gà nướng mật ong\n3. Mực nướng sa tế"
+        return "Rất vui được giúp bạn!"
+    
+    @staticmethod
+    def _structured(schema_name: str, text: str) -> Any:
+        """Chuyển câu trả lời dạng văn bản sang JSON theo schema được yêu cầu"""
+        if schema_name == "criteria" or schema_name.startswith("extract_criteria"):
+            return {"criteria": text.split("\n")}
+        if schema_name == "ranking":
+            return {"ranked_ids": [int(line) for line in text.split("\n")]}
+        if schema_name.startswith("conversation_"):
+            result = json.loads(text)
+            result["user_preferences"] = []
+            result.setdefault("conversation_stage", "SUGGESTING")
+            return result
+        return text
+    
+    def _answer_batch(self, system_message: str, user_message: str, schema_name: Optional[str], schema: Optional[Dict[str, Any]]) -> str:
+        items = re.findall(r'<item id="(\d+)">\n(.*?)\n</item>', user_message, re.S)
+        answers = {}
+        for item_id, text in items:
+            answer = self._answer(system_message, text)
+            if schema and schema["properties"][item_id]["type"] == "array":
+                # Câu trả lời văn bản được gửi dạng danh sách các dòng
+                answers[item_id] = answer.split("\n")
+            else:
+                answers[item_id] = self._structured(schema_name[:-len("_batch")], answer) if schema_name else answer
+        return json.dumps(answers, ensure_ascii=False)
+    
+    def create(self, model: str, messages: List[Dict[str, str]], **kwargs: Any) -> Any:
+        self.calls += 1
+        time.sleep(self.latency)
+        response_format = kwargs.get("response_format")
+        schema_name = response_format["json_schema"]["name"] if response_format else None
+        schema = response_format["json_schema"]["schema"] if response_format else None
+        if "<item id=" in messages[-1]["content"]:
+            content = self._answer_batch(messages[0]["content"], messages[-1]["content"], schema_name, schema)
+        else:
+            content = self._answer(messages[0]["content"], messages[-1]["content"])
+            if schema_name:
+                content = json.dumps(self._structured(schema_name, content), ensure_ascii=False)
+        prompt_chars = sum(len(message["content"]) for message in messages)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=prompt_chars // 4, completion_tokens=len(content) // 4)
+        )
+
+def percentile(values: List[float], pct: float) -> float:
+    """Phân vị theo phương pháp nearest-rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def install_fakes(llm_latency: float, overpass_latency: float, overpass_elements: int) -> FakeLLM:
+    """Thay LLM và Overpass bằng bản giả"""
+    import llm.main
+    import location.main
+    
+    fake_llm = FakeLLM(llm_latency)
+    llm.main.client.chat.completions.create = fake_llm.create
+    
+    payload = overpass_payload(HOAN_KIEM, overpass_elements)
+    
+    def fake_fetch(query: str, timeout: Optional[float] = None, cache_only: bool = False) -> bytes:
+        time.sleep(overpass_latency)
+        return payload
+    
+    location.main._fetch_overpass = fake_fetch
+    return fake_llm
+
+async def run_user(user_id: int, script: List[Tuple[str, Any]], latencies: List[float]) -> None:
+    """Chạy một kịch bản hội thoại cho một người dùng"""
+    from bot.main import start, handle_message, handle_location, handle_criteria_callback
+    from bot.criteria_editor import CriteriaEditor, CALLBACK_CONFIRM, CALLBACK_TOGGLE
+    
+    context = FakeContext()
+    keyboard_message = None
+    for kind, payload in script:
+        if kind == "callback":
+            # Nhấn nút trên tin nhắn chứa bàn phím chọn tiêu chí gần nhất
+            if payload == "ok":
+                data = CALLBACK_CONFIRM
+            else:
+                data = f"{CALLBACK_TOGGLE}{CriteriaEditor.keyboard_options(keyboard_message.reply_markup).index(payload)}"
+            update = FakeUpdate(user_id, keyboard_message, FakeCallbackQuery(data, keyboard_message))
+            handler = handle_criteria_callback
+        elif kind == "location":
+            update = FakeUpdate(user_id, FakeMessage(location=payload))
+            handler = handle_location
+        else:
+            update = FakeUpdate(user_id, FakeMessage(text=payload))
+            handler = start if kind == "command" else handle_message
+        
+        started = time.perf_counter()
+        await handler(update, context)
+        latencies.append(time.perf_counter() - started)
+        if kind != "callback" and isinstance(update.message.reply_markup, InlineKeyboardMarkup):
+            keyboard_message = update.message
+
+async def run_level(users: int, fake_llm: FakeLLM, first_user_id: int) -> Dict[str, float]:
+    """Chạy tất cả kịch bản với số người dùng đồng thời cho trước"""
+    from metrics.main import registry
+    
+    def db_queries() -> float:
+        return sum(registry._counters.get("db_queries_total", {}).values())
+    
+    latencies: List[float] = []
+    script_names = sorted(SCRIPTS)
+    llm_calls_before = fake_llm.calls
+    db_queries_before = db_queries()
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_user(first_user_id + index, SCRIPTS[script_names[index % len(script_names)]], latencies)
+        for index in range(users)
+    ))
+    elapsed = time.perf_counter() - started
+    
+    return {
+        "users": users,
+        "turns": len(latencies),
+        "seconds": elapsed,
+        "turns_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "llm_calls": fake_llm.calls - llm_calls_before,
+        "db_queries": db_queries() - db_queries_before,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark hội thoại với backend giả")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 100, 1000], help="Số người dùng đồng thời")
+    parser.add_argument("--llm-latency", type=float, default=0.005, help="Độ trễ mỗi lần gọi LLM giả (giây)")
+    parser.add_argument("--overpass-latency", type=float, default=0.05, help="Độ trễ mỗi lần gọi Overpass giả (giây)")
+    parser.add_argument("--overpass-elements", type=int, default=500, help="Số phần tử trong phản hồi Overpass")
+    parser.add_argument("--telegram-limits", action="store_true", help="Áp dụng giới hạn gửi của Telegram (bot/sender.py)")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not args.telegram_limits:
+        # Người dùng giả gửi liên tục không nghỉ, giới hạn theo cuộc trò chuyện sẽ chi phối kết quả
+        from bot.sender import scheduler
+        scheduler.configure(global_rate=0, chat_rate=0)
+    from metrics.main import registry
+    registry.enabled = True
+    fake_llm = install_fakes(args.llm_latency, args.overpass_latency, args.overpass_elements)
+    
+    print(f"{'users':>6} {'turns':>7} {'turns/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'llm':>7} {'db':>8}")
+    first_user_id = 1
+    for users in args.users:
+        result = asyncio.run(run_level(users, fake_llm, first_user_id))
+        first_user_id += users
+        print(
+            f"{result['users']:>6} {result['turns']:>7} {result['turns_per_second']:>9.1f} "
+            f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+            f"{result['llm_calls']:>7} {int(result['db_queries']):>8}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Dữ liệu Overpass cho benchmark.
+
+Repo không kèm phản hồi ghi lại nào: mặc định generate_overpass_response() tạo dữ
+liệu giả lập có cấu trúc giống phản hồi Overpass (node/way, tag amenity/cuisine/addr,
+địa điểm không tên, way chỉ có center) với số phần tử tùy ý và kết quả cố định theo
+seed. Tên quán, địa chỉ và tọa độ trong dữ liệu này là giả.
+
+Có thể ghi lại phản hồi thật từ Overpass vào benchmark/fixtures/ (cần kết nối mạng)
+để đọc bằng load_recording(); hàm này báo lỗi khi chưa có file ghi lại, không tự
+chuyển sang dữ liệu giả lập:
+
+    python -m benchmark.fixtures record
+"""
+import os
+import sys
+import json
+import random
+from typing import Any, Dict, List, Tuple
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Các vị trí dùng trong benchmark
+HOAN_KIEM = (21.0287, 105.8524)
+SUBURB = (21.0590, 105.7350)
+
+_AMENITIES = ["restaurant"] * 6 + ["cafe"] * 3 + ["fast_food"] * 2 + ["food_court"]
+_CUISINES = [
+    "vietnamese", "noodle;pho", "bun_cha", "barbecue", "seafood", "vegetarian", "coffee_shop",
+    "chinese", "japanese;sushi", "korean", "thai", "italian;pizza", "french", "burger", None, None
+]
+_NAME_PREFIXES = ["Phở", "Bún chả", "Cơm", "Bánh mì", "Lẩu", "Nướng", "Cà phê", "Chè", "Ốc", "Quán", "Nhà hàng"]
+_NAME_SUFFIXES = ["Hà Nội", "Bà Lan", "Ông Tư", "Hàng Bạc", "Phố Cổ", "36", "Gia truyền", "Sài Gòn", "Cô Ba", "Hồ Gươm"]
+_STREETS = ["Hàng Bạc", "Hàng Bè", "Lương Văn Can", "Hàng Gai", "Đinh Tiên Hoàng", "Tràng Tiền", "Lý Quốc Sư", "Hàng Trống"]
+_DESCRIPTIONS = ["món nướng cay", "món nước truyền thống", "đồ chay", "hải sản tươi", "món khô", None, None, None]
+
+def generate_overpass_response(center: Tuple[float, float], count: int, spread: float = 0.02, seed: int = 0) -> Dict[str, Any]:
+    """
+    Tạo phản hồi Overpass giả lập
+    
+    Args:
+        center: Tọa độ trung tâm
+        count: Số phần tử
+        spread: Độ lệch tối đa của tọa độ so với trung tâm (độ)
+        seed: Seed cho kết quả cố định
+        
+    Returns:
+        Dict có cấu trúc giống phản hồi JSON của Overpass
+    """
+    rng = random.Random(seed)
+    elements: List[Dict[str, Any]] = []
+    for index in range(count):
+        latitude = center[0] + rng.uniform(-spread, spread)
+        longitude = center[1] + rng.uniform(-spread, spread)
+        tags: Dict[str, str] = {"amenity": rng.choice(_AMENITIES)}
+        
+        # Khoảng 15% địa điểm không có tên
+        if rng.random() > 0.15:
+            tags["name"] = f"{rng.choice(_NAME_PREFIXES)} {rng.choice(_NAME_SUFFIXES)}"
+        cuisine = rng.choice(_CUISINES)
+        if cuisine:
+            tags["cuisine"] = cuisine
+        if rng.random() < 0.5:
+            tags["addr:street"] = rng.choice(_STREETS)
+        if rng.random() < 0.2:
+            tags["opening_hours"] = "Mo-Su 07:00-22:00"
+        if rng.random() < 0.15:
+            tags["phone"] = f"+84 24 {rng.randint(3000, 3999)} {rng.randint(1000, 9999)}"
+        description = rng.choice(_DESCRIPTIONS)
+        if description:
+            tags["description"] = description
+        
+        # Khoảng 20% là way chỉ có tọa độ trung tâm
+        if rng.random() < 0.2:
+            elements.append({
+                "type": "way",
+                "id": 100000000 + index,
+                "center": {"lat": latitude, "lon": longitude},
+                "nodes": [rng.randint(1, 10 ** 9) for _ in range(4)],
+                "tags": tags
+            })
+        else:
+            elements.append({"type": "node", "id": index + 1, "lat": latitude, "lon": longitude, "tags": tags})
+    
+    # Các node hình học trả về bởi "out skel" (không có tag)
+    for index in range(count // 10):
+        elements.append({
+            "type": "node",
+            "id": 200000000 + index,
+            "lat": center[0] + rng.uniform(-spread, spread),
+            "lon": center[1] + rng.uniform(-spread, spread)
+        })
+    
+    return {"version": 0.6, "generator": "Overpass API (benchmark)", "elements": elements}
+
+def recording_path(center: Tuple[float, float]) -> str:
+    """Đường dẫn file phản hồi Overpass ghi lại quanh center"""
+    return os.path.join(FIXTURES_DIR, f"overpass_{center[0]}_{center[1]}.json")
+
+def load_recording(center: Tuple[float, float]) -> bytes:
+    """Đọc phản hồi Overpass đã ghi lại quanh center, báo lỗi nếu chưa ghi"""
+    path = recording_path(center)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Chưa có phản hồi Overpass ghi lại quanh {center} ({path}), hãy chạy: python -m benchmark.fixtures record")
+    with open(path, "rb") as f:
+        return f.read()
+
+def overpass_payload(center: Tuple[float, float], count: int, seed: int = 0) -> bytes:
+    """Phản hồi Overpass giả lập dạng bytes (xem generate_overpass_response)"""
+    return json.dumps(generate_overpass_response(center, count, seed=seed), ensure_ascii=False).encode("utf-8")
+
+def record(radius: int = 1000) -> None:
+    """Ghi lại phản hồi thật từ Overpass vào benchmark/fixtures/"""
+    import requests
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from location.main import OVERPASS_API_URL, _build_overpass_query
+    
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    for center in (HOAN_KIEM, SUBURB):
+        response = requests.post(OVERPASS_API_URL, data={"data": _build_overpass_query(center[0], center[1], radius)}, timeout=60)
+        response.raise_for_status()
+        count = len(response.json().get("elements", []))
+        with open(recording_path(center), "wb") as f:
+            f.write(response.content)
+        print(f"Đã ghi {count} phần tử quanh {center}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "record":
+        record()
+    else:
+        print(__doc__)
@@ -0,0 +1,113 @@
+"""
+Microbenchmark cho pipeline tìm quán ăn của LocationService.
+
+Đo riêng từng giai đoạn (parse, match, distance, rank, format) trên dữ liệu
+khu trung tâm (Hoàn Kiếm, mặc định 12000 phần tử) và ngoại ô, kèm bộ nhớ đỉnh
+của mỗi giai đoạn (tracemalloc). Mặc định dùng dữ liệu giả lập; --recorded dùng
+phản hồi Overpass đã ghi lại (python -m benchmark.fixtures record) và dừng với lỗi
+nếu chưa ghi:
+
+    python -m benchmark.location_pipeline --rounds 5 [--recorded]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+# Thêm thư mục gốc vào sys.path để import các module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import location.main as location_main
+from location.main import LocationService, process_overpass_response
+from benchmark.fixtures import HOAN_KIEM, SUBURB, overpass_payload, load_recording
+
+CRITERIA = ["nướng", "cay", "hải sản"]
+
+def measure(func: Callable[[], Any], rounds: int) -> Dict[str, float]:
+    """
+    Chạy hàm nhiều lần, trả về thời gian (min/trung bình/max, ms) và bộ nhớ đỉnh (KiB)
+    
+    Bộ nhớ đỉnh được đo trong một lần chạy riêng để tracemalloc không ảnh hưởng
+    đến thời gian.
+    """
+    timings: List[float] = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return {
+        "min_ms": min(timings) * 1000,
+        "mean_ms": sum(timings) / len(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+        "peak_kib": peak / 1024,
+    }
+
+def stages(raw: bytes, center: Tuple[float, float], top_k: int) -> Dict[str, Callable[[], Any]]:
+    """Các giai đoạn của pipeline, mỗi giai đoạn dùng đầu ra đã tính sẵn của giai đoạn trước"""
+    latitude, longitude = center
+    data = location_main._decode_json(raw)
+    named = list(location_main._iter_named_places(data["elements"]))
+    relevant = list(location_main._iter_relevant(named, CRITERIA))
+    with_distance = list(location_main._iter_with_distance(relevant, latitude, longitude))
+    restaurants = process_overpass_response(raw, latitude, longitude, CRITERIA, top_k)
+    
+    return {
+        "parse (json)": lambda: json.loads(raw),
+        "parse (orjson)": (lambda: location_main.orjson.loads(raw)) if location_main.orjson else None,
+        "match": lambda: list(location_main._iter_relevant(named, CRITERIA)),
+        "distance": lambda: list(location_main._iter_with_distance(relevant, latitude, longitude)),
+        "rank (full sort)": lambda: sorted(with_distance, key=lambda item: item[0]),
+        f"rank (top {top_k})": lambda: location_main.heapq.nsmallest(top_k, with_distance, key=lambda item: item[0]),
+        "format": lambda: LocationService.format_restaurant_results(restaurants[:3], CRITERIA),
+        "end-to-end (all)": lambda: process_overpass_response(raw, latitude, longitude, CRITERIA),
+        f"end-to-end (top {top_k})": lambda: process_overpass_response(raw, latitude, longitude, CRITERIA, top_k),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmark pipeline tìm quán ăn")
+    parser.add_argument("--rounds", type=int, default=5, help="Số lần chạy mỗi giai đoạn")
+    parser.add_argument("--city-elements", type=int, default=12000, help="Số phần tử khu trung tâm")
+    parser.add_argument("--suburb-elements", type=int, default=800, help="Số phần tử khu ngoại ô")
+    parser.add_argument("--top-k", type=int, default=10, help="Số kết quả giữ lại")
+    parser.add_argument("--recorded", action="store_true", help="Dùng phản hồi Overpass đã ghi lại thay cho dữ liệu giả lập")
+    args = parser.parse_args()
+    
+    if args.recorded:
+        try:
+            datasets = [
+                ("Hoàn Kiếm", HOAN_KIEM, load_recording(HOAN_KIEM)),
+                ("Ngoại ô", SUBURB, load_recording(SUBURB)),
+            ]
+        except FileNotFoundError as e:
+            parser.error(str(e))
+        source = "ghi lại"
+    else:
+        datasets = [
+            ("Hoàn Kiếm", HOAN_KIEM, overpass_payload(HOAN_KIEM, args.city_elements, seed=1)),
+            ("Ngoại ô", SUBURB, overpass_payload(SUBURB, args.suburb_elements, seed=2)),
+        ]
+        source = "giả lập"
+    
+    for name, center, raw in datasets:
+        print(f"\n{name} (dữ liệu {source}): {len(raw) / 1024 / 1024:.1f} MiB")
+        print(f"{'stage':<22} {'min ms':>9} {'mean ms':>9} {'max ms':>9} {'peak KiB':>10}")
+        for stage, func in stages(raw, center, args.top_k).items():
+            if func is None:
+                continue
+            result = measure(func, args.rounds)
+            print(
+                f"{stage:<22} {result['min_ms']:>9.2f} {result['mean_ms']:>9.2f} "
+                f"{result['max_ms']:>9.2f} {result['peak_kib']:>10.1f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Microbenchmark cho việc định dạng câu trả lời (render/main.py).
+
+So sánh hàm mới với cách làm cũ (remove_markdown năm lần re.sub, ghép kết quả tìm
+quán ăn bằng +=) trên câu trả lời ngắn, câu trả lời dài kiểu model và kết quả tìm
+quán ăn; đo thêm MarkdownV2, HTML và việc tách tin nhắn dài:
+
+    python -m benchmark.render --number 2000
+"""
+import os
+import re
+import sys
+import timeit
+import argparse
+from typing import Any, Callable, Dict, List, Tuple
+
+# Thêm thư mục gốc vào sys.path để import các module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from location.main import LocationService
+from render.main import strip_markdown, to_markdown_v2, to_html, split_message
+
+CRITERIA = ["nướng", "cay", "hải sản"]
+
+SHORT_REPLY = "Đang tìm kiếm quán ăn phù hợp với tiêu chí của bạn..."
+
+LLM_PARAGRAPH = (
+    "**Bún chả Hương Liên** là lựa chọn *rất được yêu thích* với chả nướng than hoa, "
+    "nước chấm `chua ngọt` và rau sống tươi. Giá khoảng 50.000đ - 70.000đ (~~100.000đ~~). "
+    "__Lưu ý:__ quán đông vào giờ trưa, nên đến trước 11h30!\n\n"
+)
+
+RESTAURANTS: List[Dict[str, Any]] = [
+    {
+        "name": f"Quán nướng số {index}",
+        "cuisine": "vietnamese",
+        "address": f"{index} Phố Hàng Bạc, Hoàn Kiếm, Hà Nội",
+        "distance": 120 * index,
+        "phone": "+84 24 3826 0000",
+        "opening_hours": "Mo-Su 10:00-22:00",
+    }
+    for index in range(1, 4)
+]
+
+def legacy_remove_markdown(text: str) -> str:
+    """remove_markdown trước đây của bot/main.py"""
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    text = re.sub(r'\*(.*?)\*', r'\1', text)
+    text = re.sub(r'__(.*?)__', r'\1', text)
+    text = re.sub(r'`(.*?)`', r'\1', text)
+    text = re.sub(r'~~(.*?)~~', r'\1', text)
+    return text
+
+def legacy_format_restaurant_results(restaurants: List[Dict[str, Any]], criteria: List[str]) -> str:
+    """LocationService.format_restaurant_results trước đây"""
+    result = f"Dựa trên tiêu chí của bạn ({', '.join(criteria)}), đây là top {len(restaurants)} quán ăn gần bạn:\n\n"
+    for i, restaurant in enumerate(restaurants, 1):
+        result += f"#{i}: {LocationService.format_restaurant_info(restaurant)}\n\n"
+    result += "Bạn có thể hỏi tôi về việc gợi ý món ăn bất cứ lúc nào."
+    return result
+
+def cases() -> List[Tuple[str, Callable[[], Any]]]:
+    """Các trường hợp được đo, trường hợp legacy đứng ngay trước trường hợp mới tương ứng"""
+    long_reply = LLM_PARAGRAPH * 40
+    results = LocationService.format_restaurant_results(RESTAURANTS, CRITERIA)
+    return [
+        ("legacy strip short", lambda: legacy_remove_markdown(SHORT_REPLY)),
+        ("strip short", lambda: strip_markdown(SHORT_REPLY)),
+        ("legacy strip results", lambda: legacy_remove_markdown(results)),
+        ("strip results", lambda: strip_markdown(results)),
+        ("legacy strip long", lambda: legacy_remove_markdown(long_reply)),
+        ("strip long", lambda: strip_markdown(long_reply)),
+        ("markdown_v2 long", lambda: to_markdown_v2(long_reply)),
+        ("html long", lambda: to_html(long_reply)),
+        ("split long", lambda: split_message(long_reply * 3)),
+        ("legacy format results", lambda: legacy_format_restaurant_results(RESTAURANTS, CRITERIA)),
+        ("format results", lambda: LocationService.format_restaurant_results(RESTAURANTS, CRITERIA)),
+    ]
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmark định dạng câu trả lời")
+    parser.add_argument("--number", type=int, default=2000, help="Số lần gọi mỗi lượt đo")
+    parser.add_argument("--repeat", type=int, default=5, help="Số lượt đo mỗi trường hợp")
+    args = parser.parse_args()
+
+    # Kết quả mới phải giống cách làm cũ với các câu trả lời thông thường
+    long_reply = LLM_PARAGRAPH * 40
+    assert strip_markdown(long_reply) == legacy_remove_markdown(long_reply)
+    assert LocationService.format_restaurant_results(RESTAURANTS, CRITERIA) == legacy_format_restaurant_results(RESTAURANTS, CRITERIA)
+
+    print(f"{'case':<24} {'best µs':>9} {'mean µs':>9}")
+    for name, func in cases():
+        timings = timeit.repeat(func, number=args.number, repeat=args.repeat)
+        best = min(timings) / args.number * 1e6
+        mean = sum(timings) / len(timings) / args.number * 1e6
+        print(f"{name:<24} {best:>9.2f} {mean:>9.2f}")
+
+if __name__ == "__main__":
+    main()
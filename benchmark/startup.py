@@ -0,0 +1,95 @@
+"""
+Benchmark khởi động: đo thời gian khởi động nguội (mỗi lần chạy là một tiến trình
+Python mới) của các bước khởi động bot và worker, kèm hồ sơ import (-X importtime)
+liệt kê các module import chậm nhất. Không cần kết nối mạng.
+
+    python -m benchmark.startup --rounds 5 --top 15
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Các bước khởi động được đo, mỗi bước chạy trong một tiến trình mới
+TARGETS: Dict[str, str] = {
+    "import bot.main": "import bot.main",
+    "build_application": "import bot.main; bot.main.build_application()",
+    "import worker.main": "import worker.main",
+    "first db query": "from session.main import SessionManager; SessionManager.get_state('startup')",
+}
+
+# Dòng "import time:      self |  cumulative | module" của -X importtime (đơn vị micro giây)
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+def _environment(db_dir: str) -> Dict[str, str]:
+    """Biến môi trường cho tiến trình con: cơ sở dữ liệu tạm, khóa API và token giả"""
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "benchmark")
+    env.setdefault("TELEGRAM_TOKEN", "123456:benchmark")
+    env["DB_PATH"] = os.path.join(db_dir, "startup.db")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+def measure(statement: str, rounds: int, env: Dict[str, str]) -> List[float]:
+    """Chạy statement trong rounds tiến trình Python mới, trả về thời gian (ms) của mỗi lần"""
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], env=env, cwd=ROOT, check=True, capture_output=True)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+def import_profile(statement: str, env: Dict[str, str]) -> List[Tuple[str, int, int, int]]:
+    """
+    Chạy statement với -X importtime
+
+    Returns:
+        Danh sách (module, độ sâu, thời gian riêng µs, thời gian tích lũy µs)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        env=env, cwd=ROOT, check=True, capture_output=True, text=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((name, (len(indent) - 1) // 2, int(self_us), int(cumulative_us)))
+    return modules
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark thời gian khởi động")
+    parser.add_argument("--rounds", type=int, default=5, help="Số lần chạy mỗi bước")
+    parser.add_argument("--top", type=int, default=15, help="Số module import chậm nhất được liệt kê")
+    parser.add_argument("--profile", default="import bot.main", choices=list(TARGETS), help="Bước được lập hồ sơ import")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="food-chatbot-startup-") as db_dir:
+        env = _environment(db_dir)
+
+        # Tiến trình Python trống làm mốc so sánh
+        baseline = statistics.median(measure("pass", args.rounds, env))
+        print(f"{'step':<22} {'min ms':>9} {'median ms':>10} {'max ms':>9}")
+        print(f"{'python -c pass':<22} {'':>9} {baseline:>10.1f}")
+        for name, statement in TARGETS.items():
+            timings = measure(statement, args.rounds, env)
+            print(f"{name:<22} {min(timings):>9.1f} {statistics.median(timings):>10.1f} {max(timings):>9.1f}")
+
+        modules = import_profile(TARGETS[args.profile], env)
+
+    total_ms = sum(cumulative for _, depth, _, cumulative in modules if depth == 0) / 1000
+    print(f"\nImport profile of '{args.profile}': {total_ms:.1f} ms total")
+    print(f"{'module':<40} {'self ms':>9} {'cumulative ms':>14}")
+    for name, depth, self_us, cumulative_us in sorted(modules, key=lambda module: module[3], reverse=True)[:args.top]:
+        print(f"{name:<40} {self_us / 1000:>9.1f} {cumulative_us / 1000:>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os
+from typing import List, Optional, Tuple
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from criteria.main import COMMON_CRITERIA
+
+# Số nút tiêu chí tối đa trên bàn phím inline (tiêu chí đã chọn luôn được hiển thị) và số nút mỗi hàng
+CRITERIA_CHIPS = int(os.getenv("CRITERIA_CHIPS", "8"))
+CRITERIA_CHIPS_PER_ROW = int(os.getenv("CRITERIA_CHIPS_PER_ROW", "3"))
+
+# callback_data của các nút (Telegram giới hạn 64 byte, nên nút tiêu chí dùng vị trí thay cho tên):
+# crit:t:<vị trí> bật/tắt tiêu chí, crit:ok xác nhận, crit:cancel hủy
+CALLBACK_PATTERN = r"^crit:"
+CALLBACK_TOGGLE = "crit:t:"
+CALLBACK_CONFIRM = "crit:ok"
+CALLBACK_CANCEL = "crit:cancel"
+
+# Dấu ở đầu nhãn nút: tiêu chí đã chọn và tiêu chí có thể thêm
+SELECTED_MARK = "✅"
+OPTION_MARK = "➕"
+
+class CriteriaEditor:
+    """
+    Bàn phím inline để chọn tiêu chí ở trạng thái CONFIRMING_CRITERIA
+
+    Mỗi tiêu chí là một nút bật/tắt. Danh sách tiêu chí trên bàn phím được đọc lại từ
+    chính tin nhắn khi người dùng nhấn nút, nên không cần lưu thêm trạng thái và
+    không cần gọi Gemini; tiêu chí đã chọn vẫn được lưu trong SessionManager.
+    """
+
+    @staticmethod
+    def options(criteria: List[str], suggested_criteria: Optional[List[str]] = None) -> List[str]:
+        """
+        Các tiêu chí hiển thị trên bàn phím: tiêu chí đã chọn, tiêu chí gợi ý, rồi các
+        tiêu chí phổ biến cho đến khi đủ CRITERIA_CHIPS nút
+        """
+        options = list(dict.fromkeys([*criteria, *(suggested_criteria or [])]))
+        for criterion in COMMON_CRITERIA:
+            if len(options) >= CRITERIA_CHIPS:
+                break
+            if criterion not in options:
+                options.append(criterion)
+        return options
+
+    @staticmethod
+    def build_keyboard(criteria: List[str], options: List[str]) -> InlineKeyboardMarkup:
+        """
+        Tạo bàn phím inline gồm các nút tiêu chí và hàng nút Xác nhận/Hủy
+
+        Args:
+            criteria: Tiêu chí đã chọn
+            options: Các tiêu chí hiển thị, theo thứ tự
+        """
+        buttons = [
+            InlineKeyboardButton(CriteriaEditor._label(option, option in criteria), callback_data=f"{CALLBACK_TOGGLE}{index}")
+            for index, option in enumerate(options)
+        ]
+        rows = [buttons[start:start + CRITERIA_CHIPS_PER_ROW] for start in range(0, len(buttons), CRITERIA_CHIPS_PER_ROW)]
+        rows.append([
+            InlineKeyboardButton("Xác nhận", callback_data=CALLBACK_CONFIRM),
+            InlineKeyboardButton("Hủy", callback_data=CALLBACK_CANCEL),
+        ])
+        return InlineKeyboardMarkup(rows)
+
+    @staticmethod
+    def keyboard_options(markup: Optional[InlineKeyboardMarkup]) -> List[str]:
+        """Đọc lại các tiêu chí hiển thị từ bàn phím inline của tin nhắn"""
+        if markup is None:
+            return []
+        options = {}
+        for row in markup.inline_keyboard:
+            for button in row:
+                data = button.callback_data
+                if isinstance(data, str) and data.startswith(CALLBACK_TOGGLE):
+                    options[int(data[len(CALLBACK_TOGGLE):])] = CriteriaEditor._option(button.text)
+        return [options[index] for index in sorted(options)]
+
+    @staticmethod
+    def _label(option: str, selected: bool) -> str:
+        """Nhãn nút tiêu chí, dạng <dấu> <tiêu chí>"""
+        return f"{SELECTED_MARK if selected else OPTION_MARK} {option}"
+
+    @staticmethod
+    def _option(label: str) -> str:
+        """Đọc lại tiêu chí từ nhãn nút (ngược với _label), chỉ bỏ đúng dấu ở đầu nhãn"""
+        for mark in (SELECTED_MARK, OPTION_MARK):
+            if label.startswith(f"{mark} "):
+                return label[len(mark) + 1:]
+        return label
+
+    @staticmethod
+    def parse_callback(data: str) -> Tuple[str, Optional[int]]:
+        """
+        Đọc callback_data của nút
+
+        Returns:
+            ("toggle", vị trí), ("confirm", None) hoặc ("cancel", None)
+
+        Raises:
+            ValueError: Nếu callback_data không hợp lệ
+        """
+        if data == CALLBACK_CONFIRM:
+            return "confirm", None
+        if data == CALLBACK_CANCEL:
+            return "cancel", None
+        if data.startswith(CALLBACK_TOGGLE):
+            return "toggle", int(data[len(CALLBACK_TOGGLE):])
+        raise ValueError(f"callback_data không hợp lệ: {data}")
+
+    @staticmethod
+    def toggle(criteria: List[str], criterion: str) -> List[str]:
+        """Bỏ tiêu chí nếu đã chọn, ngược lại thêm vào cuối danh sách"""
+        if criterion in criteria:
+            return [c for c in criteria if c != criterion]
+        return criteria + [criterion]
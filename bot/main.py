@@ -1,70 +1,168 @@
 import os
 import logging
 import asyncio
-import re  # Thêm thư viện re để xử lý regex
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from typing import List, Dict, Optional
+from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 from llm.main import (
     get_model_response, 
     get_model_response_with_history,
     analyze_conversation_history,
     rank_restaurants_by_criteria,
     generate_food_suggestions,
-    client
+    LLM_RANKING_MAX_RESTAURANTS,
+    get_client,
+    MicroBatcher,
+    LLMUnavailableError
 )
 from session.main import SessionManager, ConversationState
 from criteria.main import CriteriaProcessor
 from location.main import LocationService
 from fallback.main import FallbackHandler
+from preferences.main import PreferenceStore
+from database.journal import journal, DB_JOURNAL_SHUTDOWN_TIMEOUT
+from database.retention import start_retention_thread
+from budget.main import Deadline, BUDGET_LLM_MIN_S
+from metrics.main import span, timed, timed_turn, set_turn_label, start_metrics_server
+from bot.sender import scheduler
+from bot.criteria_editor import CriteriaEditor, CALLBACK_PATTERN
+from render.main import render_message, split_message, strip_markdown
+from render.templates import criteria_editor_text
 
 # Get environment variables (already loaded in main.py)
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 MODEL_NAME = os.getenv("MODEL_NAME")
+# Định dạng tin nhắn gửi đi: để trống (văn bản thuần, bỏ dấu markdown), "MarkdownV2" hoặc "HTML"
+TELEGRAM_PARSE_MODE = os.getenv("TELEGRAM_PARSE_MODE") or None
 
-# Configure logging
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.ERROR
-)
 logger = logging.getLogger(__name__)
 
+# Các nút của luồng nhanh cho người dùng quay lại
+SAME_AS_LAST_BUTTON = "Như lần trước"
+NEW_CRITERIA_BUTTON = "Chọn tiêu chí mới"
+
 # Define system message for the AI
 SYSTEM_MESSAGE = """Bạn là trợ lý AI giúp gợi ý món ăn dựa trên tiêu chí của người dùng.
 Hãy trả lời ngắn gọn, thân thiện và chính xác."""
 
-# Hàm xử lý markdown
-def remove_markdown(text):
+# System message cho việc phân tích ý định
+INTENT_SYSTEM_MESSAGE = """Bạn là trợ lý AI phân tích ý định của người dùng.
+Nhiệm vụ của bạn là xác định xem tin nhắn của người dùng có phải là yêu cầu gợi ý món ăn hoặc tìm quán ăn không.
+Chỉ trả về "yes" nếu người dùng đang hỏi về việc gợi ý món ăn, tìm quán ăn, hoặc muốn biết nên ăn gì.
+Trả về "no" cho tất cả các trường hợp khác."""
+
+# Gom các yêu cầu phân tích ý định của nhiều người dùng (xem LLM_BATCH_WINDOW_MS)
+_intent_batcher = MicroBatcher("intent", INTENT_SYSTEM_MESSAGE)
+
+# Các tác vụ nền đang chạy (giữ tham chiếu để không bị thu hồi trước khi hoàn thành)
+_background_tasks = set()
+
+def schedule_history_summary(user_id: str) -> None:
     """
-    Loại bỏ các dấu markdown trong văn bản
+    Tóm tắt hội thoại của người dùng trong nền
+    
+    Chỉ tạo tác vụ nền khi bộ đếm tin nhắn cho thấy có thể cần tóm tắt, để các lượt
+    thông thường không phải chờ ghi journal hay đọc cơ sở dữ liệu.
     
     Args:
-        text: Văn bản cần xử lý
+        user_id: ID người dùng
+    """
+    if not SessionManager.needs_summary(user_id):
+        return
+    task = asyncio.ensure_future(asyncio.to_thread(SessionManager.summarize_history, user_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def suggest_criteria(user_id: str, criteria: List[str], conversation_history: List[Dict[str, str]]) -> List[str]:
+    """
+    Gợi ý thêm tiêu chí cho người dùng
+    
+    Ưu tiên các tiêu chí người dùng hay chọn, chỉ gọi Gemini khi chưa có sở thích nào.
+    
+    Args:
+        user_id: ID người dùng
+        criteria: Danh sách tiêu chí hiện có
+        conversation_history: Lịch sử hội thoại
         
     Returns:
-        Văn bản đã được xử lý
+        Danh sách các tiêu chí được gợi ý thêm
     """
-    # Loại bỏ dấu ** (bold)
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    
-    # Loại bỏ dấu * (italic)
-    text = re.sub(r'\*(.*?)\*', r'\1', text)
+    favorite_criteria = PreferenceStore.get_favorite_criteria(user_id, exclude=criteria, limit=2)
+    if favorite_criteria:
+        return favorite_criteria
+    return CriteriaProcessor.generate_criteria_suggestions(criteria, conversation_history, max_suggestions=2)
+
+async def _send_text(update: Update, text: str, **kwargs) -> None:
+    """Gửi một phần tin nhắn theo TELEGRAM_PARSE_MODE, gửi lại dạng văn bản thuần nếu Telegram từ chối định dạng"""
+    chat_id = update.effective_chat.id
+    if TELEGRAM_PARSE_MODE:
+        rendered = render_message(text, TELEGRAM_PARSE_MODE)
+        try:
+            await scheduler.send(chat_id, lambda: update.effective_message.reply_text(rendered, parse_mode=TELEGRAM_PARSE_MODE, **kwargs))
+            return
+        except BadRequest as e:
+            logger.warning(f"Telegram không đọc được định dạng {TELEGRAM_PARSE_MODE}, gửi văn bản thuần: {e}")
+    await scheduler.send(chat_id, lambda: update.effective_message.reply_text(strip_markdown(text), **kwargs))
+
+async def reply(update: Update, text: str, **kwargs) -> None:
+    """
+    Gửi tin nhắn trả lời cho người dùng qua bộ lập lịch gửi (bot/sender.py)
     
-    # Loại bỏ dấu __ (underline)
-    text = re.sub(r'__(.*?)__', r'\1', text)
+    Markdown trong tin nhắn được định dạng theo TELEGRAM_PARSE_MODE (render/main.py).
+    Tin nhắn dài hơn giới hạn của Telegram được tách thành nhiều phần, bàn phím
+    chỉ gắn vào phần cuối.
     
-    # Loại bỏ dấu ` (code)
-    text = re.sub(r'`(.*?)`', r'\1', text)
+    Args:
+        update: Update từ Telegram
+        text: Nội dung tin nhắn (có thể chứa markdown)
+        **kwargs: Các tham số khác của reply_text (reply_markup, ...)
+    """
+    chunks = split_message(text)
+    reply_markup = kwargs.pop("reply_markup", None)
+    for chunk in chunks[:-1]:
+        await _send_text(update, chunk, **kwargs)
+    if reply_markup is not None:
+        kwargs["reply_markup"] = reply_markup
+    await _send_text(update, chunks[-1], **kwargs)
+
+async def edit_message(update: Update, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> None:
+    """
+    Sửa tin nhắn chứa nút vừa được nhấn (callback query) qua bộ lập lịch gửi
     
-    # Loại bỏ dấu ~~ (strikethrough)
-    text = re.sub(r'~~(.*?)~~', r'\1', text)
+    Giống _send_text, sửa lại bằng văn bản thuần nếu Telegram từ chối định dạng.
     
-    return text
+    Args:
+        update: Update từ Telegram có callback_query
+        text: Nội dung mới (có thể chứa markdown)
+        reply_markup: Bàn phím inline mới, None để bỏ bàn phím
+    """
+    query = update.callback_query
+    chat_id = update.effective_chat.id
+    try:
+        if TELEGRAM_PARSE_MODE:
+            rendered = render_message(text, TELEGRAM_PARSE_MODE)
+            try:
+                await scheduler.send(chat_id, lambda: query.edit_message_text(rendered, parse_mode=TELEGRAM_PARSE_MODE, reply_markup=reply_markup))
+                return
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    raise
+                logger.warning(f"Telegram không đọc được định dạng {TELEGRAM_PARSE_MODE}, sửa bằng văn bản thuần: {e}")
+        await scheduler.send(chat_id, lambda: query.edit_message_text(strip_markdown(text), reply_markup=reply_markup))
+    except BadRequest as e:
+        # Nhấn nút hai lần liên tiếp có thể tạo ra nội dung không đổi
+        if "not modified" not in str(e).lower():
+            raise
 
+@timed_turn("start")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Xử lý lệnh /start."""
     user = update.effective_user
     user_id = str(user.id)
     
     # Khởi tạo phiên mới và đặt trạng thái về IDLE
+    SessionManager.close_session(user_id)
     SessionManager.reset_state(user_id)
     
     # Lưu tin nhắn vào lịch sử
@@ -79,8 +177,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     suggestion_button = KeyboardButton("Gợi ý món ăn")
     reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
     
-    await update.message.reply_text(welcome_message, reply_markup=reply_markup)
+    await reply(update, welcome_message, reply_markup=reply_markup)
 
+@timed_turn("help")
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Xử lý lệnh /help."""
     user_id = str(update.effective_user.id)
@@ -98,13 +197,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # Lưu tin nhắn vào lịch sử
     SessionManager.add_bot_message(user_id, help_message)
     
-    await update.message.reply_text(help_message)
+    await reply(update, help_message)
 
+@timed_turn("reset")
 async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Đặt lại trạng thái hội thoại."""
     user_id = str(update.effective_user.id)
     
-    # Đặt lại trạng thái về IDLE
+    # Đóng phiên hiện tại và đặt lại trạng thái về IDLE
+    SessionManager.close_session(user_id)
     SessionManager.reset_state(user_id)
     
     reset_message = "Đã đặt lại quá trình tìm kiếm. Bạn có thể hỏi tôi về việc gợi ý món ăn bất cứ lúc nào."
@@ -116,8 +217,9 @@ async def reset_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     suggestion_button = KeyboardButton("Gợi ý món ăn")
     reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
     
-    await update.message.reply_text(reset_message, reply_markup=reply_markup)
+    await reply(update, reset_message, reply_markup=reply_markup)
 
+@timed("intent")
 def is_food_suggestion_request(message: str) -> bool:
     """
     Sử dụng Gemini để xác định xem tin nhắn có phải là yêu cầu gợi ý món ăn không.
@@ -130,15 +232,10 @@ def is_food_suggestion_request(message: str) -> bool:
     """
     try:
         # Xây dựng prompt cho Gemini
-        system_message = """Bạn là trợ lý AI phân tích ý định của người dùng.
-Nhiệm vụ của bạn là xác định xem tin nhắn của người dùng có phải là yêu cầu gợi ý món ăn hoặc tìm quán ăn không.
-Chỉ trả về "yes" nếu người dùng đang hỏi về việc gợi ý món ăn, tìm quán ăn, hoặc muốn biết nên ăn gì.
-Trả về "no" cho tất cả các trường hợp khác."""
-        
         user_message = f"Tin nhắn của người dùng: '{message}'\nĐây có phải là yêu cầu gợi ý món ăn hoặc tìm quán ăn không? Chỉ trả lời 'yes' hoặc 'no'."
         
         # Gọi Gemini để phân tích
-        response = get_model_response(client, system_message, user_message).strip().lower()
+        response = _intent_batcher.submit(user_message).strip().lower()
         
         # Kiểm tra kết quả
         return "yes" in response
@@ -153,16 +250,173 @@ async def send_typing_action(update: Update) -> None:
     """
     Hiển thị trạng thái 'đang nhập' để cải thiện trải nghiệm người dùng
     
+    Trạng thái được gửi sau các tin nhắn đang chờ và không làm chậm lượt hội thoại.
+    
     Args:
         update: Update từ Telegram
     """
-    try:
-        await update.effective_chat.send_chat_action(action="typing")
-    except Exception as e:
-        logger.error(f"Lỗi khi gửi trạng thái đang nhập: {e}")
+    chat = update.effective_chat
+    scheduler.send_typing(chat.id, lambda: chat.send_chat_action(action="typing"))
+
+async def cancel_search(update: Update, user_id: str) -> None:
+    """Hủy quá trình tìm kiếm và đưa hội thoại về trạng thái IDLE."""
+    # Đặt lại trạng thái về IDLE
+    SessionManager.reset_state(user_id)
+    
+    cancel_message = "Đã hủy quá trình tìm kiếm. Bạn có thể hỏi tôi về việc gợi ý món ăn bất cứ lúc nào."
+    
+    # Lưu tin nhắn vào lịch sử
+    SessionManager.add_bot_message(user_id, cancel_message)
+    
+    # Tạo nút gợi ý món ăn
+    suggestion_button = KeyboardButton("Gợi ý món ăn")
+    reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
+    
+    await reply(update, cancel_message, reply_markup=reply_markup)
+
+async def confirm_criteria(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: str, current_criteria: List[str], fast_path: bool = False) -> None:
+    """
+    Xác nhận tiêu chí và chuyển sang bước chờ vị trí (bằng tin nhắn hoặc nút 'Xác nhận')
+    
+    fast_path chỉ bật khi người dùng quay lại nhấn nút SAME_AS_LAST_BUTTON: khi đó quán ăn
+    được xếp hạng không cần Gemini.
+    """
+    # Nếu không có tiêu chí nào, yêu cầu người dùng nhập lại
+    if not current_criteria:
+        no_criteria_message = "Bạn chưa cung cấp tiêu chí nào. Vui lòng nhập tiêu chí để tôi có thể gợi ý món ăn phù hợp."
+        
+        # Lưu tin nhắn vào lịch sử
+        SessionManager.add_bot_message(user_id, no_criteria_message)
+        
+        # Tạo nút hủy
+        cancel_button = KeyboardButton("Hủy")
+        reply_markup = ReplyKeyboardMarkup([[cancel_button]], resize_keyboard=True)
+        
+        await reply(update, no_criteria_message, reply_markup=reply_markup)
+        return
+    
+    # Người dùng chọn tìm giống lần trước: xếp hạng quán ăn không cần Gemini
+    context.user_data["fast_path"] = fast_path
+    
+    # Ghi nhận tiêu chí đã xác nhận vào sở thích của người dùng
+    PreferenceStore.record_confirmed_criteria(user_id, current_criteria)
+    
+    # Chuyển sang trạng thái chờ vị trí
+    SessionManager.set_state(user_id, ConversationState.WAITING_FOR_LOCATION, current_criteria)
+    
+    # Tạo nút chia sẻ vị trí và hủy
+    location_button = KeyboardButton("Chia sẻ vị trí", request_location=True)
+    cancel_button = KeyboardButton("Hủy")
+    reply_markup = ReplyKeyboardMarkup([[location_button], [cancel_button]], resize_keyboard=True)
+    
+    location_message = "Vui lòng chia sẻ vị trí của bạn để tôi có thể tìm quán ăn gần đó."
+    
+    # Lưu tin nhắn vào lịch sử
+    SessionManager.add_bot_message(user_id, location_message)
+    
+    await reply(update, location_message, reply_markup=reply_markup)
+
+async def ask_criteria_confirmation(update: Update, user_id: str, criteria: List[str]) -> None:
+    """
+    Gửi tin nhắn xác nhận tiêu chí kèm gợi ý thêm tiêu chí và bàn phím chọn tiêu chí
+    
+    Việc gợi ý và định dạng tin nhắn xác nhận có thể gọi Gemini nên chạy trong thread.
+    """
+    # Lấy lịch sử hội thoại
+    conversation_history = SessionManager.get_formatted_history(user_id)
+    
+    # Gợi ý thêm tiêu chí nếu cần
+    suggested_criteria = []
+    if len(criteria) < 3:
+        suggested_criteria = await asyncio.to_thread(suggest_criteria, user_id, criteria, conversation_history)
+    
+    # Định dạng tiêu chí để xác nhận, kèm theo gợi ý (nhưng không thêm vào danh sách tiêu chí)
+    confirmation_message = await asyncio.to_thread(CriteriaProcessor.format_criteria_for_confirmation, criteria, suggested_criteria)
+    
+    # Lưu tin nhắn vào lịch sử
+    SessionManager.add_bot_message(user_id, confirmation_message)
+    
+    # Bàn phím chọn tiêu chí: nhấn để thêm hoặc bỏ tiêu chí, rồi xác nhận hoặc hủy
+    reply_markup = CriteriaEditor.build_keyboard(criteria, CriteriaEditor.options(criteria, suggested_criteria))
+    
+    await reply(update, confirmation_message, reply_markup=reply_markup)
 
+async def search_and_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: str, latitude: float, longitude: float, deadline: Deadline) -> None:
+    """
+    Tìm quán ăn gần vị trí theo tiêu chí đã xác nhận, gửi kết quả (hoặc gợi ý món ăn
+    khi không tìm thấy) rồi đưa hội thoại về trạng thái IDLE
+    
+    Các bước gọi Gemini chạy trong thread để không chặn các cuộc trò chuyện khác.
+    """
+    # Lấy tiêu chí hiện có
+    current_criteria = SessionManager.get_criteria(user_id) or []
+    
+    # Chuyển sang trạng thái xử lý
+    SessionManager.set_state(user_id, ConversationState.PROCESSING, current_criteria, (latitude, longitude))
+    
+    # Hiển thị trạng thái "đang nhập" để cải thiện trải nghiệm người dùng
+    await send_typing_action(update)
+    
+    # Thông báo đang xử lý
+    processing_message = "Đang tìm kiếm quán ăn phù hợp với tiêu chí của bạn..."
+    
+    # Lưu tin nhắn vào lịch sử
+    SessionManager.add_bot_message(user_id, processing_message)
+    
+    await reply(update, processing_message)
+    
+    # Tìm kiếm quán ăn gần vị trí: chỉ giữ số quán gần nhất mà bước xếp hạng bằng Gemini
+    # xem xét (LLM_RANKING_MAX_RESTAURANTS), các quán xa hơn không bao giờ được chọn
+    with span("location_search"):
+        restaurants = await LocationService.search_restaurants_by_coordinates_async(
+            latitude, longitude, current_criteria, top_k=LLM_RANKING_MAX_RESTAURANTS, deadline=deadline
+        )
+    
+    # Nếu tìm thấy quán ăn
+    if restaurants:
+        # Xếp hạng quán ăn dựa trên tiêu chí (không gọi Gemini nếu tiêu chí giống lần trước
+        # hoặc không còn đủ thời gian)
+        if context.user_data.pop("fast_path", False) or not deadline.allows(BUDGET_LLM_MIN_S, "llm_ranking"):
+            ranked_restaurants = LocationService.rank_by_criteria(restaurants, current_criteria)
+        else:
+            ranked_restaurants = await asyncio.to_thread(rank_restaurants_by_criteria, restaurants, current_criteria, deadline)
+        
+        # Lấy top 3 quán ăn
+        top_restaurants = ranked_restaurants[:3]
+        PreferenceStore.record_restaurant(user_id, top_restaurants[0])
+        
+        # Định dạng kết quả
+        result_message = LocationService.format_restaurant_results(top_restaurants, current_criteria)
+        
+        # Lưu tin nhắn vào lịch sử
+        SessionManager.add_bot_message(user_id, result_message)
+        
+        # Tạo nút gợi ý món ăn
+        suggestion_button = KeyboardButton("Gợi ý món ăn")
+        reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
+        
+        await reply(update, result_message, reply_markup=reply_markup)
+    else:
+        # Không tìm thấy quán ăn, sử dụng fallback
+        fallback_message = await asyncio.to_thread(FallbackHandler.handle_no_restaurants, current_criteria, deadline)
+        
+        # Lưu tin nhắn vào lịch sử
+        SessionManager.add_bot_message(user_id, fallback_message)
+        
+        # Tạo nút gợi ý món ăn
+        suggestion_button = KeyboardButton("Gợi ý món ăn")
+        reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
+        
+        await reply(update, fallback_message, reply_markup=reply_markup)
+    
+    # Đặt lại trạng thái về IDLE sau khi hoàn thành
+    SessionManager.reset_state(user_id)
+
+@timed_turn("message")
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Xử lý tin nhắn của người dùng dựa trên trạng thái hội thoại."""
+    # Hạn chót của lượt này, các bước tìm kiếm/xếp hạng chọn cách nhanh hơn khi sắp hết thời gian
+    deadline = Deadline()
     try:
         # Lấy thông tin người dùng và tin nhắn
         user = update.effective_user
@@ -174,15 +428,43 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         # Lấy trạng thái hiện tại của người dùng
         current_state = SessionManager.get_state(user_id)
+        set_turn_label("state", current_state.value)
         
-        # Kiểm tra nếu tin nhắn là "Gợi ý món ăn"
-        if user_message == "Gợi ý món ăn":
+        # Kiểm tra nếu tin nhắn là "Gợi ý món ăn" hoặc "Chọn tiêu chí mới"
+        if user_message in ("Gợi ý món ăn", NEW_CRITERIA_BUTTON):
             # Đặt lại trạng thái về IDLE
             SessionManager.reset_state(user_id)
             
             # Tạo phiên mới
             session_id = SessionManager.get_or_create_session(user_id)
             
+            # Người dùng quay lại: đề nghị dùng lại tiêu chí lần trước, không cần gọi Gemini
+            last_criteria = PreferenceStore.get_last_criteria(user_id) if user_message == "Gợi ý món ăn" else None
+            if last_criteria:
+                fast_path_message = f"Lần trước bạn đã chọn: {', '.join(last_criteria)}."
+                last_restaurant = PreferenceStore.get_last_restaurant(user_id)
+                if last_restaurant and last_restaurant.get("name"):
+                    fast_path_message += f" Tôi đã gợi ý quán {last_restaurant['name']}."
+                fast_path_message += (
+                    f"\n\nBạn muốn tìm giống lần trước không? Nhấn '{SAME_AS_LAST_BUTTON}' để tiếp tục "
+                    f"hoặc '{NEW_CRITERIA_BUTTON}' để nhập tiêu chí khác."
+                )
+                
+                # Lưu tin nhắn vào lịch sử
+                SessionManager.add_bot_message(user_id, fast_path_message)
+                
+                # Chuyển sang trạng thái xác nhận với tiêu chí lần trước
+                SessionManager.set_state(user_id, ConversationState.CONFIRMING_CRITERIA, last_criteria)
+                
+                # Tạo nút dùng lại, chọn mới và hủy
+                same_button = KeyboardButton(SAME_AS_LAST_BUTTON)
+                new_button = KeyboardButton(NEW_CRITERIA_BUTTON)
+                cancel_button = KeyboardButton("Hủy")
+                reply_markup = ReplyKeyboardMarkup([[same_button], [new_button, cancel_button]], resize_keyboard=True)
+                
+                await reply(update, fast_path_message, reply_markup=reply_markup)
+                return
+            
             # Thông báo bắt đầu quá trình gợi ý món ăn
             start_message = "Hãy cho tôi biết bạn muốn ăn gì? Bạn có thể nhập các tiêu chí như: nướng, cay, hải sản..."
             
@@ -196,50 +478,24 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             cancel_button = KeyboardButton("Hủy")
             reply_markup = ReplyKeyboardMarkup([[cancel_button]], resize_keyboard=True)
             
-            await update.message.reply_text(start_message, reply_markup=reply_markup)
+            await reply(update, start_message, reply_markup=reply_markup)
             return
         
         # Kiểm tra xem người dùng có đang yêu cầu gợi ý món ăn không
-        if current_state == ConversationState.IDLE and is_food_suggestion_request(user_message):
+        if current_state == ConversationState.IDLE and await asyncio.to_thread(is_food_suggestion_request, user_message):
             # Đặt lại trạng thái và tạo phiên mới để bắt đầu flow gợi ý món ăn
             SessionManager.reset_state(user_id)
             session_id = SessionManager.get_or_create_session(user_id)
             
             # Trích xuất tiêu chí từ tin nhắn ban đầu
-            initial_criteria = CriteriaProcessor.extract_criteria_from_message(user_message)
+            initial_criteria = await asyncio.to_thread(CriteriaProcessor.extract_criteria_from_message, user_message)
             
             # Nếu đã có tiêu chí trong tin nhắn ban đầu, chuyển thẳng sang trạng thái xác nhận
             if initial_criteria:
                 # Chuyển sang trạng thái xác nhận tiêu chí
                 SessionManager.set_state(user_id, ConversationState.CONFIRMING_CRITERIA, initial_criteria)
                 
-                # Lấy lịch sử hội thoại
-                conversation_history = SessionManager.get_formatted_history(user_id)
-                
-                # Gợi ý thêm tiêu chí nếu cần
-                suggested_criteria = []
-                if len(initial_criteria) < 3:
-                    suggested_criteria = CriteriaProcessor.generate_criteria_suggestions(
-                        initial_criteria, 
-                        conversation_history,
-                        max_suggestions=2
-                    )
-                
-                # Định dạng tiêu chí để xác nhận, kèm theo gợi ý (nhưng không thêm vào danh sách tiêu chí)
-                confirmation_message = CriteriaProcessor.format_criteria_for_confirmation(initial_criteria, suggested_criteria)
-                
-                # Lưu tin nhắn vào lịch sử
-                SessionManager.add_bot_message(user_id, confirmation_message)
-                
-                # Tạo nút xác nhận và hủy
-                confirm_button = KeyboardButton("Xác nhận")
-                cancel_button = KeyboardButton("Hủy")
-                reply_markup = ReplyKeyboardMarkup([[confirm_button, cancel_button]], resize_keyboard=True)
-                
-                # Xử lý markdown trước khi gửi
-                confirmation_message = remove_markdown(confirmation_message)
-                
-                await update.message.reply_text(confirmation_message, reply_markup=reply_markup)
+                await ask_criteria_confirmation(update, user_id, initial_criteria)
                 return
             else:
                 # Nếu không có tiêu chí, chuyển sang trạng thái thu thập tiêu chí
@@ -255,30 +511,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 cancel_button = KeyboardButton("Hủy")
                 reply_markup = ReplyKeyboardMarkup([[cancel_button]], resize_keyboard=True)
                 
-                await update.message.reply_text(criteria_prompt, reply_markup=reply_markup)
+                await reply(update, criteria_prompt, reply_markup=reply_markup)
                 return
         
         # Kiểm tra nếu người dùng muốn hủy quá trình
         if user_message.lower() == "hủy" and current_state != ConversationState.IDLE:
-            # Đặt lại trạng thái về IDLE
-            SessionManager.reset_state(user_id)
-            
-            cancel_message = "Đã hủy quá trình tìm kiếm. Bạn có thể hỏi tôi về việc gợi ý món ăn bất cứ lúc nào."
-            
-            # Lưu tin nhắn vào lịch sử
-            SessionManager.add_bot_message(user_id, cancel_message)
-            
-            # Tạo nút gợi ý món ăn
-            suggestion_button = KeyboardButton("Gợi ý món ăn")
-            reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
-            
-            await update.message.reply_text(cancel_message, reply_markup=reply_markup)
+            await cancel_search(update, user_id)
             return
         
         # Xử lý các trạng thái khác nhau của hội thoại
         if current_state == ConversationState.COLLECTING_CRITERIA:
             # Trích xuất tiêu chí từ tin nhắn
-            extracted_criteria = CriteriaProcessor.extract_criteria_from_message(user_message)
+            extracted_criteria = await asyncio.to_thread(CriteriaProcessor.extract_criteria_from_message, user_message)
             
             # Lấy tiêu chí hiện có (nếu có)
             current_criteria = SessionManager.get_criteria(user_id) or []
@@ -289,73 +533,25 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             # Cập nhật trạng thái với tiêu chí mới
             SessionManager.set_state(user_id, ConversationState.CONFIRMING_CRITERIA, updated_criteria)
             
-            # Lấy lịch sử hội thoại
-            conversation_history = SessionManager.get_formatted_history(user_id)
-            
-            # Gợi ý thêm tiêu chí nếu cần
-            suggested_criteria = []
-            if len(updated_criteria) < 3:
-                suggested_criteria = CriteriaProcessor.generate_criteria_suggestions(
-                    updated_criteria, 
-                    conversation_history,
-                    max_suggestions=2
-                )
-            
-            # Định dạng tiêu chí để xác nhận, kèm theo gợi ý (nhưng không thêm vào danh sách tiêu chí)
-            confirmation_message = CriteriaProcessor.format_criteria_for_confirmation(updated_criteria, suggested_criteria)
-            
-            # Lưu tin nhắn vào lịch sử
-            SessionManager.add_bot_message(user_id, confirmation_message)
-            
-            # Tạo nút xác nhận và hủy
-            confirm_button = KeyboardButton("Xác nhận")
-            cancel_button = KeyboardButton("Hủy")
-            reply_markup = ReplyKeyboardMarkup([[confirm_button, cancel_button]], resize_keyboard=True)
-            
-            # Xử lý markdown trước khi gửi
-            confirmation_message = remove_markdown(confirmation_message)
-            
-            await update.message.reply_text(confirmation_message, reply_markup=reply_markup)
+            await ask_criteria_confirmation(update, user_id, updated_criteria)
             return
         elif current_state == ConversationState.CONFIRMING_CRITERIA:
             # Lấy tiêu chí hiện có
             current_criteria = SessionManager.get_criteria(user_id) or []
             
+            # Người dùng quay lại nhấn nút tìm giống lần trước (luồng nhanh)
+            if user_message == SAME_AS_LAST_BUTTON:
+                await confirm_criteria(update, context, user_id, current_criteria, fast_path=True)
+                return
+            
             # Kiểm tra xem người dùng có xác nhận không
             if CriteriaProcessor.is_confirmation_message(user_message):
-                # Nếu không có tiêu chí nào, yêu cầu người dùng nhập lại
-                if not current_criteria:
-                    no_criteria_message = "Bạn chưa cung cấp tiêu chí nào. Vui lòng nhập tiêu chí để tôi có thể gợi ý món ăn phù hợp."
-                    
-                    # Lưu tin nhắn vào lịch sử
-                    SessionManager.add_bot_message(user_id, no_criteria_message)
-                    
-                    # Tạo nút hủy
-                    cancel_button = KeyboardButton("Hủy")
-                    reply_markup = ReplyKeyboardMarkup([[cancel_button]], resize_keyboard=True)
-                    
-                    await update.message.reply_text(no_criteria_message, reply_markup=reply_markup)
-                    return
-                
-                # Chuyển sang trạng thái chờ vị trí
-                SessionManager.set_state(user_id, ConversationState.WAITING_FOR_LOCATION, current_criteria)
-                
-                # Tạo nút chia sẻ vị trí và hủy
-                location_button = KeyboardButton("Chia sẻ vị trí", request_location=True)
-                cancel_button = KeyboardButton("Hủy")
-                reply_markup = ReplyKeyboardMarkup([[location_button], [cancel_button]], resize_keyboard=True)
-                
-                location_message = "Vui lòng chia sẻ vị trí của bạn để tôi có thể tìm quán ăn gần đó."
-                
-                # Lưu tin nhắn vào lịch sử
-                SessionManager.add_bot_message(user_id, location_message)
-                
-                await update.message.reply_text(location_message, reply_markup=reply_markup)
+                await confirm_criteria(update, context, user_id, current_criteria)
                 return
             else:
                 # Nếu không phải xác nhận, xử lý như tin nhắn thông thường
                 # Trích xuất tiêu chí từ tin nhắn
-                extracted_criteria = CriteriaProcessor.extract_criteria_from_message(user_message)
+                extracted_criteria = await asyncio.to_thread(CriteriaProcessor.extract_criteria_from_message, user_message)
                 
                 # Nếu không tìm thấy tiêu chí nào, yêu cầu người dùng nhập lại
                 if not extracted_criteria:
@@ -368,7 +564,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     cancel_button = KeyboardButton("Hủy")
                     reply_markup = ReplyKeyboardMarkup([[cancel_button]], resize_keyboard=True)
                     
-                    await update.message.reply_text(no_criteria_message, reply_markup=reply_markup)
+                    await reply(update, no_criteria_message, reply_markup=reply_markup)
                     return
                 
                 # Thêm tiêu chí mới vào danh sách
@@ -377,33 +573,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 # Cập nhật trạng thái với tiêu chí mới
                 SessionManager.set_state(user_id, ConversationState.CONFIRMING_CRITERIA, updated_criteria)
                 
-                # Lấy lịch sử hội thoại
-                conversation_history = SessionManager.get_formatted_history(user_id)
-                
-                # Gợi ý thêm tiêu chí nếu cần
-                suggested_criteria = []
-                if len(updated_criteria) < 3:
-                    suggested_criteria = CriteriaProcessor.generate_criteria_suggestions(
-                        updated_criteria, 
-                        conversation_history,
-                        max_suggestions=2
-                    )
-                
-                # Định dạng tiêu chí để xác nhận, kèm theo gợi ý (nhưng không thêm vào danh sách tiêu chí)
-                confirmation_message = CriteriaProcessor.format_criteria_for_confirmation(updated_criteria, suggested_criteria)
-                
-                # Lưu tin nhắn vào lịch sử
-                SessionManager.add_bot_message(user_id, confirmation_message)
-                
-                # Tạo nút xác nhận và hủy
-                confirm_button = KeyboardButton("Xác nhận")
-                cancel_button = KeyboardButton("Hủy")
-                reply_markup = ReplyKeyboardMarkup([[confirm_button, cancel_button]], resize_keyboard=True)
-                
-                # Xử lý markdown trước khi gửi
-                confirmation_message = remove_markdown(confirmation_message)
-                
-                await update.message.reply_text(confirmation_message, reply_markup=reply_markup)
+                await ask_criteria_confirmation(update, user_id, updated_criteria)
                 return
         elif current_state == ConversationState.WAITING_FOR_LOCATION:
             # Kiểm tra xem tin nhắn có chứa vị trí không
@@ -412,66 +582,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 latitude = update.message.location.latitude
                 longitude = update.message.location.longitude
                 
-                # Lấy tiêu chí hiện có
-                current_criteria = SessionManager.get_criteria(user_id) or []
-                
-                # Chuyển sang trạng thái xử lý
-                SessionManager.set_state(user_id, ConversationState.PROCESSING, current_criteria, (latitude, longitude))
-                
-                # Hiển thị trạng thái "đang nhập" để cải thiện trải nghiệm người dùng
-                await send_typing_action(update)
-                
-                # Thông báo đang xử lý
-                processing_message = "Đang tìm kiếm quán ăn phù hợp với tiêu chí của bạn..."
-                
-                # Lưu tin nhắn vào lịch sử
-                SessionManager.add_bot_message(user_id, processing_message)
-                
-                await update.message.reply_text(processing_message)
-                
-                # Tìm kiếm quán ăn gần vị trí
-                restaurants = LocationService.search_restaurants_by_coordinates(latitude, longitude, current_criteria)
-                
-                # Nếu tìm thấy quán ăn
-                if restaurants:
-                    # Xếp hạng quán ăn dựa trên tiêu chí
-                    ranked_restaurants = rank_restaurants_by_criteria(restaurants, current_criteria)
-                    
-                    # Lấy top 3 quán ăn
-                    top_restaurants = ranked_restaurants[:3]
-                    
-                    # Định dạng kết quả
-                    result_message = LocationService.format_restaurant_results(top_restaurants, current_criteria)
-                    
-                    # Lưu tin nhắn vào lịch sử
-                    SessionManager.add_bot_message(user_id, result_message)
-                    
-                    # Tạo nút gợi ý món ăn
-                    suggestion_button = KeyboardButton("Gợi ý món ăn")
-                    reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
-                    
-                    # Xử lý markdown trước khi gửi
-                    result_message = remove_markdown(result_message)
-                    
-                    await update.message.reply_text(result_message, reply_markup=reply_markup)
-                else:
-                    # Không tìm thấy quán ăn, sử dụng fallback
-                    fallback_message = FallbackHandler.handle_no_restaurants(current_criteria)
-                    
-                    # Lưu tin nhắn vào lịch sử
-                    SessionManager.add_bot_message(user_id, fallback_message)
-                    
-                    # Tạo nút gợi ý món ăn
-                    suggestion_button = KeyboardButton("Gợi ý món ăn")
-                    reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
-                    
-                    # Xử lý markdown trước khi gửi
-                    fallback_message = remove_markdown(fallback_message)
-                    
-                    await update.message.reply_text(fallback_message, reply_markup=reply_markup)
-                
-                # Đặt lại trạng thái về IDLE sau khi hoàn thành
-                SessionManager.reset_state(user_id)
+                await search_and_reply(update, context, user_id, latitude, longitude, deadline)
                 return
             else:
                 # Nếu không có vị trí, yêu cầu người dùng chia sẻ vị trí
@@ -485,7 +596,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 cancel_button = KeyboardButton("Hủy")
                 reply_markup = ReplyKeyboardMarkup([[location_button], [cancel_button]], resize_keyboard=True)
                 
-                await update.message.reply_text(location_reminder, reply_markup=reply_markup)
+                await reply(update, location_reminder, reply_markup=reply_markup)
                 return
         else:
             # Nếu không ở trong flow gợi ý món ăn, sử dụng Gemini để trả lời tin nhắn thông thường
@@ -496,26 +607,33 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             conversation_history = SessionManager.get_formatted_history(user_id)
             
             # Gọi Gemini để trả lời
-            response = get_model_response_with_history(client, SYSTEM_MESSAGE, conversation_history, user_message)
-            
-            # Lưu tin nhắn vào lịch sử
-            SessionManager.add_bot_message(user_id, response)
+            try:
+                response = await asyncio.to_thread(get_model_response_with_history, get_client(), SYSTEM_MESSAGE, conversation_history, user_message)
+                
+                # Lưu tin nhắn vào lịch sử
+                SessionManager.add_bot_message(user_id, response)
+            except LLMUnavailableError:
+                # Không lưu lời xin lỗi vào lịch sử để không ảnh hưởng các lượt sau
+                response = FallbackHandler.handle_api_error()
             
             # Tạo nút gợi ý món ăn
             suggestion_button = KeyboardButton("Gợi ý món ăn")
             reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
             
-            # Xử lý markdown trước khi gửi
-            response = remove_markdown(response)
-            
-            await update.message.reply_text(response, reply_markup=reply_markup)
+            await reply(update, response, reply_markup=reply_markup)
             return
     except Exception as e:
         logger.error(f"Lỗi khi xử lý tin nhắn: {e}")
         await handle_error(update, context, e)
+    finally:
+        # Tóm tắt hội thoại sau khi đã trả lời để không làm chậm phản hồi
+        schedule_history_summary(str(update.effective_user.id))
 
+@timed_turn("location")
 async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Xử lý khi người dùng chia sẻ vị trí."""
+    # Hạn chót của lượt này, các bước tìm kiếm/xếp hạng chọn cách nhanh hơn khi sắp hết thời gian
+    deadline = Deadline()
     try:
         # Lấy thông tin người dùng và vị trí
         user = update.effective_user
@@ -524,76 +642,66 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         # Lấy trạng thái hiện tại của người dùng
         current_state = SessionManager.get_state(user_id)
+        set_turn_label("state", current_state.value)
         
         # Chỉ xử lý nếu đang ở trạng thái chờ vị trí
         if current_state == ConversationState.WAITING_FOR_LOCATION:
-            # Lấy vị trí từ tin nhắn
-            latitude = location.latitude
-            longitude = location.longitude
-            
-            # Lấy tiêu chí hiện có
-            current_criteria = SessionManager.get_criteria(user_id) or []
-            
-            # Chuyển sang trạng thái xử lý
-            SessionManager.set_state(user_id, ConversationState.PROCESSING, current_criteria, (latitude, longitude))
-            
-            # Hiển thị trạng thái "đang nhập" để cải thiện trải nghiệm người dùng
-            await send_typing_action(update)
-            
-            # Thông báo đang xử lý
-            processing_message = "Đang tìm kiếm quán ăn phù hợp với tiêu chí của bạn..."
-            
-            # Lưu tin nhắn vào lịch sử
-            SessionManager.add_bot_message(user_id, processing_message)
-            
-            await update.message.reply_text(processing_message)
-            
-            # Tìm kiếm quán ăn gần vị trí
-            restaurants = LocationService.search_restaurants_by_coordinates(latitude, longitude, current_criteria)
-            
-            # Nếu tìm thấy quán ăn
-            if restaurants:
-                # Xếp hạng quán ăn dựa trên tiêu chí
-                ranked_restaurants = rank_restaurants_by_criteria(restaurants, current_criteria)
-                
-                # Lấy top 3 quán ăn
-                top_restaurants = ranked_restaurants[:3]
-                
-                # Định dạng kết quả
-                result_message = LocationService.format_restaurant_results(top_restaurants, current_criteria)
-                
-                # Lưu tin nhắn vào lịch sử
-                SessionManager.add_bot_message(user_id, result_message)
-                
-                # Tạo nút gợi ý món ăn
-                suggestion_button = KeyboardButton("Gợi ý món ăn")
-                reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
-                
-                # Xử lý markdown trước khi gửi
-                result_message = remove_markdown(result_message)
-                
-                await update.message.reply_text(result_message, reply_markup=reply_markup)
-            else:
-                # Không tìm thấy quán ăn, sử dụng fallback
-                fallback_message = FallbackHandler.handle_no_restaurants(current_criteria)
-                
-                # Lưu tin nhắn vào lịch sử
-                SessionManager.add_bot_message(user_id, fallback_message)
-                
-                # Tạo nút gợi ý món ăn
-                suggestion_button = KeyboardButton("Gợi ý món ăn")
-                reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
-                
-                # Xử lý markdown trước khi gửi
-                fallback_message = remove_markdown(fallback_message)
-                
-                await update.message.reply_text(fallback_message, reply_markup=reply_markup)
-            
-            # Đặt lại trạng thái về IDLE sau khi hoàn thành
-            SessionManager.reset_state(user_id)
+            await search_and_reply(update, context, user_id, location.latitude, location.longitude, deadline)
     except Exception as e:
         logger.error(f"Lỗi khi xử lý vị trí: {e}")
         await handle_error(update, context, e)
+    finally:
+        # Tóm tắt hội thoại sau khi đã trả lời để không làm chậm phản hồi
+        schedule_history_summary(str(update.effective_user.id))
+
+@timed_turn("criteria_callback")
+async def handle_criteria_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Xử lý các nút của bàn phím chọn tiêu chí: bật/tắt tiêu chí, xác nhận hoặc hủy, không gọi Gemini."""
+    query = update.callback_query
+    try:
+        user_id = str(update.effective_user.id)
+        action, index = CriteriaEditor.parse_callback(query.data)
+        
+        # Lấy trạng thái hiện tại của người dùng
+        current_state = SessionManager.get_state(user_id)
+        set_turn_label("state", current_state.value)
+        
+        # Bàn phím của lượt tìm kiếm đã kết thúc hoặc tin nhắn quá cũ để sửa
+        accessible = query.message is not None and query.message.is_accessible
+        if current_state != ConversationState.CONFIRMING_CRITERIA or not accessible:
+            await query.answer("Danh sách tiêu chí này đã hết hạn.")
+            if accessible:
+                await scheduler.send(update.effective_chat.id, lambda: query.edit_message_reply_markup(None))
+            return
+        
+        await query.answer()
+        current_criteria = SessionManager.get_criteria(user_id) or []
+        
+        if action == "toggle":
+            options = CriteriaEditor.keyboard_options(query.message.reply_markup)
+            if index >= len(options):
+                return
+            
+            # Cập nhật tiêu chí và sửa tin nhắn tại chỗ
+            updated_criteria = CriteriaEditor.toggle(current_criteria, options[index])
+            SessionManager.set_state(user_id, ConversationState.CONFIRMING_CRITERIA, updated_criteria)
+            await edit_message(update, criteria_editor_text(updated_criteria), CriteriaEditor.build_keyboard(updated_criteria, options))
+            return
+        
+        # Xác nhận hoặc hủy: bỏ bàn phím và xử lý như khi người dùng nhắn tin
+        await edit_message(update, criteria_editor_text(current_criteria))
+        if action == "confirm":
+            SessionManager.add_user_message(user_id, "Xác nhận")
+            await confirm_criteria(update, context, user_id, current_criteria)
+        else:
+            SessionManager.add_user_message(user_id, "Hủy")
+            await cancel_search(update, user_id)
+    except Exception as e:
+        logger.error(f"Lỗi khi xử lý nút tiêu chí: {e}")
+        await handle_error(update, context, e)
+    finally:
+        # Tóm tắt hội thoại sau khi đã trả lời để không làm chậm phản hồi
+        schedule_history_summary(str(update.effective_user.id))
 
 async def handle_error(update: Update, context: ContextTypes.DEFAULT_TYPE, error: Exception = None) -> None:
     """Xử lý lỗi và gửi thông báo lỗi đến người dùng."""
@@ -615,25 +723,46 @@ async def handle_error(update: Update, context: ContextTypes.DEFAULT_TYPE, error
         suggestion_button = KeyboardButton("Gợi ý món ăn")
         reply_markup = ReplyKeyboardMarkup([[suggestion_button]], resize_keyboard=True)
         
-        # Xử lý markdown trước khi gửi
-        error_message = remove_markdown(error_message)
-        
-        await update.message.reply_text(error_message, reply_markup=reply_markup)
+        await reply(update, error_message, reply_markup=reply_markup)
     except Exception as e:
         logger.error(f"Lỗi khi xử lý lỗi: {e}")
 
-def run_bot() -> None:
-    """Khởi động bot."""
-    # Tạo ứng dụng
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
-
-    # Thêm các handler
+def register_handlers(application: Application) -> None:
+    """
+    Đăng ký các handler của bot vào ứng dụng
+    
+    Args:
+        application: Ứng dụng Telegram
+    """
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("reset", reset_command))
     application.add_handler(MessageHandler(filters.LOCATION, handle_location))
+    application.add_handler(CallbackQueryHandler(handle_criteria_callback, pattern=CALLBACK_PATTERN))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+async def flush_journal(application: Application) -> None:
+    """Ghi nốt các tin nhắn và trạng thái còn trong journal khi dừng bot."""
+    if not await asyncio.to_thread(journal.flush, DB_JOURNAL_SHUTDOWN_TIMEOUT):
+        logger.error("Journal chưa ghi xong hoặc đã bỏ bản ghi khi dừng bot")
+
+def build_application() -> Application:
+    """Tạo ứng dụng Telegram với đầy đủ các handler."""
+    application = Application.builder().token(TELEGRAM_TOKEN).post_shutdown(flush_journal).build()
+    register_handlers(application)
+    return application
+
+def run_bot() -> None:
+    """Khởi động bot."""
+    # Tạo ứng dụng
+    application = build_application()
+    
+    # Xuất số liệu Prometheus nếu được bật (METRICS_ENABLED)
+    start_metrics_server()
+    
+    # Dọn dữ liệu quá hạn trong khung giờ bảo trì nếu được bật (DB_RETENTION_ENABLED)
+    start_retention_thread()
+
     # Chạy bot cho đến khi người dùng nhấn Ctrl-C
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
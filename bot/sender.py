@@ -0,0 +1,291 @@
+import os
+import time
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from telegram.error import RetryAfter
+from metrics.main import inc, span
+
+logger = logging.getLogger(__name__)
+
+# Giới hạn gửi của Telegram: khoảng 30 tin nhắn/giây cho cả bot và khoảng 1 tin nhắn/giây
+# cho mỗi cuộc trò chuyện (cho phép gửi dồn vài tin). Đặt tốc độ bằng 0 để bỏ giới hạn.
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "28"))
+TELEGRAM_GLOBAL_BURST = int(os.getenv("TELEGRAM_GLOBAL_BURST", "28"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+# Trạng thái 'đang nhập' hiển thị khoảng 5 giây, không gửi lại trong khoảng thời gian này
+TELEGRAM_TYPING_INTERVAL_S = float(os.getenv("TELEGRAM_TYPING_INTERVAL_S", "4"))
+# Số lần gửi lại khi Telegram trả về RetryAfter (429)
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "3"))
+
+# Làn ưu tiên: tin nhắn trả lời được gửi trước trạng thái 'đang nhập'
+PRIORITY_MESSAGE = 0
+PRIORITY_TYPING = 1
+
+# Số cuộc trò chuyện tối đa được giữ bộ giới hạn tốc độ khi không có tin nhắn chờ gửi
+_MAX_IDLE_CHATS = 10000
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    """Thời gian chờ (giây) của lỗi RetryAfter, retry_after có thể là số giây hoặc timedelta"""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+class _Bucket:
+    """Token bucket không chặn, dùng trong event loop"""
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = now
+        # Không cấp token trước thời điểm này (sau lỗi RetryAfter)
+        self.paused_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Số giây cần chờ đến khi có token, 0 nếu có thể gửi ngay"""
+        if self.rate <= 0:
+            return max(0.0, self.paused_until - now)
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        wait = (1 - self._tokens) / self.rate if self._tokens < 1 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def take(self) -> None:
+        """Lấy một token (gọi sau khi wait_time trả về 0)"""
+        if self.rate > 0:
+            self._tokens -= 1
+
+    def is_idle(self, now: float) -> bool:
+        """Bucket đã đầy và không bị tạm dừng, có thể bỏ đi mà không ảnh hưởng giới hạn"""
+        return self.wait_time(now) == 0 and self._tokens >= self.capacity
+
+class _Job:
+    """Một lần gửi đang chờ trong hàng đợi"""
+
+    __slots__ = ("priority", "sequence", "chat_id", "send", "future", "attempts")
+
+    def __init__(self, priority: int, sequence: int, chat_id: Any, send: Callable[[], Awaitable[Any]], future: asyncio.Future):
+        self.priority = priority
+        self.sequence = sequence
+        self.chat_id = chat_id
+        self.send = send
+        self.future = future
+        self.attempts = 0
+
+    def sort_key(self):
+        return (self.priority, self.sequence)
+
+class OutboundScheduler:
+    """
+    Lập lịch gửi tin nhắn ra Telegram theo giới hạn tốc độ của cả bot và của từng cuộc trò chuyện
+
+    Các lần gửi được đưa vào hàng đợi và được một task nền gửi đi theo thứ tự ưu tiên
+    (tin nhắn trước, trạng thái 'đang nhập' sau), giữ đúng thứ tự trong mỗi cuộc trò chuyện.
+    Cuộc trò chuyện đã hết lượt gửi không chặn các cuộc trò chuyện khác. Khi Telegram trả về
+    RetryAfter, việc gửi (của cả bot) bị tạm dừng đúng thời gian yêu cầu rồi tin nhắn được gửi lại.
+
+    Trong chế độ đa tiến trình, mỗi worker dùng một phần giới hạn chung (xem configure).
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, global_burst: int = TELEGRAM_GLOBAL_BURST,
+                 chat_rate: float = TELEGRAM_CHAT_RATE, chat_burst: int = TELEGRAM_CHAT_BURST):
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reset()
+
+    def configure(self, global_rate: Optional[float] = None, global_burst: Optional[int] = None,
+                  chat_rate: Optional[float] = None, chat_burst: Optional[int] = None) -> None:
+        """Thay đổi giới hạn tốc độ; các tham số None giữ nguyên giá trị hiện tại"""
+        self.global_rate = global_rate if global_rate is not None else self.global_rate
+        self.global_burst = global_burst if global_burst is not None else self.global_burst
+        self.chat_rate = chat_rate if chat_rate is not None else self.chat_rate
+        self.chat_burst = chat_burst if chat_burst is not None else self.chat_burst
+        now = time.monotonic()
+        self._global = _Bucket(self.global_rate, self.global_burst, now)
+        self._chats.clear()
+
+    def _reset(self) -> None:
+        """Tạo mới trạng thái của hàng đợi (khi khởi tạo hoặc khi chạy trong event loop mới)"""
+        self._global = _Bucket(self.global_rate, self.global_burst, time.monotonic())
+        self._chats: Dict[Any, _Bucket] = {}
+        self._jobs: List[_Job] = []
+        self._sequence = 0
+        # Cuộc trò chuyện đang có một lần gửi chưa xong, để giữ thứ tự tin nhắn
+        self._sending: Set[Any] = set()
+        # Cuộc trò chuyện đang có trạng thái 'đang nhập' chờ gửi và thời điểm gửi gần nhất
+        self._typing_pending: Set[Any] = set()
+        self._typing_sent: Dict[Any, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self) -> None:
+        """Khởi động task gửi trong event loop hiện tại"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Event loop mới (ví dụ: mỗi lần asyncio.run), hàng đợi cũ không còn dùng được
+            self._reset()
+            self._loop = loop
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run(), name="telegram-sender")
+
+    def _enqueue(self, chat_id: Any, send: Callable[[], Awaitable[Any]], priority: int) -> asyncio.Future:
+        self._ensure_started()
+        self._sequence += 1
+        future = self._loop.create_future()
+        self._jobs.append(_Job(priority, self._sequence, chat_id, send, future))
+        self._jobs.sort(key=_Job.sort_key)
+        self._wakeup.set()
+        return future
+
+    async def send(self, chat_id: Any, send: Callable[[], Awaitable[Any]], priority: int = PRIORITY_MESSAGE) -> Any:
+        """
+        Gửi một tin nhắn theo giới hạn tốc độ và chờ đến khi gửi xong
+
+        Args:
+            chat_id: ID cuộc trò chuyện
+            send: Hàm tạo coroutine gửi tin nhắn (ví dụ: lambda: message.reply_text(text))
+            priority: Làn ưu tiên (PRIORITY_MESSAGE hoặc PRIORITY_TYPING)
+
+        Returns:
+            Kết quả của coroutine gửi tin nhắn
+        """
+        # Đo cả thời gian chờ trong hàng đợi, là độ trễ mà người dùng thấy
+        with span("telegram_send"):
+            return await self._enqueue(chat_id, send, priority)
+
+    def send_typing(self, chat_id: Any, send: Callable[[], Awaitable[Any]]) -> None:
+        """
+        Đưa trạng thái 'đang nhập' vào hàng đợi mà không chờ gửi xong
+
+        Bỏ qua nếu cuộc trò chuyện đã có trạng thái 'đang nhập' chờ gửi, hoặc vừa được gửi
+        trong TELEGRAM_TYPING_INTERVAL_S giây mà chưa có tin nhắn nào xóa nó.
+        """
+        self._ensure_started()
+        last_sent = self._typing_sent.get(chat_id)
+        if chat_id in self._typing_pending or (last_sent is not None and time.monotonic() - last_sent < TELEGRAM_TYPING_INTERVAL_S):
+            inc("telegram_typing_coalesced_total")
+            return
+
+        self._typing_pending.add(chat_id)
+        future = self._enqueue(chat_id, send, PRIORITY_TYPING)
+        future.add_done_callback(self._log_typing_error)
+
+    @staticmethod
+    def _log_typing_error(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Lỗi khi gửi trạng thái đang nhập: {future.exception()}")
+
+    def _chat_bucket(self, chat_id: Any, now: float) -> _Bucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= _MAX_IDLE_CHATS:
+                self._prune_chats(now)
+            bucket = self._chats[chat_id] = _Bucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    def _prune_chats(self, now: float) -> None:
+        """Bỏ bộ giới hạn của các cuộc trò chuyện đã hồi đầy token"""
+        active = {job.chat_id for job in self._jobs} | self._sending
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if chat_id not in active and bucket.is_idle(now)]:
+            del self._chats[chat_id]
+            self._typing_sent.pop(chat_id, None)
+
+    def _next_job(self, now: float) -> Optional[float]:
+        """
+        Chọn lần gửi tiếp theo có thể gửi ngay và bắt đầu gửi
+
+        Returns:
+            None nếu đã bắt đầu một lần gửi, ngược lại là số giây cần chờ
+            (vô hạn nếu chỉ còn các cuộc trò chuyện đang gửi)
+        """
+        global_wait = self._global.wait_time(now)
+        if global_wait > 0:
+            return global_wait
+
+        wait = float("inf")
+        blocked: Set[Any] = set()
+        self._jobs = [job for job in self._jobs if not job.future.cancelled()]
+        for index, job in enumerate(self._jobs):
+            # Lần gửi đầu tiên của mỗi cuộc trò chuyện chặn các lần gửi sau của cuộc trò chuyện đó
+            if job.chat_id in blocked:
+                continue
+            blocked.add(job.chat_id)
+            if job.chat_id in self._sending:
+                continue
+            bucket = self._chat_bucket(job.chat_id, now)
+            chat_wait = bucket.wait_time(now)
+            if chat_wait > 0:
+                wait = min(wait, chat_wait)
+                continue
+
+            bucket.take()
+            self._global.take()
+            del self._jobs[index]
+            self._sending.add(job.chat_id)
+            self._loop.create_task(self._deliver(job))
+            return None
+        return wait
+
+    async def _run(self) -> None:
+        """Vòng lặp của task gửi: gửi các tin nhắn khi có token"""
+        while True:
+            self._wakeup.clear()
+            wait = self._next_job(time.monotonic())
+            if wait is None:
+                continue
+            if wait == float("inf"):
+                await self._wakeup.wait()
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, job: _Job) -> None:
+        """Gửi một tin nhắn, tạm dừng cuộc trò chuyện và đưa lại vào hàng đợi khi gặp RetryAfter"""
+        try:
+            job.attempts += 1
+            result = await job.send()
+        except RetryAfter as e:
+            delay = _retry_after_seconds(e)
+            inc("telegram_retry_after_total")
+            # Trạng thái 'đang nhập' không quan trọng, bỏ qua thay vì gửi lại
+            if job.priority == PRIORITY_MESSAGE and job.attempts <= TELEGRAM_SEND_RETRIES:
+                logger.warning(f"Telegram yêu cầu chờ {delay}s trước khi gửi tiếp đến {job.chat_id}")
+                paused_until = time.monotonic() + delay
+                self._chat_bucket(job.chat_id, time.monotonic()).paused_until = paused_until
+                # RetryAfter thường do vượt giới hạn chung của bot: tạm dừng cả các cuộc trò chuyện
+                # khác, để không nhận thêm lỗi 429 trong lúc chờ
+                self._global.paused_until = max(self._global.paused_until, paused_until)
+                self._jobs.append(job)
+                self._jobs.sort(key=_Job.sort_key)
+            elif not job.future.done():
+                job.future.set_exception(e)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if job.priority == PRIORITY_TYPING:
+                self._typing_sent[job.chat_id] = time.monotonic()
+            else:
+                # Tin nhắn mới xóa trạng thái 'đang nhập' trên Telegram
+                self._typing_sent.pop(job.chat_id, None)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._sending.discard(job.chat_id)
+            if job.priority == PRIORITY_TYPING:
+                self._typing_pending.discard(job.chat_id)
+            self._wakeup.set()
+
+# Bộ lập lịch gửi dùng chung trong tiến trình
+scheduler = OutboundScheduler()
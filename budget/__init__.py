@@ -0,0 +1,2 @@
+# Per-turn time budget package
+from .main import Deadline
\ No newline at end of file
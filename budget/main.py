@@ -0,0 +1,62 @@
+import os
+import time
+import logging
+from typing import Optional
+from metrics.main import inc
+
+logger = logging.getLogger(__name__)
+
+# Thời gian tối đa (giây) của một lượt hội thoại, tính từ khi nhận update đến khi trả lời
+TURN_SLO_S = float(os.getenv("TURN_SLO_S", "20"))
+# Thời gian giữ lại để gửi câu trả lời
+BUDGET_REPLY_RESERVE_S = float(os.getenv("BUDGET_REPLY_RESERVE_S", "1"))
+# Thời gian còn lại tối thiểu để gọi mạng (Overpass); ít hơn thì chỉ dùng kết quả đã lưu
+BUDGET_NETWORK_MIN_S = float(os.getenv("BUDGET_NETWORK_MIN_S", "2"))
+# Thời gian còn lại tối thiểu để mở rộng bán kính tìm kiếm
+BUDGET_RADIUS_EXPANSION_S = float(os.getenv("BUDGET_RADIUS_EXPANSION_S", "8"))
+# Thời gian còn lại tối thiểu để gọi LLM (xếp hạng, gợi ý món ăn)
+BUDGET_LLM_MIN_S = float(os.getenv("BUDGET_LLM_MIN_S", "4"))
+
+class Deadline:
+    """
+    Hạn chót của một lượt hội thoại
+    
+    Được tạo cho mỗi update và truyền qua các bước xử lý. Mỗi bước hỏi thời gian còn
+    lại để chọn cách làm rẻ hơn (bỏ mở rộng bán kính, chỉ dùng cache, bỏ xếp hạng
+    bằng LLM) và giới hạn thời gian chờ của các lần gọi mạng.
+    """
+    
+    __slots__ = ("expires_at",)
+    
+    def __init__(self, seconds: float = TURN_SLO_S):
+        self.expires_at = time.monotonic() + seconds
+    
+    def remaining(self) -> float:
+        """Số giây còn lại (không âm)"""
+        return max(0.0, self.expires_at - time.monotonic())
+    
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+    
+    def allows(self, seconds: float, stage: str) -> bool:
+        """
+        Kiểm tra còn đủ thời gian cho một bước hay không, ghi nhận khi phải bỏ qua
+        
+        Args:
+            seconds: Thời gian tối thiểu cần còn lại
+            stage: Tên bước (dùng cho log và số liệu)
+        """
+        if self.remaining() - BUDGET_REPLY_RESERVE_S >= seconds:
+            return True
+        logger.warning(f"Không đủ thời gian cho bước {stage} (còn {self.remaining():.1f}s), dùng cách xử lý nhanh hơn")
+        inc("budget_degraded_total", stage=stage)
+        return False
+    
+    def timeout(self, default: float) -> float:
+        """Thời gian chờ cho một lần gọi: không vượt quá default và thời gian còn lại trừ phần dành để trả lời"""
+        return max(0.1, min(default, self.remaining() - BUDGET_REPLY_RESERVE_S))
+    
+    @staticmethod
+    def timeout_for(deadline: Optional["Deadline"], default: float) -> float:
+        """Như timeout(), trả về default nếu không có hạn chót"""
+        return default if deadline is None else deadline.timeout(default)
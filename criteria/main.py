@@ -1,6 +1,8 @@
 import logging
 from typing import List, Dict, Any, Optional
-from llm.main import get_model_response, client
+from llm.main import get_model_response, get_structured_response, get_client, PromptBudget, MicroBatcher, CRITERIA_SCHEMA
+from metrics.main import timed
+from render.templates import CRITERIA_CHOICES, criteria_suggestions
 from prompts.criteria import (
     SUGGEST_CRITERIA_SYSTEM,
     SUGGEST_CRITERIA_USER,
@@ -10,8 +12,6 @@ from prompts.criteria import (
     CONFIRM_CRITERIA_USER
 )
 
-# Cấu hình logging
-logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Danh sách các tiêu chí phổ biến
@@ -21,10 +21,14 @@ COMMON_CRITERIA = [
     "bình dân", "Việt Nam", "Trung Quốc", "Nhật Bản", "Hàn Quốc", "Thái Lan", "Ý", "Pháp"
 ]
 
+# Gom các yêu cầu trích xuất tiêu chí của nhiều người dùng (xem LLM_BATCH_WINDOW_MS)
+_extract_batcher = MicroBatcher("extract_criteria", EXTRACT_CRITERIA_SYSTEM, CRITERIA_SCHEMA)
+
 class CriteriaProcessor:
     """Xử lý tiêu chí món ăn"""
     
     @staticmethod
+    @timed("criteria_extraction")
     def extract_criteria_from_message(message: str) -> List[str]:
         """
         Trích xuất tiêu chí từ tin nhắn của người dùng
@@ -38,10 +42,10 @@ class CriteriaProcessor:
         try:
             # Sử dụng Gemini để trích xuất tiêu chí
             user_message = EXTRACT_CRITERIA_USER.format(message=message)
-            response = get_model_response(client, EXTRACT_CRITERIA_SYSTEM, user_message)
+            result = _extract_batcher.submit(user_message)
             
             # Xử lý kết quả
-            extracted_criteria = [line.strip() for line in response.strip().split('\n') if line.strip()]
+            extracted_criteria = [criterion.strip() for criterion in result["criteria"] if criterion.strip()]
             
             # Nếu không tìm thấy tiêu chí nào, sử dụng phương pháp đơn giản
             if not extracted_criteria:
@@ -102,6 +106,7 @@ class CriteriaProcessor:
         return available_criteria[:max_suggestions]
     
     @staticmethod
+    @timed("criteria_suggestions")
     def generate_criteria_suggestions(current_criteria: List[str], conversation_history: List[Dict[str, str]], max_suggestions: int = 2) -> List[str]:
         """
         Sử dụng Gemini để gợi ý thêm tiêu chí dựa trên lịch sử hội thoại
@@ -115,11 +120,8 @@ class CriteriaProcessor:
             Danh sách các tiêu chí được gợi ý thêm
         """
         try:
-            # Chuyển đổi lịch sử hội thoại thành văn bản
-            conversation_text = ""
-            for message in conversation_history:
-                role = "User" if message["role"] == "user" else "Bot"
-                conversation_text += f"{role}: {message['content']}\n\n"
+            # Chuyển đổi lịch sử hội thoại thành văn bản (trong giới hạn ngân sách token)
+            conversation_text = PromptBudget.format_history_text(conversation_history)
             
             # Chuẩn bị thông tin tiêu chí hiện có
             current_criteria_text = ', '.join(current_criteria) if current_criteria else 'Chưa có tiêu chí nào'
@@ -132,10 +134,10 @@ class CriteriaProcessor:
             )
             
             # Gọi Gemini để gợi ý
-            response = get_model_response(client, SUGGEST_CRITERIA_SYSTEM, user_message)
+            result = get_structured_response(get_client(), SUGGEST_CRITERIA_SYSTEM, user_message, "criteria", CRITERIA_SCHEMA, "criteria_suggestions")
             
             # Xử lý kết quả
-            suggested_criteria = [line.strip() for line in response.strip().split('\n') if line.strip()]
+            suggested_criteria = [criterion.strip() for criterion in result["criteria"] if criterion.strip()]
             
             # Giới hạn số lượng gợi ý
             return suggested_criteria[:max_suggestions]
@@ -146,6 +148,7 @@ class CriteriaProcessor:
             return CriteriaProcessor.suggest_additional_criteria(current_criteria, max_suggestions)
     
     @staticmethod
+    @timed("criteria_confirmation")
     def format_criteria_for_confirmation(criteria: List[str], suggested_criteria: List[str] = None) -> str:
         """
         Định dạng danh sách tiêu chí để xác nhận
@@ -166,17 +169,14 @@ class CriteriaProcessor:
             user_message = CONFIRM_CRITERIA_USER.format(criteria=', '.join(criteria))
             
             # Gọi Gemini để định dạng
-            response = get_model_response(client, CONFIRM_CRITERIA_SYSTEM, user_message)
-            
-            # Thêm tiêu chí gợi ý nếu có
-            if suggested_criteria and len(suggested_criteria) > 0:
-                response += f"\n\nTôi cũng gợi ý thêm các tiêu chí: {', '.join(suggested_criteria)}"
-                response += "\nBạn có thể nhập thêm các tiêu chí này nếu muốn."
+            response = get_model_response(get_client(), CONFIRM_CRITERIA_SYSTEM, user_message, task="confirmation")
             
-            # Thêm hướng dẫn rõ ràng về hai lựa chọn
-            response += "\n\n**Bạn có thể:**\n1. Nhấn nút 'Xác nhận' hoặc gõ 'xác nhận' để tiếp tục\n2. Hoặc nhập thêm tiêu chí nếu bạn muốn"
-            
-            return response
+            # Thêm tiêu chí gợi ý nếu có và hướng dẫn rõ ràng về hai lựa chọn
+            parts = [response]
+            if suggested_criteria:
+                parts.append(criteria_suggestions(suggested_criteria))
+            parts.append(CRITERIA_CHOICES)
+            return "".join(parts)
             
         except Exception as e:
             logger.error(f"Lỗi khi định dạng tiêu chí: {e}")
@@ -186,12 +186,7 @@ class CriteriaProcessor:
             if suggested_criteria and len(suggested_criteria) > 0:
                 suggested_text = f"\n\nTôi cũng gợi ý thêm các tiêu chí: {', '.join(suggested_criteria)}"
             
-            return (
-                f"Tiêu chí bạn đã chọn: {criteria_text}{suggested_text}\n\n"
-                "**Bạn có thể:**\n"
-                "1. Nhấn nút 'Xác nhận' hoặc gõ 'xác nhận' để tiếp tục\n"
-                "2. Hoặc nhập thêm tiêu chí nếu bạn muốn"
-            )
+            return f"Tiêu chí bạn đã chọn: {criteria_text}{suggested_text}{CRITERIA_CHOICES}"
     
     @staticmethod
     def is_confirmation_message(message: str) -> bool:
@@ -204,7 +199,7 @@ class CriteriaProcessor:
         Returns:
             True nếu là xác nhận, False nếu không
         """
-        confirmation_keywords = ["xác nhận", "đồng ý", "ok", "được", "tiếp tục", "yes", "có"]
+        confirmation_keywords = ["xác nhận", "đồng ý", "ok", "được", "tiếp tục", "yes", "có", "như lần trước"]
         message_lower = message.lower()
         
         for keyword in confirmation_keywords:
@@ -1,5 +1,4 @@
 # Database package 
 from .main import get_connection, init_database
 
-# Khởi tạo cơ sở dữ liệu khi module được import
-init_database()
+# Cơ sở dữ liệu được khởi tạo khi mở kết nối đầu tiên (xem get_connection)
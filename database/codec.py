@@ -0,0 +1,76 @@
+import os
+import zlib
+from typing import Union
+
+# Nén nội dung tin nhắn dài hơn DB_COMPRESS_MIN_BYTES byte (0 để tắt nén)
+DB_COMPRESS_MIN_BYTES = int(os.getenv("DB_COMPRESS_MIN_BYTES", "160"))
+DB_COMPRESS_LEVEL = int(os.getenv("DB_COMPRESS_LEVEL", "6"))
+
+# Từ điển nén (preset dictionary) phiên bản 1, viết tay. Chỉ còn dùng để giải nén dữ liệu
+# đã nén bằng _FORMAT_ZLIB_V1; KHÔNG được sửa vì dữ liệu đã nén cần đúng từ điển để giải nén.
+_ZDICT_V1 = "".join((
+    "Tôi là trợ lý AI giúp bạn tìm món ăn phù hợp. Đây là cách sử dụng:\n\n",
+    "1. Hỏi tôi về việc gợi ý món ăn hoặc tìm quán ăn\n",
+    "2. Nhập các tiêu chí món ăn (ví dụ: nướng, cay, hải sản...)\n",
+    "3. Xác nhận tiêu chí bằng cách nhắn 'xác nhận'\n4. Chia sẻ vị trí của bạn\n",
+    "5. Nhận gợi ý món ăn phù hợp\n\nBạn có thể nhắn /reset để bắt đầu lại quá trình tìm kiếm.",
+    "Xin lỗi, tôi đang gặp sự cố khi kết nối với máy chủ. Vui lòng thử lại sau.\n\n",
+    "Trong khi chờ đợi, bạn có thể thử lại với các tiêu chí khác hoặc chia sẻ vị trí khác.",
+    "Để tôi có thể gợi ý quán ăn gần bạn, vui lòng chia sẻ vị trí của bạn.\n\n",
+    "Bạn có thể sử dụng nút 'Chia sẻ vị trí' bên dưới hoặc nhập địa chỉ của bạn.",
+    "Tôi không thể tìm thấy quán ăn nào gần vị trí của bạn dựa trên tiêu chí (",
+    "Tuy nhiên, tôi có thể gợi ý một số món ăn phù hợp với tiêu chí của bạn:\n\n",
+    "Hãy cho tôi biết bạn muốn ăn gì? Bạn có thể nhập các tiêu chí như: nướng, cay, hải sản...",
+    "Tiêu chí bạn đã chọn: ",
+    "\n\nTôi cũng gợi ý thêm các tiêu chí: ",
+    "\nBạn có thể nhập thêm các tiêu chí này nếu muốn.",
+    "\n\n**Bạn có thể:**\n1. Nhấn nút 'Xác nhận' hoặc gõ 'xác nhận' để tiếp tục\n2. Hoặc nhập thêm tiêu chí nếu bạn muốn",
+    "Loại: vietnamese\nGiờ mở cửa: Mo-Su 06:00-22:00\nĐiện thoại: +84 \nWebsite: https://",
+    "Dựa trên tiêu chí của bạn (",
+    "), đây là top 5 quán ăn gần bạn:\n\n",
+    "#1: Tên: Quán \nĐịa chỉ: Đường , Phường , Quận , Thành phố Hồ Chí Minh\nKhoảng cách: m\n\n",
+    "#2: Tên: Nhà hàng \nĐịa chỉ: Phố , Hà Nội\nKhoảng cách: m\n\n",
+    "\n\nBạn có thể hỏi tôi về việc gợi ý món ăn bất cứ lúc nào.",
+)).encode("utf-8")
+
+# Từ điển phiên bản 2, dựng bằng python -m database.zdict --output database/zdict_v2.txt.
+# Cũng KHÔNG được sửa file này; khi cần từ điển mới, ghi ra zdict_v3.txt và thêm mã định dạng mới.
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "zdict_v2.txt"), "rb") as _file:
+    _ZDICT_V2 = _file.read()
+
+# Mã định dạng ở byte đầu tiên của nội dung đã nén, mỗi mã ứng với một từ điển
+_FORMAT_ZLIB_V1 = 1
+_FORMAT_ZLIB_V2 = 2
+_ZDICTS = {_FORMAT_ZLIB_V1: _ZDICT_V1, _FORMAT_ZLIB_V2: _ZDICT_V2}
+# Nội dung mới được nén bằng từ điển mới nhất
+_FORMAT_CURRENT = _FORMAT_ZLIB_V2
+
+def encode_content(content: str) -> Union[str, bytes]:
+    """
+    Mã hóa nội dung tin nhắn để lưu vào cột content
+
+    Tin nhắn ngắn được giữ nguyên dạng TEXT. Tin nhắn dài được nén bằng zlib với từ điển
+    mới nhất và lưu dạng BLOB, byte đầu tiên là mã định dạng (cho biết từ điển đã dùng).
+    """
+    if not DB_COMPRESS_MIN_BYTES:
+        return content
+
+    raw = content.encode("utf-8")
+    if len(raw) < DB_COMPRESS_MIN_BYTES:
+        return content
+
+    # wbits âm: bỏ header và checksum của zlib để tiết kiệm 6 byte mỗi tin nhắn
+    compressor = zlib.compressobj(DB_COMPRESS_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=_ZDICTS[_FORMAT_CURRENT])
+    compressed = bytes((_FORMAT_CURRENT,)) + compressor.compress(raw) + compressor.flush()
+    return compressed if len(compressed) < len(raw) else content
+
+def decode_content(value: Union[str, bytes]) -> str:
+    """Giải mã nội dung tin nhắn đã lưu bằng encode_content"""
+    if not isinstance(value, bytes):
+        return value
+
+    zdict = _ZDICTS.get(value[0])
+    if zdict is not None:
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=zdict)
+        return (decompressor.decompress(value[1:]) + decompressor.flush()).decode("utf-8")
+    raise ValueError(f"Không nhận ra định dạng nội dung tin nhắn: {value[0]}")
@@ -0,0 +1,318 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Set, Tuple
+from metrics.main import inc, timed
+from database.main import (
+    get_connection,
+    get_session_messages as _db_get_session_messages,
+    get_user_state as _db_get_user_state,
+    add_message as _db_add_message,
+    set_user_state as _db_set_user_state,
+    clear_user_state as _db_clear_user_state,
+    _insert_message,
+    _user_state_row,
+    _upsert_user_state,
+    _clear_user_state,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ghi tin nhắn và trạng thái qua journal (ghi nền, gộp commit); false để ghi trực tiếp như trước
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "true").lower() in ("1", "true", "yes")
+# Gộp các bản ghi trong tối đa DB_JOURNAL_FLUSH_MS mili giây hoặc DB_JOURNAL_BATCH bản ghi mỗi lần commit
+DB_JOURNAL_FLUSH_MS = float(os.getenv("DB_JOURNAL_FLUSH_MS", "5"))
+DB_JOURNAL_BATCH = int(os.getenv("DB_JOURNAL_BATCH", "200"))
+# Số lần thử lại khi commit lỗi (ví dụ: database is locked)
+DB_JOURNAL_RETRIES = int(os.getenv("DB_JOURNAL_RETRIES", "3"))
+# Thời gian chờ tối đa (giây) để ghi nốt journal khi dừng bot
+DB_JOURNAL_SHUTDOWN_TIMEOUT = float(os.getenv("DB_JOURNAL_SHUTDOWN_TIMEOUT", "10"))
+
+_STOP = object()
+
+class MessageJournal:
+    """
+    Ghi tin nhắn và trạng thái người dùng xuống SQLite trong một thread riêng
+
+    Các bản ghi được đưa vào hàng đợi và được gộp lại trong một transaction mỗi
+    DB_JOURNAL_FLUSH_MS mili giây (hoặc khi đủ DB_JOURNAL_BATCH bản ghi), nên việc
+    trả lời người dùng không phải chờ commit.
+
+    Các bản ghi chưa được ghi được giữ trong bộ nhớ và được gộp vào kết quả đọc
+    (get_session_messages, get_user_state), nhờ đó người dùng luôn đọc được những gì
+    vừa ghi. flush() chờ ghi xong mọi bản ghi và báo lỗi nếu có bản ghi bị bỏ; close()
+    được gọi khi thoát tiến trình. Nếu thread ghi gặp lỗi không phục hồi được (ví dụ
+    không mở được cơ sở dữ liệu), journal chuyển sang ghi trực tiếp.
+    """
+
+    def __init__(self, flush_ms: float = DB_JOURNAL_FLUSH_MS, batch_size: int = DB_JOURNAL_BATCH):
+        self.flush_interval = flush_ms / 1000
+        self.batch_size = max(1, batch_size)
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._committed = threading.Condition(self._lock)
+        self._enqueued = 0
+        self._written = 0
+        # Số thứ tự các bản ghi bị bỏ mà flush() chưa báo
+        self._dropped: Set[int] = set()
+        # Lỗi làm thread ghi dừng hẳn
+        self._failed: Optional[Exception] = None
+        # Tin nhắn chưa ghi theo phiên và trạng thái chưa ghi theo người dùng
+        self._pending_messages: Dict[int, List[Dict[str, Any]]] = {}
+        self._pending_states: Dict[str, Tuple[int, Any]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def _ensure_started(self) -> None:
+        """Khởi động thread ghi khi có bản ghi đầu tiên (gọi khi đang giữ lock)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="db-journal", daemon=True)
+            self._thread.start()
+
+    def _enqueue(self, record: Tuple[Any, ...]) -> int:
+        """Đưa bản ghi vào hàng đợi (gọi khi đang giữ lock), trả về số thứ tự của bản ghi"""
+        self._ensure_started()
+        self._enqueued += 1
+        self._queue.put((self._enqueued,) + record)
+        inc("db_journal_records_total", kind=record[0])
+        return self._enqueued
+
+    def add_message(self, session_id: int, user_id: str, role: str, content: str) -> None:
+        """Thêm tin nhắn vào lịch sử hội thoại (ghi nền)"""
+        if not DB_WRITE_BEHIND or self._closed:
+            _db_add_message(session_id, user_id, role, content)
+            return
+
+        # message_id chỉ có sau khi thread ghi thêm tin nhắn vào bảng messages
+        message = {
+            "seq": None,
+            "message_id": None,
+            "session_id": session_id,
+            "user_id": user_id,
+            "role": role,
+            "content": content,
+            "timestamp": int(time.time()),
+        }
+        with self._lock:
+            self._pending_messages.setdefault(session_id, []).append(message)
+            self._enqueue(("message", message))
+
+    def set_user_state(self, user_id: str, state: str, criteria: Optional[List[str]] = None, location: Optional[Tuple[float, float]] = None) -> None:
+        """Cập nhật trạng thái của người dùng (ghi nền)"""
+        if not DB_WRITE_BEHIND or self._closed:
+            return _db_set_user_state(user_id, state, criteria, location)
+
+        row = _user_state_row(user_id, state, criteria, location)
+        with self._lock:
+            sequence = self._enqueue(("state", row))
+            self._pending_states[user_id] = (sequence, row)
+
+    def clear_user_state(self, user_id: str) -> None:
+        """Xóa trạng thái của người dùng (ghi nền)"""
+        if not DB_WRITE_BEHIND or self._closed:
+            return _db_clear_user_state(user_id)
+
+        # Trạng thái được đặt lại về IDLE, con trỏ tới phiên hiện tại được giữ nguyên
+        row = _user_state_row(user_id, "IDLE", None, None)
+        with self._lock:
+            sequence = self._enqueue(("clear_state", row))
+            self._pending_states[user_id] = (sequence, row)
+
+    def get_session_messages(self, session_id: int, after_seq: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Lấy tin nhắn trong một phiên, gồm cả các tin nhắn chưa được ghi
+
+        Tin nhắn chưa được ghi có seq = None và luôn nằm sau các tin nhắn đã ghi.
+        """
+        # Lấy các tin nhắn chưa ghi trước khi đọc cơ sở dữ liệu: tin nhắn được ghi xong
+        # giữa hai lần đọc sẽ xuất hiện ở cả hai và được loại trùng theo message_id
+        with self._lock:
+            pending = list(self._pending_messages.get(session_id, ()))
+
+        messages = _db_get_session_messages(session_id, after_seq)
+        if pending:
+            stored_ids = {message["message_id"] for message in messages}
+            with self._lock:
+                messages.extend(
+                    dict(message, message_id=None) for message in pending
+                    if message["message_id"] not in stored_ids
+                )
+        return messages
+
+    def get_user_state(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Lấy trạng thái hiện tại của người dùng, ưu tiên trạng thái chưa được ghi"""
+        with self._lock:
+            pending = self._pending_states.get(user_id)
+        if pending is not None:
+            return dict(pending[1])
+        return _db_get_user_state(user_id)
+
+    @timed("db.journal_flush")
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Chờ ghi xong mọi bản ghi đã đưa vào trước thời điểm gọi
+
+        Returns:
+            True nếu đã ghi xong trong thời gian chờ; False nếu hết thời gian chờ, thread
+            ghi đã dừng vì lỗi, hoặc có bản ghi bị bỏ (mỗi bản ghi bị bỏ chỉ được báo một lần)
+        """
+        with self._lock:
+            target = self._enqueued
+            self._committed.wait_for(lambda: self._written >= target or self._failed is not None, timeout)
+            dropped = {sequence for sequence in self._dropped if sequence <= target}
+            self._dropped -= dropped
+            if dropped:
+                logger.error(f"Journal đã bỏ {len(dropped)} bản ghi chưa ghi")
+            return self._written >= target and not dropped
+
+    def close(self, timeout: Optional[float] = DB_JOURNAL_SHUTDOWN_TIMEOUT) -> None:
+        """Ghi nốt các bản ghi còn lại và dừng thread ghi; các lần ghi sau đó được ghi trực tiếp"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error("Journal chưa ghi xong các bản ghi còn lại trước khi thoát")
+
+    def _run(self) -> None:
+        """Chạy vòng lặp ghi; nếu vòng lặp dừng vì lỗi, chuyển sang ghi trực tiếp và báo cho flush()"""
+        try:
+            self._loop()
+        except Exception as e:
+            logger.error(f"Thread ghi journal dừng vì lỗi, chuyển sang ghi trực tiếp: {e}")
+            with self._lock:
+                self._failed = e
+                self._closed = True
+            # Các bản ghi còn trong hàng đợi không còn được ghi
+            rest = []
+            while True:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is not _STOP:
+                    rest.append(record)
+            if rest:
+                self._drop(rest, e)
+            self._release(rest, dropped=True)
+
+    def _loop(self) -> None:
+        """Vòng lặp của thread ghi: gom bản ghi và commit theo nhóm"""
+        conn = get_connection()
+        try:
+            while True:
+                record = self._queue.get()
+                if record is _STOP:
+                    return
+
+                # Gom thêm bản ghi trong cửa sổ thời gian hoặc đến khi đủ nhóm
+                batch = [record]
+                stop = False
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        record = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if record is _STOP:
+                        stop = True
+                        break
+                    batch.append(record)
+
+                self._write(conn, batch)
+                if stop:
+                    # Ghi nốt những gì còn trong hàng đợi
+                    rest = []
+                    while True:
+                        try:
+                            record = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if record is not _STOP:
+                            rest.append(record)
+                    if rest:
+                        self._write(conn, rest)
+                    return
+        finally:
+            conn.close()
+
+    def _drop(self, batch: List[Tuple[Any, ...]], error: Exception) -> None:
+        """Ghi log và đếm từng bản ghi bị bỏ sau khi commit lỗi quá số lần thử lại"""
+        logger.error(f"Bỏ {len(batch)} bản ghi journal sau {DB_JOURNAL_RETRIES + 1} lần lỗi: {error}")
+        for _, kind, payload in batch:
+            if kind == "message":
+                logger.error(f"Mất tin nhắn chưa ghi: session_id={payload['session_id']}, user_id={payload['user_id']}, role={payload['role']}")
+            else:
+                user_id = payload["user_id"] if kind == "state" else payload
+                logger.error(f"Mất bản ghi {kind} chưa ghi: user_id={user_id}")
+            inc("db_journal_dropped_total", kind=kind)
+
+    def _write(self, conn, batch: List[Tuple[Any, ...]]) -> None:
+        """Ghi một nhóm bản ghi trong một transaction, sau đó bỏ chúng khỏi bộ nhớ tạm"""
+        dropped = False
+        for attempt in range(DB_JOURNAL_RETRIES + 1):
+            try:
+                cursor = conn.cursor()
+                for record in batch:
+                    kind = record[1]
+                    if kind == "message":
+                        message = record[2]
+                        message_id = _insert_message(cursor, message["session_id"], message["user_id"],
+                                                     message["role"], message["content"], message["timestamp"])
+                        # Ghi nhận message_id để loại trùng khi đọc (xem get_session_messages)
+                        with self._lock:
+                            message["message_id"] = message_id
+                    elif kind == "state":
+                        _upsert_user_state(cursor, record[2])
+                    elif kind == "clear_state":
+                        _clear_user_state(cursor, record[2])
+                conn.commit()
+                inc("db_journal_commits_total")
+                break
+            except Exception as e:
+                conn.rollback()
+                if attempt < DB_JOURNAL_RETRIES:
+                    logger.warning(f"Lỗi khi ghi journal, thử lại: {e}")
+                    time.sleep(0.05 * (attempt + 1))
+                else:
+                    self._drop(batch, e)
+                    dropped = True
+        self._release(batch, dropped)
+
+    def _release(self, batch: List[Tuple[Any, ...]], dropped: bool) -> None:
+        """Bỏ một nhóm bản ghi khỏi bộ nhớ tạm và đánh thức các flush() đang chờ"""
+        with self._lock:
+            for record in batch:
+                sequence, kind, payload = record
+                if kind == "message":
+                    pending = self._pending_messages.get(payload["session_id"])
+                    if pending:
+                        pending.remove(payload)
+                        if not pending:
+                            del self._pending_messages[payload["session_id"]]
+                else:
+                    user_id = payload["user_id"]
+                    current = self._pending_states.get(user_id)
+                    # Chỉ bỏ nếu không có trạng thái mới hơn đang chờ
+                    if current is not None and current[0] == sequence:
+                        del self._pending_states[user_id]
+            if dropped:
+                self._dropped.update(record[0] for record in batch)
+            if batch:
+                self._written = max(self._written, batch[-1][0])
+            self._committed.notify_all()
+
+# Journal dùng chung trong tiến trình
+journal = MessageJournal()
+
+# Ghi nốt các bản ghi còn lại khi tiến trình thoát
+atexit.register(journal.close)
@@ -1,190 +1,513 @@
 import sqlite3
 import os
 import json
-import uuid
-from datetime import datetime
+import time
+import threading
 from typing import List, Dict, Any, Optional, Tuple
+from metrics.main import registry as metrics_registry, inc, timed
+from database.codec import encode_content, decode_content
 
-# Đường dẫn đến file database
-DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'food_chatbot.db')
+# Đường dẫn đến file database (có thể thay đổi bằng biến môi trường DB_PATH)
+DB_PATH = os.getenv("DB_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'food_chatbot.db'))
+# Dùng chế độ WAL để việc đọc (và việc dọn dữ liệu) không chặn việc ghi của bot
+DB_WAL = os.getenv("DB_WAL", "true").lower() in ("1", "true", "yes")
+
+# Cơ sở dữ liệu được khởi tạo (tạo bảng, nâng cấp lược đồ) một lần, khi mở kết nối đầu tiên
+_database_ready = False
+_database_lock = threading.Lock()
 
 def get_connection():
     """Tạo và trả về kết nối đến cơ sở dữ liệu SQLite"""
+    global _database_ready
+    if not _database_ready:
+        with _database_lock:
+            if not _database_ready:
+                init_database()
+                _database_ready = True
+    return _connect()
+
+def _connect():
+    """Mở kết nối đến cơ sở dữ liệu (không kiểm tra lược đồ)"""
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row  # Để kết quả truy vấn có thể truy cập bằng tên cột
+    if metrics_registry.enabled:
+        # Đếm số câu lệnh SQL được thực thi
+        conn.set_trace_callback(lambda statement: inc("db_queries_total"))
     return conn
 
+# Phiên bản lược đồ, lưu trong PRAGMA user_version
+# 0: lược đồ cũ (khóa uuid4 dạng TEXT, thời gian ISO-8601)
+# 1: lược đồ gọn (khóa INTEGER rowid, thời gian epoch, nội dung dài được nén)
+# 2: phiên có thời điểm đóng (sessions.closed_at), user_states trỏ tới phiên hiện tại (active_session_id)
+# 3: user_states và user_preferences lưu last_updated dạng epoch
+COMPACT_SCHEMA_VERSION = 1
+SCHEMA_VERSION = 3
+
+# Phiên không có tin nhắn mới trong SESSION_IDLE_TIMEOUT_S giây được đóng, tin nhắn tiếp theo mở phiên mới
+SESSION_IDLE_TIMEOUT_S = int(os.getenv("SESSION_IDLE_TIMEOUT_S", str(6 * 3600)))
+
+def compact_tables(suffix: str = "") -> List[str]:
+    """
+    Câu lệnh tạo các bảng sessions, messages và session_summaries theo lược đồ gọn
+    
+    Args:
+        suffix: Hậu tố thêm vào tên bảng (dùng cho các bảng tạm khi chuyển đổi)
+    """
+    return [
+        # Bảng sessions để lưu trữ thông tin phiên
+        f'''
+        CREATE TABLE IF NOT EXISTS sessions{suffix} (
+            session_id INTEGER PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            created_at INTEGER NOT NULL,
+            last_updated INTEGER NOT NULL,
+            closed_at INTEGER
+        )
+        ''',
+        # Bảng messages để lưu trữ lịch sử tin nhắn, content là TEXT hoặc BLOB đã nén (xem database/codec.py)
+        f'''
+        CREATE TABLE IF NOT EXISTS messages{suffix} (
+            message_id INTEGER PRIMARY KEY,
+            session_id INTEGER NOT NULL,
+            user_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content BLOB NOT NULL,
+            timestamp INTEGER NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES sessions{suffix} (session_id)
+        )
+        ''',
+        # Bảng session_summaries để lưu bản tóm tắt các tin nhắn cũ của phiên
+        f'''
+        CREATE TABLE IF NOT EXISTS session_summaries{suffix} (
+            session_id INTEGER PRIMARY KEY,
+            summary TEXT NOT NULL,
+            summarized_until INTEGER NOT NULL,
+            last_updated INTEGER NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES sessions{suffix} (session_id)
+        )
+        ''',
+    ]
+
+def state_tables(suffix: str = "") -> List[str]:
+    """
+    Câu lệnh tạo các bảng user_preferences và user_states
+    
+    Args:
+        suffix: Hậu tố thêm vào tên bảng (dùng cho các bảng tạm khi chuyển đổi)
+    """
+    return [
+        # Bảng user_preferences để lưu sở thích đã học được của người dùng
+        f'''
+        CREATE TABLE IF NOT EXISTS user_preferences{suffix} (
+            user_id TEXT PRIMARY KEY,
+            last_criteria TEXT,
+            criteria_counts TEXT,
+            last_restaurant TEXT,
+            last_updated INTEGER NOT NULL
+        )
+        ''',
+        # Bảng user_states để lưu trữ trạng thái của người dùng
+        f'''
+        CREATE TABLE IF NOT EXISTS user_states{suffix} (
+            user_id TEXT PRIMARY KEY,
+            current_state TEXT NOT NULL,
+            criteria TEXT,
+            location TEXT,
+            last_updated INTEGER NOT NULL,
+            active_session_id INTEGER
+        )
+        ''',
+    ]
+
+def _has_column(cursor: sqlite3.Cursor, table: str, column: str) -> bool:
+    """Kiểm tra bảng table đã có cột column chưa"""
+    return any(row[1] == column for row in cursor.execute(f"PRAGMA table_info({table})").fetchall())
+
+def create_schema(cursor: sqlite3.Cursor) -> None:
+    """Tạo các bảng và chỉ mục còn thiếu theo lược đồ hiện tại (không commit)"""
+    for statement in compact_tables():
+        cursor.execute(statement)
+    
+    # Chỉ mục cho các truy vấn theo phiên và theo người dùng
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user ON sessions (user_id, last_updated)")
+    
+    for statement in state_tables():
+        cursor.execute(statement)
+    
+    # Nâng cấp từ phiên bản 1: thêm các cột còn thiếu
+    if not _has_column(cursor, "sessions", "closed_at"):
+        cursor.execute("ALTER TABLE sessions ADD COLUMN closed_at INTEGER")
+    if not _has_column(cursor, "user_states", "active_session_id"):
+        cursor.execute("ALTER TABLE user_states ADD COLUMN active_session_id INTEGER")
+        # Phiên hiện tại của người dùng là phiên được cập nhật gần nhất
+        cursor.execute('''
+        UPDATE user_states SET active_session_id = (
+            SELECT session_id FROM sessions WHERE sessions.user_id = user_states.user_id
+            ORDER BY last_updated DESC, session_id DESC LIMIT 1
+        )
+        ''')
+    # Nâng cấp từ phiên bản 2: last_updated của user_states và user_preferences sang epoch
+    from database.migrate import convert_state_tables
+    convert_state_tables(cursor)
+    
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
 def init_database():
     """Khởi tạo cơ sở dữ liệu và các bảng cần thiết nếu chưa tồn tại"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    conn = _connect()
+    # Chỉ có tác dụng với cơ sở dữ liệu mới; file cũ cần VACUUM (python -m database.migrate --vacuum)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    if DB_WAL:
+        conn.execute("PRAGMA journal_mode = WAL")
     
-    # Tạo bảng sessions để lưu trữ thông tin phiên
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS sessions (
-        session_id TEXT PRIMARY KEY,
-        user_id TEXT NOT NULL,
-        created_at TEXT NOT NULL,
-        last_updated TEXT NOT NULL
-    )
-    ''')
-    
-    # Tạo bảng messages để lưu trữ lịch sử tin nhắn
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS messages (
-        message_id TEXT PRIMARY KEY,
-        session_id TEXT NOT NULL,
-        user_id TEXT NOT NULL,
-        role TEXT NOT NULL,
-        content TEXT NOT NULL,
-        timestamp TEXT NOT NULL,
-        FOREIGN KEY (session_id) REFERENCES sessions (session_id)
-    )
-    ''')
-    
-    # Tạo bảng user_states để lưu trữ trạng thái của người dùng
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS user_states (
-        user_id TEXT PRIMARY KEY,
-        current_state TEXT NOT NULL,
-        criteria TEXT,
-        location TEXT,
-        last_updated TEXT NOT NULL
-    )
-    ''')
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        # Lược đồ đã mới nhất, không cần tạo bảng
+        conn.close()
+        return
+    
+    has_tables = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sessions'").fetchone()
+    if version < COMPACT_SCHEMA_VERSION and has_tables:
+        # Chuyển cơ sở dữ liệu cũ sang lược đồ gọn (chỉ chạy một lần)
+        conn.close()
+        from database.migrate import convert_database
+        convert_database(DB_PATH)
+        conn = _connect()
     
+    # Nâng cấp lược đồ trong một transaction, các tiến trình khởi động cùng lúc chạy lần lượt
+    conn.execute("BEGIN IMMEDIATE")
+    create_schema(conn.cursor())
     conn.commit()
     conn.close()
 
-def create_session(user_id: str) -> str:
-    """Tạo một phiên mới cho người dùng và trả về session_id"""
+def _set_active_session(cursor: sqlite3.Cursor, user_id: str, session_id: int) -> None:
+    """Trỏ user_states.active_session_id tới phiên session_id (không commit)"""
+    cursor.execute(
+        """INSERT INTO user_states (user_id, current_state, last_updated, active_session_id) VALUES (?, 'IDLE', ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET active_session_id = excluded.active_session_id""",
+        (user_id, int(time.time()), session_id)
+    )
+
+def _close_active_session(cursor: sqlite3.Cursor, user_id: str, now: int) -> None:
+    """Đóng phiên hiện tại của người dùng nếu chưa đóng (không commit)"""
+    cursor.execute(
+        """UPDATE sessions SET closed_at = ?
+        WHERE session_id = (SELECT active_session_id FROM user_states WHERE user_id = ?) AND closed_at IS NULL""",
+        (now, user_id)
+    )
+
+@timed("db.create_session")
+def create_session(user_id: str) -> int:
+    """Đóng phiên hiện tại (nếu có), tạo một phiên mới cho người dùng và trả về session_id"""
     conn = get_connection()
     cursor = conn.cursor()
     
-    session_id = str(uuid.uuid4())
-    now = datetime.now().isoformat()
+    now = int(time.time())
     
+    _close_active_session(cursor, user_id, now)
     cursor.execute(
-        "INSERT INTO sessions (session_id, user_id, created_at, last_updated) VALUES (?, ?, ?, ?)",
-        (session_id, user_id, now, now)
+        "INSERT INTO sessions (user_id, created_at, last_updated) VALUES (?, ?, ?)",
+        (user_id, now, now)
     )
+    session_id = cursor.lastrowid
+    _set_active_session(cursor, user_id, session_id)
     
     conn.commit()
     conn.close()
     
     return session_id
 
-def get_active_session(user_id: str) -> Optional[str]:
-    """Lấy phiên hoạt động gần nhất của người dùng"""
+@timed("db.get_active_session")
+def get_active_session(user_id: str) -> Optional[int]:
+    """
+    Lấy phiên hiện tại của người dùng qua con trỏ user_states.active_session_id
+    
+    Trả về None nếu người dùng chưa có phiên, phiên đã đóng hoặc đã không có tin nhắn
+    mới quá SESSION_IDLE_TIMEOUT_S giây.
+    """
     conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
-        "SELECT session_id FROM sessions WHERE user_id = ? ORDER BY last_updated DESC LIMIT 1",
+        """SELECT s.session_id, s.last_updated, s.closed_at
+        FROM user_states us JOIN sessions s ON s.session_id = us.active_session_id
+        WHERE us.user_id = ?""",
         (user_id,)
     )
     
     result = cursor.fetchone()
     conn.close()
     
-    return result['session_id'] if result else None
+    if not result or result['closed_at'] is not None:
+        return None
+    if SESSION_IDLE_TIMEOUT_S and time.time() - result['last_updated'] > SESSION_IDLE_TIMEOUT_S:
+        return None
+    return result['session_id']
 
-def add_message(session_id: str, user_id: str, role: str, content: str) -> str:
-    """Thêm tin nhắn mới vào lịch sử hội thoại"""
+@timed("db.close_session")
+def close_active_session(user_id: str) -> None:
+    """Đóng phiên hiện tại của người dùng, tin nhắn tiếp theo sẽ mở phiên mới"""
     conn = get_connection()
     cursor = conn.cursor()
     
-    message_id = str(uuid.uuid4())
-    now = datetime.now().isoformat()
+    _close_active_session(cursor, user_id, int(time.time()))
     
-    # Thêm tin nhắn vào bảng messages
+    conn.commit()
+    conn.close()
+
+def _insert_message(cursor: sqlite3.Cursor, session_id: int, user_id: str, role: str, content: str, timestamp: int) -> int:
+    """Thêm tin nhắn và cập nhật thời gian last_updated của phiên (không commit), trả về message_id"""
     cursor.execute(
-        "INSERT INTO messages (message_id, session_id, user_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
-        (message_id, session_id, user_id, role, content, now)
+        "INSERT INTO messages (session_id, user_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+        (session_id, user_id, role, encode_content(content), timestamp)
     )
-    
-    # Cập nhật thời gian last_updated của phiên
+    message_id = cursor.lastrowid
     cursor.execute(
         "UPDATE sessions SET last_updated = ? WHERE session_id = ?",
-        (now, session_id)
+        (timestamp, session_id)
     )
+    return message_id
+
+@timed("db.add_message")
+def add_message(session_id: int, user_id: str, role: str, content: str) -> int:
+    """Thêm tin nhắn mới vào lịch sử hội thoại"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    # Thêm tin nhắn vào bảng messages và cập nhật phiên
+    message_id = _insert_message(cursor, session_id, user_id, role, content, int(time.time()))
     
     conn.commit()
     conn.close()
     
     return message_id
 
-def get_session_messages(session_id: str) -> List[Dict[str, Any]]:
-    """Lấy tất cả tin nhắn trong một phiên"""
+@timed("db.get_session_messages")
+def get_session_messages(session_id: int, after_seq: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Lấy tin nhắn trong một phiên
+    
+    Mỗi tin nhắn có thêm trường seq (bằng message_id) tăng dần theo thứ tự thêm vào.
+    Nếu có after_seq, chỉ lấy các tin nhắn có seq lớn hơn after_seq.
+    """
     conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
-        "SELECT * FROM messages WHERE session_id = ? ORDER BY timestamp ASC",
-        (session_id,)
+        "SELECT message_id AS seq, * FROM messages WHERE session_id = ? AND message_id > ? ORDER BY message_id ASC",
+        (session_id, after_seq if after_seq is not None else 0)
     )
     
-    messages = [dict(row) for row in cursor.fetchall()]
+    messages = []
+    for row in cursor.fetchall():
+        message = dict(row)
+        message["content"] = decode_content(message["content"])
+        messages.append(message)
     conn.close()
     
     return messages
 
-def get_user_state(user_id: str) -> Optional[Dict[str, Any]]:
-    """Lấy trạng thái hiện tại của người dùng"""
+@timed("db.get_session_summary")
+def get_session_summary(session_id: int) -> Optional[Dict[str, Any]]:
+    """Lấy bản tóm tắt của phiên"""
     conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
-        "SELECT * FROM user_states WHERE user_id = ?",
-        (user_id,)
+        "SELECT * FROM session_summaries WHERE session_id = ?",
+        (session_id,)
     )
     
     result = cursor.fetchone()
     conn.close()
     
-    return dict(result) if result else None
+    if not result:
+        return None
+    
+    summary = dict(result)
+    summary["summary"] = json.loads(summary["summary"])
+    return summary
 
-def set_user_state(user_id: str, state: str, criteria: Optional[List[str]] = None, location: Optional[Tuple[float, float]] = None) -> None:
-    """Cập nhật trạng thái của người dùng"""
+@timed("db.save_session_summary")
+def save_session_summary(session_id: int, summary: Dict[str, Any], summarized_until: int) -> None:
+    """Lưu bản tóm tắt của phiên, tính đến tin nhắn có seq = summarized_until"""
     conn = get_connection()
     cursor = conn.cursor()
     
-    now = datetime.now().isoformat()
-    criteria_json = json.dumps(criteria) if criteria else None
-    location_json = json.dumps(location) if location else None
+    now = int(time.time())
     
-    # Kiểm tra xem người dùng đã có trong bảng user_states chưa
     cursor.execute(
-        "SELECT user_id FROM user_states WHERE user_id = ?",
+        "INSERT OR REPLACE INTO session_summaries (session_id, summary, summarized_until, last_updated) VALUES (?, ?, ?, ?)",
+        (session_id, json.dumps(summary, ensure_ascii=False), summarized_until, now)
+    )
+    
+    conn.commit()
+    conn.close()
+
+@timed("db.get_user_preferences")
+def get_user_preferences(user_id: str) -> Optional[Dict[str, Any]]:
+    """Lấy sở thích đã lưu của người dùng"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        "SELECT * FROM user_preferences WHERE user_id = ?",
         (user_id,)
     )
     
-    if cursor.fetchone():
-        # Cập nhật trạng thái nếu người dùng đã tồn tại
-        cursor.execute(
-            "UPDATE user_states SET current_state = ?, criteria = ?, location = ?, last_updated = ? WHERE user_id = ?",
-            (state, criteria_json, location_json, now, user_id)
+    result = cursor.fetchone()
+    conn.close()
+    
+    if not result:
+        return None
+    
+    preferences = dict(result)
+    for key in ("last_criteria", "criteria_counts", "last_restaurant"):
+        preferences[key] = json.loads(preferences[key]) if preferences[key] else None
+    return preferences
+
+@timed("db.save_user_preferences")
+def save_user_preferences(user_id: str, last_criteria: Optional[List[str]], criteria_counts: Optional[Dict[str, int]], last_restaurant: Optional[Dict[str, Any]]) -> None:
+    """Lưu sở thích của người dùng"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    now = int(time.time())
+    
+    cursor.execute(
+        "INSERT OR REPLACE INTO user_preferences (user_id, last_criteria, criteria_counts, last_restaurant, last_updated) VALUES (?, ?, ?, ?, ?)",
+        (
+            user_id,
+            json.dumps(last_criteria, ensure_ascii=False) if last_criteria else None,
+            json.dumps(criteria_counts, ensure_ascii=False) if criteria_counts else None,
+            json.dumps(last_restaurant, ensure_ascii=False) if last_restaurant else None,
+            now
         )
-    else:
-        # Thêm mới nếu người dùng chưa tồn tại
+    )
+    
+    conn.commit()
+    conn.close()
+
+@timed("db.record_confirmed_criteria")
+def record_confirmed_criteria(user_id: str, criteria: List[str]) -> None:
+    """
+    Lưu bộ tiêu chí vừa xác nhận và tăng số lần chọn của từng tiêu chí
+    
+    Đọc và ghi trong cùng một transaction BEGIN IMMEDIATE, để các lượt đồng thời của
+    cùng một người dùng không ghi đè số lần chọn của nhau.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute("SELECT criteria_counts FROM user_preferences WHERE user_id = ?", (user_id,))
+        result = cursor.fetchone()
+        criteria_counts = json.loads(result["criteria_counts"]) if result and result["criteria_counts"] else {}
+        for criterion in criteria:
+            criteria_counts[criterion] = criteria_counts.get(criterion, 0) + 1
+        
         cursor.execute(
-            "INSERT INTO user_states (user_id, current_state, criteria, location, last_updated) VALUES (?, ?, ?, ?, ?)",
-            (user_id, state, criteria_json, location_json, now)
+            """INSERT INTO user_preferences (user_id, last_criteria, criteria_counts, last_updated) VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET last_criteria = excluded.last_criteria,
+                criteria_counts = excluded.criteria_counts, last_updated = excluded.last_updated""",
+            (
+                user_id,
+                json.dumps(criteria, ensure_ascii=False) if criteria else None,
+                json.dumps(criteria_counts, ensure_ascii=False) if criteria_counts else None,
+                int(time.time())
+            )
         )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+@timed("db.set_last_restaurant")
+def set_last_restaurant(user_id: str, last_restaurant: Dict[str, Any]) -> None:
+    """Lưu quán ăn được gợi ý gần nhất, giữ nguyên các sở thích khác (một câu lệnh)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute(
+        """INSERT INTO user_preferences (user_id, last_restaurant, last_updated) VALUES (?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET last_restaurant = excluded.last_restaurant,
+            last_updated = excluded.last_updated""",
+        (user_id, json.dumps(last_restaurant, ensure_ascii=False), int(time.time()))
+    )
     
     conn.commit()
     conn.close()
 
-def clear_user_state(user_id: str) -> None:
-    """Xóa trạng thái của người dùng"""
+@timed("db.get_user_state")
+def get_user_state(user_id: str) -> Optional[Dict[str, Any]]:
+    """Lấy trạng thái hiện tại của người dùng"""
     conn = get_connection()
     cursor = conn.cursor()
     
     cursor.execute(
-        "DELETE FROM user_states WHERE user_id = ?",
+        "SELECT * FROM user_states WHERE user_id = ?",
         (user_id,)
     )
     
+    result = cursor.fetchone()
+    conn.close()
+    
+    return dict(result) if result else None
+
+def _user_state_row(user_id: str, state: str, criteria: Optional[List[str]], location: Optional[Tuple[float, float]]) -> Dict[str, Any]:
+    """Tạo bản ghi trạng thái giống một dòng của bảng user_states"""
+    return {
+        "user_id": user_id,
+        "current_state": state,
+        "criteria": json.dumps(criteria) if criteria else None,
+        "location": json.dumps(location) if location else None,
+        "last_updated": int(time.time()),
+    }
+
+def _upsert_user_state(cursor: sqlite3.Cursor, row: Dict[str, Any]) -> None:
+    """Thêm hoặc cập nhật trạng thái của người dùng (không commit)"""
+    cursor.execute(
+        """INSERT INTO user_states (user_id, current_state, criteria, location, last_updated) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET current_state = excluded.current_state, criteria = excluded.criteria,
+        location = excluded.location, last_updated = excluded.last_updated""",
+        (row["user_id"], row["current_state"], row["criteria"], row["location"], row["last_updated"])
+    )
+
+def _clear_user_state(cursor: sqlite3.Cursor, row: Dict[str, Any]) -> None:
+    """
+    Xóa trạng thái của người dùng về row (IDLE, không có tiêu chí và vị trí) (không commit)
+    
+    Dòng của người dùng được giữ lại vì còn chứa con trỏ active_session_id tới phiên hiện tại.
+    """
+    cursor.execute(
+        """UPDATE user_states SET current_state = ?, criteria = NULL, location = NULL, last_updated = ?
+        WHERE user_id = ?""",
+        (row["current_state"], row["last_updated"], row["user_id"])
+    )
+
+@timed("db.set_user_state")
+def set_user_state(user_id: str, state: str, criteria: Optional[List[str]] = None, location: Optional[Tuple[float, float]] = None) -> None:
+    """Cập nhật trạng thái của người dùng"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    _upsert_user_state(cursor, _user_state_row(user_id, state, criteria, location))
+    
+    conn.commit()
+    conn.close()
+
+@timed("db.clear_user_state")
+def clear_user_state(user_id: str) -> None:
+    """Xóa trạng thái của người dùng, phiên hiện tại được giữ nguyên"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    _clear_user_state(cursor, _user_state_row(user_id, "IDLE", None, None))
+    
     conn.commit()
     conn.close()
 
@@ -0,0 +1,205 @@
+"""
+Chuyển cơ sở dữ liệu cũ sang lược đồ gọn (PRAGMA user_version >= COMPACT_SCHEMA_VERSION)
+
+Cách dùng:
+    python -m database.migrate [đường dẫn food_chatbot.db] [--batch 5000] [--vacuum]
+
+Tin nhắn được chép sang bảng tạm theo từng lô, mỗi lô là một transaction ngắn nên bot vẫn
+ghi được trong lúc chuyển đổi. Bước cuối (chép phần còn lại, phiên và bản tóm tắt, đổi tên
+bảng) chạy trong một transaction duy nhất. message_id và session_id mới chính là rowid cũ,
+nên summarized_until của các bản tóm tắt vẫn giữ nguyên ý nghĩa.
+
+last_updated của user_states và user_preferences được chuyển từ ISO-8601 sang epoch
+(convert_state_tables) khi nâng cấp lược đồ lúc bot khởi động.
+"""
+import os
+import sys
+import time
+import sqlite3
+import logging
+import argparse
+from datetime import datetime
+from typing import Optional
+from database.main import DB_PATH, COMPACT_SCHEMA_VERSION, compact_tables, state_tables, create_schema
+from database.codec import encode_content
+
+logger = logging.getLogger(__name__)
+
+# Số tin nhắn được chép trong mỗi transaction
+DB_MIGRATE_BATCH = int(os.getenv("DB_MIGRATE_BATCH", "5000"))
+
+# Hậu tố của các bảng tạm trong lúc chuyển đổi
+_SUFFIX = "_compact"
+
+def _to_epoch(value: Optional[str]) -> int:
+    """Chuyển thời gian ISO-8601 (giờ địa phương, như datetime.now().isoformat()) sang epoch"""
+    if not value:
+        return 0
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        return 0
+
+def convert_state_tables(cursor: sqlite3.Cursor) -> None:
+    """
+    Chuyển last_updated của user_states và user_preferences từ ISO-8601 (TEXT) sang epoch (không commit)
+
+    SQLite không đổi được kiểu cột, nên bảng được tạo lại theo state_tables() và chép dữ
+    liệu sang. Bảng chưa tồn tại hoặc đã chuyển đổi được bỏ qua.
+    """
+    cursor.connection.create_function("to_epoch", 1, _to_epoch, deterministic=True)
+    for table, statement in zip(("user_preferences", "user_states"), state_tables(_SUFFIX)):
+        columns = {row[1]: row[2] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+        if columns.get("last_updated", "").upper() != "TEXT":
+            continue
+
+        cursor.execute(statement)
+        names = ", ".join(columns)
+        values = ", ".join("to_epoch(last_updated)" if name == "last_updated" else name for name in columns)
+        cursor.execute(f"INSERT INTO {table}{_SUFFIX} ({names}) SELECT {values} FROM {table}")
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {table}{_SUFFIX} RENAME TO {table}")
+        logger.info(f"Đã chuyển last_updated của bảng {table} sang epoch")
+
+def _copy_messages(conn: sqlite3.Connection, limit: Optional[int]) -> int:
+    """Chép các tin nhắn chưa được chép sang bảng tạm, trả về số tin nhắn đã chép"""
+    last_id = conn.execute(f"SELECT IFNULL(MAX(message_id), 0) FROM messages{_SUFFIX}").fetchone()[0]
+    rows = conn.execute(
+        "SELECT m.rowid, s.rowid, m.user_id, m.role, m.content, m.timestamp "
+        "FROM messages m JOIN sessions s ON s.session_id = m.session_id "
+        "WHERE m.rowid > ? ORDER BY m.rowid" + (" LIMIT ?" if limit else ""),
+        (last_id, limit) if limit else (last_id,)
+    ).fetchall()
+    conn.executemany(
+        f"INSERT INTO messages{_SUFFIX} (message_id, session_id, user_id, role, content, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (message_id, session_id, user_id, role, encode_content(content), _to_epoch(timestamp))
+            for message_id, session_id, user_id, role, content, timestamp in rows
+        ]
+    )
+    return len(rows)
+
+def _is_converted(conn: sqlite3.Connection) -> bool:
+    """Kiểm tra cơ sở dữ liệu đã ở lược đồ gọn (hoặc chưa có bảng nào) chưa"""
+    if conn.execute("PRAGMA user_version").fetchone()[0] >= COMPACT_SCHEMA_VERSION:
+        return True
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sessions'").fetchone() is None
+
+def convert_database(path: str = DB_PATH, batch_size: int = DB_MIGRATE_BATCH) -> bool:
+    """
+    Chuyển cơ sở dữ liệu sang lược đồ gọn khi cần
+
+    Có thể chạy đồng thời từ nhiều tiến trình: các lô được chép tiếp nối nhau và bước
+    cuối kiểm tra lại phiên bản lược đồ trong transaction.
+
+    Args:
+        path: Đường dẫn đến file cơ sở dữ liệu
+        batch_size: Số tin nhắn được chép trong mỗi transaction
+
+    Returns:
+        True nếu cơ sở dữ liệu vừa được chuyển đổi
+    """
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        if _is_converted(conn):
+            return False
+
+        started = time.monotonic()
+        conn.execute("BEGIN IMMEDIATE")
+        for statement in compact_tables(_SUFFIX):
+            conn.execute(statement)
+        conn.execute("COMMIT")
+
+        # Chép tin nhắn theo từng lô, giữa các lô bot vẫn ghi được
+        copied = 0
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            if _is_converted(conn):
+                # Tiến trình khác đã chuyển đổi xong
+                conn.execute("ROLLBACK")
+                return False
+            count = _copy_messages(conn, batch_size)
+            conn.execute("COMMIT")
+            copied += count
+            if count < batch_size:
+                break
+            logger.info(f"Đã chép {copied} tin nhắn sang lược đồ gọn")
+
+        # Bước cuối: chép phần còn lại và đổi bảng trong một transaction
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if _is_converted(conn):
+                conn.execute("ROLLBACK")
+                return False
+
+            copied += _copy_messages(conn, None)
+
+            conn.execute(f"DELETE FROM sessions{_SUFFIX}")
+            conn.executemany(
+                f"INSERT INTO sessions{_SUFFIX} (session_id, user_id, created_at, last_updated) VALUES (?, ?, ?, ?)",
+                [
+                    (session_id, user_id, _to_epoch(created_at), _to_epoch(last_updated))
+                    for session_id, user_id, created_at, last_updated in conn.execute(
+                        "SELECT rowid, user_id, created_at, last_updated FROM sessions"
+                    )
+                ]
+            )
+
+            conn.execute(f"DELETE FROM session_summaries{_SUFFIX}")
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'session_summaries'").fetchone():
+                conn.executemany(
+                    f"INSERT INTO session_summaries{_SUFFIX} (session_id, summary, summarized_until, last_updated) VALUES (?, ?, ?, ?)",
+                    [
+                        (session_id, summary, summarized_until, _to_epoch(last_updated))
+                        for session_id, summary, summarized_until, last_updated in conn.execute(
+                            "SELECT s.rowid, ss.summary, ss.summarized_until, ss.last_updated "
+                            "FROM session_summaries ss JOIN sessions s ON s.session_id = ss.session_id"
+                        )
+                    ]
+                )
+
+            conn.execute("DROP TABLE IF EXISTS session_summaries")
+            conn.execute("DROP TABLE messages")
+            conn.execute("DROP TABLE sessions")
+            for table in ("sessions", "messages", "session_summaries"):
+                conn.execute(f"ALTER TABLE {table}{_SUFFIX} RENAME TO {table}")
+            create_schema(conn.cursor())
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        logger.info(f"Đã chuyển {copied} tin nhắn sang lược đồ gọn trong {time.monotonic() - started:.1f}s")
+        return True
+    finally:
+        conn.close()
+
+def main(argv=None) -> int:
+    """Chạy chuyển đổi từ dòng lệnh"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # Luôn hiện tiến độ chuyển đổi khi chạy từ dòng lệnh
+    logger.setLevel(logging.INFO)
+    parser = argparse.ArgumentParser(description="Chuyển cơ sở dữ liệu của bot sang lược đồ gọn")
+    parser.add_argument("path", nargs="?", default=DB_PATH, help="Đường dẫn đến file cơ sở dữ liệu")
+    parser.add_argument("--batch", type=int, default=DB_MIGRATE_BATCH, help="Số tin nhắn mỗi transaction")
+    parser.add_argument("--vacuum", action="store_true", help="Chạy VACUUM sau khi chuyển đổi để thu nhỏ file")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        logger.error(f"Không tìm thấy cơ sở dữ liệu: {args.path}")
+        return 1
+
+    if not convert_database(args.path, args.batch):
+        logger.info("Cơ sở dữ liệu đã ở lược đồ gọn")
+
+    if args.vacuum:
+        # Ghi lại toàn bộ file để trả lại dung lượng của các bảng cũ (khóa cơ sở dữ liệu trong lúc chạy),
+        # đồng thời bật auto_vacuum = INCREMENTAL cho việc dọn dữ liệu định kỳ (database/retention.py)
+        conn = sqlite3.connect(args.path, timeout=30)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
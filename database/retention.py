@@ -0,0 +1,277 @@
+import os
+import gzip
+import json
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+from metrics.main import inc, timed
+from database.main import get_connection
+from database.codec import decode_content
+
+logger = logging.getLogger(__name__)
+
+# Bật dọn dữ liệu cũ và bảo trì cơ sở dữ liệu định kỳ
+DB_RETENTION_ENABLED = os.getenv("DB_RETENTION_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Thời gian lưu giữ (ngày) của từng bảng, 0 để giữ mãi
+# - sessions: phiên không có hoạt động, bị xóa cùng tin nhắn và bản tóm tắt
+# - messages: tin nhắn cũ đã được gộp vào bản tóm tắt của phiên
+# - user_states: trạng thái hội thoại không được cập nhật
+# - user_preferences: sở thích đã học được của người dùng
+RETENTION_TTL_DAYS = {
+    "sessions": float(os.getenv("DB_TTL_SESSIONS_DAYS", "90")),
+    "messages": float(os.getenv("DB_TTL_MESSAGES_DAYS", "30")),
+    "user_states": float(os.getenv("DB_TTL_USER_STATES_DAYS", "30")),
+    "user_preferences": float(os.getenv("DB_TTL_USER_PREFERENCES_DAYS", "0")),
+}
+
+# Số dòng xóa trong mỗi transaction và thời gian nghỉ giữa các transaction,
+# để bot không phải chờ lâu khi ghi
+DB_RETENTION_BATCH = int(os.getenv("DB_RETENTION_BATCH", "200"))
+DB_RETENTION_PAUSE_S = float(os.getenv("DB_RETENTION_PAUSE_S", "0.05"))
+
+# Thư mục lưu các phiên đã xóa dưới dạng JSONL nén gzip (để trống nếu không cần lưu)
+DB_ARCHIVE_DIR = os.getenv("DB_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "archive"))
+
+# Khung giờ ít người dùng (giờ địa phương, dạng "bắt đầu-kết thúc") để dọn dữ liệu và bảo trì
+DB_MAINTENANCE_HOURS = os.getenv("DB_MAINTENANCE_HOURS", "3-5")
+# Số trang được trả lại trong mỗi lần incremental_vacuum
+DB_VACUUM_PAGES = int(os.getenv("DB_VACUUM_PAGES", "500"))
+# Chu kỳ (giây) thread nền kiểm tra đã đến khung giờ bảo trì chưa
+DB_RETENTION_CHECK_S = float(os.getenv("DB_RETENTION_CHECK_S", "300"))
+
+def _parse_hours(value: str) -> Tuple[int, int]:
+    """Đọc khung giờ dạng "3-5" thành (3, 5)"""
+    start, _, end = value.partition("-")
+    return int(start) % 24, int(end or start) % 24
+
+def in_quiet_hours(now: Optional[datetime] = None) -> bool:
+    """Kiểm tra thời điểm hiện tại có nằm trong DB_MAINTENANCE_HOURS không (hỗ trợ khung giờ qua nửa đêm)"""
+    start, end = _parse_hours(DB_MAINTENANCE_HOURS)
+    hour = (now or datetime.now()).hour
+    if start == end:
+        return True
+    if start < end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+def _archive(table: str, records: List[Dict[str, Any]]) -> None:
+    """Ghi thêm các bản ghi vào file JSONL nén của ngày hôm nay"""
+    if not DB_ARCHIVE_DIR or not records:
+        return
+    os.makedirs(DB_ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(DB_ARCHIVE_DIR, f"{table}-{datetime.now():%Y-%m-%d}.jsonl.gz")
+    # Mỗi lần ghi là một gzip member mới, các công cụ gzip đọc nối tiếp được
+    with gzip.open(path, "at", encoding="utf-8") as archive:
+        for record in records:
+            archive.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def _read_batch(conn, queries: List[Tuple[str, tuple]]) -> List[List[Dict[str, Any]]]:
+    """Chạy các câu SELECT trong cùng một transaction đọc (WAL: không chặn bot đang ghi)"""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    try:
+        return [[dict(row) for row in cursor.execute(sql, params)] for sql, params in queries]
+    finally:
+        cursor.execute("COMMIT")
+
+def _expire_sessions(conn, cutoff: int) -> int:
+    """Lưu trữ và xóa một lô phiên không hoạt động từ trước cutoff, trả về số phiên đã xóa"""
+    (sessions,) = _read_batch(conn, [(
+        "SELECT * FROM sessions WHERE last_updated < ? ORDER BY session_id LIMIT ?",
+        (cutoff, DB_RETENTION_BATCH)
+    )])
+    if not sessions:
+        return 0
+
+    ids = [session["session_id"] for session in sessions]
+    placeholders = ",".join("?" * len(ids))
+    messages, summaries = _read_batch(conn, [
+        (f"SELECT session_id, role, content, timestamp FROM messages WHERE session_id IN ({placeholders}) ORDER BY message_id", ids),
+        (f"SELECT session_id, summary FROM session_summaries WHERE session_id IN ({placeholders})", ids),
+    ])
+    for session in sessions:
+        session["messages"] = []
+        session["summary"] = None
+    by_id = {session["session_id"]: session for session in sessions}
+    for row in messages:
+        by_id[row["session_id"]]["messages"].append(
+            {"role": row["role"], "content": decode_content(row["content"]), "timestamp": row["timestamp"]}
+        )
+    for row in summaries:
+        by_id[row["session_id"]]["summary"] = json.loads(row["summary"])
+
+    # Lưu trữ trước khi mở transaction ghi, để việc nén và ghi file không giữ khóa ghi
+    # của bot; nếu ghi file lỗi thì chưa có gì bị xóa
+    _archive("sessions", sessions)
+
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        # Chỉ xóa các phiên vẫn còn quá hạn: phiên có tin nhắn mới trong lúc lưu trữ được giữ lại
+        # (bản lưu trữ thừa của nó không ảnh hưởng gì)
+        expired = [row[0] for row in cursor.execute(
+            f"SELECT session_id FROM sessions WHERE session_id IN ({placeholders}) AND last_updated < ?",
+            ids + [cutoff]
+        )]
+        if expired:
+            placeholders = ",".join("?" * len(expired))
+            cursor.execute(f"DELETE FROM messages WHERE session_id IN ({placeholders})", expired)
+            cursor.execute(f"DELETE FROM session_summaries WHERE session_id IN ({placeholders})", expired)
+            cursor.execute(f"DELETE FROM sessions WHERE session_id IN ({placeholders})", expired)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    # Trả về số phiên đã đọc (không phải số đã xóa) để purge_expired biết còn lô tiếp theo
+    return len(sessions)
+
+def _expire_messages(conn, cutoff: int) -> int:
+    """Lưu trữ và xóa một lô tin nhắn cũ đã được tóm tắt, trả về số tin nhắn đã xóa"""
+    (messages,) = _read_batch(conn, [(
+        """SELECT m.message_id, m.session_id, m.user_id, m.role, m.content, m.timestamp
+        FROM messages m JOIN session_summaries ss ON ss.session_id = m.session_id
+        WHERE m.message_id <= ss.summarized_until AND m.timestamp < ?
+        ORDER BY m.message_id LIMIT ?""",
+        (cutoff, DB_RETENTION_BATCH)
+    )])
+    if not messages:
+        return 0
+
+    for message in messages:
+        message["content"] = decode_content(message["content"])
+    # Tin nhắn đã được tóm tắt không thay đổi nữa, nên có thể lưu trữ ngoài transaction ghi
+    _archive("messages", messages)
+
+    ids = [message["message_id"] for message in messages]
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(f"DELETE FROM messages WHERE message_id IN ({','.join('?' * len(ids))})", ids)
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return len(messages)
+
+def _expire_rows(conn, table: str, cutoff: int) -> int:
+    """Xóa một lô dòng có last_updated trước cutoff trong bảng user_states hoặc user_preferences"""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(
+            f"DELETE FROM {table} WHERE user_id IN (SELECT user_id FROM {table} WHERE last_updated < ? LIMIT ?)",
+            (cutoff, DB_RETENTION_BATCH)
+        )
+        count = cursor.rowcount
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    return count
+
+def _expire_batch(conn, table: str, cutoff: float) -> int:
+    """Xóa một lô dữ liệu quá hạn của bảng table, trả về số dòng đã xóa"""
+    if table == "sessions":
+        return _expire_sessions(conn, int(cutoff))
+    if table == "messages":
+        return _expire_messages(conn, int(cutoff))
+    return _expire_rows(conn, table, int(cutoff))
+
+@timed("db.retention")
+def purge_expired(now: Optional[float] = None) -> Dict[str, int]:
+    """
+    Xóa dữ liệu quá hạn theo RETENTION_TTL_DAYS, từng lô DB_RETENTION_BATCH dòng
+
+    Phiên và tin nhắn bị xóa được lưu vào DB_ARCHIVE_DIR trước khi xóa.
+
+    Returns:
+        Số dòng đã xóa của mỗi bảng
+    """
+    now = now if now is not None else time.time()
+    deleted = {}
+    conn = get_connection()
+    conn.isolation_level = None
+    try:
+        for table, ttl_days in RETENTION_TTL_DAYS.items():
+            if ttl_days <= 0:
+                continue
+            cutoff = now - ttl_days * 86400
+            deleted[table] = 0
+            while True:
+                count = _expire_batch(conn, table, cutoff)
+                deleted[table] += count
+                if count < DB_RETENTION_BATCH:
+                    break
+                # Nhường khóa ghi cho bot giữa các lô
+                time.sleep(DB_RETENTION_PAUSE_S)
+            if deleted[table]:
+                inc("db_retention_deleted_total", deleted[table], table=table)
+    finally:
+        conn.close()
+    return deleted
+
+@timed("db.maintenance")
+def run_maintenance() -> None:
+    """
+    Bảo trì cơ sở dữ liệu: trả lại trang trống, cập nhật thống kê và checkpoint WAL
+
+    incremental_vacuum chạy từng DB_VACUUM_PAGES trang mỗi lần để không giữ khóa ghi lâu.
+    """
+    conn = get_connection()
+    conn.isolation_level = None
+    try:
+        # incremental_vacuum chỉ có tác dụng khi auto_vacuum = INCREMENTAL (xem init_database)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            while conn.execute("PRAGMA freelist_count").fetchone()[0] > 0:
+                conn.execute(f"PRAGMA incremental_vacuum({DB_VACUUM_PAGES})").fetchall()
+                time.sleep(DB_RETENTION_PAUSE_S)
+
+        # Giới hạn số dòng được quét để ANALYZE chạy nhanh trên bảng lớn
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
+
+        # PASSIVE không chờ các kết nối khác, nên không chặn bot đang ghi
+        busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        if log_pages > 0 and checkpointed < log_pages:
+            logger.info(f"Checkpoint WAL chưa hoàn tất: {checkpointed}/{log_pages} trang")
+    finally:
+        conn.close()
+
+def run_once() -> Dict[str, int]:
+    """Dọn dữ liệu quá hạn rồi bảo trì cơ sở dữ liệu"""
+    deleted = purge_expired()
+    run_maintenance()
+    return deleted
+
+def _retention_loop() -> None:
+    """Vòng lặp của thread nền: chạy run_once mỗi ngày một lần trong khung giờ bảo trì"""
+    last_run = None
+    while True:
+        today = datetime.now().date()
+        if last_run != today and in_quiet_hours():
+            try:
+                deleted = run_once()
+                logger.info(f"Đã dọn dữ liệu quá hạn: {deleted}")
+                last_run = today
+            except Exception as e:
+                logger.error(f"Lỗi khi dọn dữ liệu quá hạn: {e}")
+        time.sleep(DB_RETENTION_CHECK_S)
+
+def start_retention_thread() -> Optional[threading.Thread]:
+    """
+    Khởi động thread nền dọn dữ liệu quá hạn và bảo trì cơ sở dữ liệu
+
+    Không làm gì nếu DB_RETENTION_ENABLED bị tắt. Chỉ nên gọi ở một tiến trình
+    (tiến trình bot hoặc supervisor).
+
+    Returns:
+        Thread đã khởi động, hoặc None nếu bị tắt
+    """
+    if not DB_RETENTION_ENABLED:
+        return None
+    thread = threading.Thread(target=_retention_loop, name="db-retention", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,136 @@
+"""
+Dựng từ điển nén (preset dictionary) cho nội dung tin nhắn (database/codec.py)
+
+Cách dùng:
+    python -m database.zdict [--db food_chatbot.db] [--size 4096] [--output database/zdict_v2.txt]
+
+Từ điển chỉ gồm câu chữ của chính bot: các hằng chuỗi trong mã nguồn (mẫu tin nhắn
+trong render/templates.py, phần cố định của các f-string trong bot/, fallback/...), không
+có tên quán, địa chỉ hay câu trả lời của LLM. Các đoạn được xếp theo số byte tiết kiệm
+được trên các tin nhắn mẫu: tin nhắn bot đã lưu trong cơ sở dữ liệu (--db), hoặc khi
+không có --db, tin nhắn của các kịch bản trong benchmark/conversation.py chạy với LLM và
+Overpass giả trên một cơ sở dữ liệu tạm. Kết quả chỉ phụ thuộc vào mã nguồn và tin nhắn
+mẫu, nên chạy lại cùng một lệnh cho cùng một file.
+
+File từ điển đã dùng để nén dữ liệu thì không được sửa: khi cần từ điển mới, ghi ra file
+phiên bản mới (ví dụ zdict_v3.txt) và thêm mã định dạng mới trong database/codec.py.
+"""
+import os
+import ast
+import sys
+import asyncio
+import logging
+import sqlite3
+import argparse
+import tempfile
+from typing import Iterable, List
+
+# Kích thước mặc định của từ điển (byte); zlib chỉ dùng tối đa 32 KB cuối của từ điển
+ZDICT_SIZE = 4096
+# Bỏ các đoạn ngắn hơn ZDICT_MIN_PIECE byte: lợi ích nén không đáng kể
+ZDICT_MIN_PIECE = 4
+
+# Thư mục gốc của mã nguồn và các thư mục không chứa tin nhắn của bot
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SKIP_DIRS = {"tests", "benchmark", "docs", "__pycache__"}
+
+def source_pieces(root: str = _ROOT) -> List[str]:
+    """Các hằng chuỗi trong mã nguồn, kể cả phần cố định của f-string (sắp xếp, không trùng)"""
+    pieces = set()
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name not in _SKIP_DIRS and not name.startswith(".")]
+        for filename in filenames:
+            if not filename.endswith(".py"):
+                continue
+            with open(os.path.join(directory, filename), encoding="utf-8") as source:
+                tree = ast.parse(source.read())
+            pieces.update(
+                node.value for node in ast.walk(tree)
+                if isinstance(node, ast.Constant) and isinstance(node.value, str)
+                and len(node.value.encode("utf-8")) >= ZDICT_MIN_PIECE
+            )
+    return sorted(pieces)
+
+def database_samples(path: str) -> List[str]:
+    """Các tin nhắn của bot đã lưu trong cơ sở dữ liệu path"""
+    from database.codec import decode_content
+    conn = sqlite3.connect(path)
+    try:
+        return [decode_content(content) for (content,) in conn.execute(
+            "SELECT content FROM messages WHERE role = 'bot' ORDER BY message_id"
+        )]
+    finally:
+        conn.close()
+
+def conversation_samples(users: int = 8) -> List[str]:
+    """Chạy các kịch bản hội thoại mẫu trên cơ sở dữ liệu tạm, trả về các tin nhắn của bot"""
+    import database.main as db
+    from database.journal import journal
+    from benchmark import conversation
+    from bot.sender import scheduler
+
+    with tempfile.TemporaryDirectory(prefix="food-chatbot-zdict-") as directory:
+        db.DB_PATH = os.path.join(directory, "zdict.db")
+        db._database_ready = False
+        scheduler.configure(global_rate=0, chat_rate=0)
+        fake_llm = conversation.install_fakes(llm_latency=0, overpass_latency=0, overpass_elements=500)
+        asyncio.run(conversation.run_level(users, fake_llm, first_user_id=1))
+        journal.flush()
+        return database_samples(db.DB_PATH)
+
+def build_dictionary(pieces: Iterable[str], samples: Iterable[str], size: int = ZDICT_SIZE) -> bytes:
+    """
+    Dựng từ điển từ các đoạn văn bản cố định và các tin nhắn mẫu
+
+    Mỗi đoạn được chấm điểm theo số byte tiết kiệm được trên các tin nhắn mẫu (số lần
+    xuất hiện x độ dài); các đoạn điểm cao được chọn cho đến khi đủ size byte, bỏ các
+    đoạn không xuất hiện trong tin nhắn nào và các đoạn đã nằm trong một đoạn được chọn
+    trước. Đoạn điểm cao nhất đứng cuối từ điển, nơi zlib tham chiếu hiệu quả nhất.
+
+    Args:
+        pieces: Các đoạn văn bản cố định (xem source_pieces)
+        samples: Các tin nhắn mẫu
+        size: Kích thước tối đa của từ điển (byte)
+
+    Returns:
+        Từ điển dạng UTF-8
+    """
+    samples = list(samples)
+    scores = {}
+    for piece in set(pieces):
+        count = sum(sample.count(piece) for sample in samples)
+        if count:
+            scores[piece] = count * len(piece.encode("utf-8"))
+
+    ranked = sorted(scores, key=lambda piece: (-scores[piece], piece))
+    chosen: List[str] = []
+    used = 0
+    for piece in ranked:
+        length = len(piece.encode("utf-8"))
+        if used + length > size or any(piece in other for other in chosen):
+            continue
+        chosen.append(piece)
+        used += length
+    return "".join(reversed(chosen)).encode("utf-8")
+
+def main(argv=None) -> int:
+    """Dựng từ điển từ dòng lệnh"""
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Dựng từ điển nén cho nội dung tin nhắn")
+    parser.add_argument("--db", help="Lấy tin nhắn mẫu từ cơ sở dữ liệu này thay vì chạy các kịch bản hội thoại mẫu")
+    parser.add_argument("--size", type=int, default=ZDICT_SIZE, help="Kích thước tối đa của từ điển (byte)")
+    parser.add_argument("--output", default="-", help="File từ điển cần ghi (mặc định: in ra màn hình)")
+    args = parser.parse_args(argv)
+
+    samples = database_samples(args.db) if args.db else conversation_samples()
+    dictionary = build_dictionary(source_pieces(), samples, args.size)
+    if args.output == "-":
+        sys.stdout.write(dictionary.decode("utf-8"))
+    else:
+        with open(args.output, "wb") as output:
+            output.write(dictionary)
+    print(f"{len(samples)} tin nhắn mẫu, từ điển {len(dictionary)} byte", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
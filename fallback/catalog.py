@@ -0,0 +1,149 @@
+import re
+from typing import List, Dict, Set, Tuple
+
+# Một từ trong tiêu chí hoặc nhãn (chữ cái có dấu, chữ số)
+_WORD = re.compile(r"\w+")
+
+def _words(text: str) -> Tuple[str, ...]:
+    return tuple(_WORD.findall(text.lower()))
+
+def _contains_words(words: Tuple[str, ...], phrase: Tuple[str, ...]) -> bool:
+    """phrase xuất hiện liền nhau, trọn từ, trong words"""
+    size = len(phrase)
+    return any(words[start:start + size] == phrase for start in range(len(words) - size + 1))
+
+# Danh mục món ăn (tên món, mô tả, nhãn), nhãn theo bộ tiêu chí COMMON_CRITERIA (khô, nước, cay, chay, ...).
+# Các món được xếp theo mức độ phổ biến, món đứng trước được ưu tiên khi điểm bằng nhau.
+DISHES: List[Tuple[str, str, Tuple[str, ...]]] = [
+    ("Phở bò", "Bánh phở mềm trong nước dùng xương bò hầm lâu, ăn kèm thịt bò tái hoặc chín và rau thơm.", ("nước", "nóng", "thịt", "Việt Nam", "bình dân")),
+    ("Bún chả", "Chả và thịt ba chỉ nướng than hoa ăn cùng bún, rau sống và nước chấm chua ngọt.", ("nướng", "thịt", "chua", "ngọt", "rau", "Việt Nam", "bình dân")),
+    ("Bánh mì thịt", "Bánh mì giòn kẹp pate, thịt, chả, dưa góp và rau thơm.", ("khô", "thịt", "ăn nhanh", "Việt Nam", "bình dân")),
+    ("Cơm tấm sườn nướng", "Cơm tấm ăn với sườn nướng, bì, chả trứng và nước mắm chua ngọt.", ("khô", "nướng", "thịt", "ngọt", "Việt Nam", "bình dân")),
+    ("Bún bò Huế", "Bún sợi to trong nước dùng cay thơm mùi sả, có giò heo và thịt bò.", ("nước", "cay", "nóng", "thịt", "Việt Nam")),
+    ("Gỏi cuốn", "Bánh tráng cuốn tôm, thịt, bún và rau sống, chấm tương đậu.", ("rau", "hải sản", "lạnh", "ăn nhanh", "Việt Nam")),
+    ("Chả giò", "Nem rán giòn nhân thịt, miến và mộc nhĩ, chấm nước mắm chua ngọt.", ("chiên", "khô", "thịt", "Việt Nam")),
+    ("Bún riêu cua", "Bún trong nước riêu cua chua nhẹ, có đậu phụ rán và cà chua.", ("nước", "chua", "hải sản", "nóng", "Việt Nam", "bình dân")),
+    ("Mì Quảng", "Mì sợi vàng với ít nước dùng đậm, tôm, thịt và bánh đa giòn.", ("khô", "hải sản", "thịt", "Việt Nam")),
+    ("Hủ tiếu Nam Vang", "Hủ tiếu với nước dùng ngọt thanh, tôm, gan và thịt bằm.", ("nước", "nóng", "hải sản", "thịt", "Việt Nam")),
+    ("Bánh xèo", "Bánh chiên giòn nhân tôm, thịt, giá, cuốn rau sống chấm nước mắm.", ("chiên", "hải sản", "rau", "Việt Nam")),
+    ("Cá kho tộ", "Cá kho nước màu trong niêu đất, đậm vị mặn ngọt, ăn với cơm trắng.", ("mặn", "hải sản", "nóng", "Việt Nam")),
+    ("Canh chua cá lóc", "Canh chua me với cá lóc, dứa, cà chua, giá và rau thơm.", ("nước", "chua", "hải sản", "rau", "Việt Nam")),
+    ("Lẩu thái hải sản", "Lẩu chua cay với tôm, mực, nghêu và rau ăn kèm.", ("nước", "cay", "chua", "hải sản", "nóng", "Thái Lan")),
+    ("Ốc luộc sả", "Ốc luộc với sả và lá chanh, chấm nước mắm gừng.", ("luộc", "hải sản", "nóng", "Việt Nam", "bình dân")),
+    ("Tôm nướng muối ớt", "Tôm ướp muối ớt nướng than, vị cay mặn đậm đà.", ("nướng", "cay", "mặn", "hải sản", "Việt Nam")),
+    ("Mực xào sa tế", "Mực xào cùng sa tế, hành tây và ớt chuông.", ("xào", "cay", "hải sản", "Việt Nam")),
+    ("Gà luộc lá chanh", "Gà ta luộc chấm muối tiêu chanh, thơm lá chanh.", ("luộc", "thịt", "nóng", "Việt Nam")),
+    ("Bò lúc lắc", "Thịt bò thái hạt lựu xào lửa lớn với hành tây và ớt chuông.", ("xào", "thịt", "Việt Nam", "sang trọng")),
+    ("Bò nướng lá lốt", "Thịt bò băm cuốn lá lốt nướng than, chấm mắm nêm.", ("nướng", "thịt", "Việt Nam")),
+    ("Cháo lòng", "Cháo nấu nước luộc lòng, ăn kèm lòng heo và quẩy.", ("nước", "nóng", "thịt", "Việt Nam", "bình dân")),
+    ("Xôi xéo", "Xôi nếp vàng với đậu xanh, hành phi và mỡ hành.", ("khô", "ăn nhanh", "Việt Nam", "bình dân")),
+    ("Bánh cuốn", "Bánh cuốn tráng mỏng nhân thịt và mộc nhĩ, chấm nước mắm.", ("hấp", "thịt", "Việt Nam", "bình dân")),
+    ("Bánh bao", "Bánh hấp nhân thịt, trứng cút và lạp xưởng.", ("hấp", "thịt", "ăn nhanh", "Trung Quốc")),
+    ("Há cảo", "Bánh hấp vỏ mỏng nhân tôm thịt.", ("hấp", "hải sản", "Trung Quốc")),
+    ("Đậu phụ sốt cà chua", "Đậu phụ rán sốt cà chua chua ngọt, món chay dễ ăn.", ("chay", "chiên", "chua", "ngọt", "Việt Nam", "bình dân")),
+    ("Cơm chay thập cẩm", "Cơm với rau củ xào, đậu phụ và nấm.", ("chay", "rau", "xào", "Việt Nam")),
+    ("Rau muống xào tỏi", "Rau muống xào tỏi giòn xanh.", ("chay", "rau", "xào", "Việt Nam", "bình dân")),
+    ("Lẩu nấm chay", "Lẩu nước rau củ ngọt thanh với nhiều loại nấm.", ("chay", "nước", "rau", "nóng", "Việt Nam")),
+    ("Chè khúc bạch", "Chè lạnh với thạch khúc bạch, nhãn và hạnh nhân.", ("ngọt", "lạnh", "Việt Nam")),
+    ("Kem xôi", "Kem mát lạnh ăn cùng xôi dẻo.", ("ngọt", "lạnh", "Việt Nam")),
+    ("Nộm đu đủ bò khô", "Đu đủ xanh trộn bò khô, rau thơm, chua cay ngọt.", ("chua", "cay", "ngọt", "rau", "lạnh", "Việt Nam", "bình dân")),
+    ("Sushi", "Cơm trộn giấm cuộn cá sống và rong biển.", ("hải sản", "lạnh", "Nhật Bản", "sang trọng")),
+    ("Ramen", "Mì sợi trong nước dùng xương hầm, thịt xá xíu và trứng lòng đào.", ("nước", "nóng", "thịt", "Nhật Bản")),
+    ("Tempura", "Tôm và rau củ tẩm bột chiên giòn.", ("chiên", "hải sản", "Nhật Bản")),
+    ("Kimbap", "Cơm cuộn rong biển với trứng, xúc xích và rau củ.", ("khô", "ăn nhanh", "Hàn Quốc")),
+    ("Tokbokki", "Bánh gạo sốt cay ngọt kiểu Hàn.", ("cay", "ngọt", "ăn nhanh", "Hàn Quốc")),
+    ("Thịt nướng Hàn Quốc", "Thịt ba chỉ và bò nướng tại bàn, cuốn rau xà lách.", ("nướng", "thịt", "ăn chậm", "Hàn Quốc")),
+    ("Pad Thái", "Phở xào kiểu Thái với tôm, đậu phụ, giá và lạc rang.", ("xào", "ngọt", "hải sản", "Thái Lan")),
+    ("Dimsum", "Nhiều món hấp nhỏ như xíu mại, há cảo, bánh bao.", ("hấp", "ăn chậm", "Trung Quốc")),
+    ("Pizza", "Bánh nướng phủ sốt cà chua, phô mai và nhân tùy chọn.", ("nướng", "ăn nhanh", "Ý")),
+    ("Mì Ý sốt bò bằm", "Mì spaghetti với sốt cà chua thịt bò bằm.", ("thịt", "Ý")),
+    ("Bò sốt vang", "Thịt bò hầm rượu vang với cà rốt, ăn kèm bánh mì.", ("thịt", "nóng", "ăn chậm", "Pháp", "sang trọng")),
+    ("Gà rán", "Gà tẩm bột chiên giòn.", ("chiên", "thịt", "ăn nhanh")),
+]
+
+class DishCatalog:
+    """
+    Tra cứu món ăn theo tiêu chí, dùng cho gợi ý món ăn khi không tìm thấy quán
+    
+    Chỉ mục ngược nhãn -> món được dựng một lần khi import nên việc tra cứu không cần gọi LLM.
+    """
+    
+    # Nhãn/tên món (chữ thường) -> tập chỉ số món
+    _index: Dict[str, Set[int]] = {}
+    # Nhãn/tên món (chữ thường) -> các từ của nhãn
+    _key_words: Dict[str, Tuple[str, ...]] = {}
+    
+    @classmethod
+    def _build_index(cls) -> None:
+        index: Dict[str, Set[int]] = {}
+        for position, (name, _, tags) in enumerate(DISHES):
+            for key in (name,) + tags:
+                index.setdefault(key.lower(), set()).add(position)
+        cls._index = index
+        cls._key_words = {key: _words(key) for key in index}
+    
+    @classmethod
+    def _matching_keys(cls, criterion: str) -> List[str]:
+        """
+        Các khóa của chỉ mục khớp với tiêu chí theo trọn từ: khóa nằm trong tiêu chí
+        ('đồ nướng' khớp 'nướng') hoặc tiêu chí nằm trong khóa ('phở' khớp 'phở bò').
+        Không so khớp một phần của từ, nên 'ý' không khớp 'quý' và 'bò' không khớp 'bòn bon'.
+        """
+        criterion = criterion.lower().strip()
+        if not criterion:
+            return []
+        if criterion in cls._index:
+            return [criterion]
+        words = _words(criterion)
+        if not words:
+            return []
+        return [
+            key for key, key_words in cls._key_words.items()
+            if _contains_words(words, key_words) or _contains_words(key_words, words)
+        ]
+    
+    @classmethod
+    def suggest(cls, criteria: List[str], count: int = 3) -> List[Dict[str, object]]:
+        """
+        Gợi ý món ăn phù hợp với tiêu chí
+        
+        Args:
+            criteria: Danh sách tiêu chí
+            count: Số lượng món cần gợi ý
+            
+        Returns:
+            Danh sách món (name, description, matched), món khớp nhiều tiêu chí nhất trước;
+            nếu không món nào khớp, trả về các món phổ biến nhất
+        """
+        scores: Dict[int, int] = {}
+        matched: Dict[int, List[str]] = {}
+        for criterion in criteria or []:
+            positions: Set[int] = set()
+            for key in cls._matching_keys(criterion):
+                positions |= cls._index[key]
+            for position in positions:
+                scores[position] = scores.get(position, 0) + 1
+                matched.setdefault(position, []).append(criterion)
+        
+        if scores:
+            ranked = sorted(scores, key=lambda position: (-scores[position], position))[:count]
+        else:
+            ranked = list(range(min(count, len(DISHES))))
+        
+        return [
+            {"name": DISHES[position][0], "description": DISHES[position][1], "matched": matched.get(position, [])}
+            for position in ranked
+        ]
+    
+    @staticmethod
+    def format_suggestions(dishes: List[Dict[str, object]]) -> str:
+        """Định dạng danh sách món ăn thành văn bản"""
+        lines = []
+        for i, dish in enumerate(dishes, 1):
+            line = f"{i}. {dish['name']}: {dish['description']}"
+            if dish["matched"]:
+                line += f" (phù hợp với: {', '.join(dish['matched'])})"
+            lines.append(line)
+        return "\n".join(lines)
+
+DishCatalog._build_index()
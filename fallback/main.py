@@ -1,41 +1,47 @@
+import os
 import logging
 from typing import List, Dict, Any, Optional
-from llm.main import generate_food_suggestions, get_model_response, client
+from llm.main import generate_food_suggestions, get_model_response, get_client, LLMUnavailableError
 from prompts.recommendation import SUGGEST_FOODS_SYSTEM, SUGGEST_FOODS_USER
+from metrics.main import timed
+from fallback.catalog import DishCatalog
+from budget.main import Deadline, BUDGET_LLM_MIN_S
+from render.templates import FOLLOW_UP, no_restaurants_header
 
-# Cấu hình logging
-logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Dùng LLM để gợi ý món ăn thay cho danh mục dựng sẵn (danh mục vẫn là phương án dự phòng)
+FALLBACK_USE_LLM = os.getenv("FALLBACK_USE_LLM", "false").lower() in ("1", "true", "yes")
+
 class FallbackHandler:
     """Xử lý các trường hợp đặc biệt khi không tìm thấy quán ăn hoặc xảy ra lỗi"""
     
     @staticmethod
-    def handle_no_restaurants(criteria: List[str]) -> str:
+    @timed("fallback")
+    def handle_no_restaurants(criteria: List[str], deadline: Optional[Deadline] = None) -> str:
         """
         Xử lý trường hợp không tìm thấy quán ăn
         
         Args:
             criteria: Danh sách tiêu chí
+            deadline: Hạn chót của lượt hội thoại; chỉ dùng danh mục nếu không đủ thời gian gọi model
             
         Returns:
             Chuỗi văn bản chứa gợi ý món ăn
         """
         try:
-            # Tạo thông báo
-            message = (
-                f"Tôi không thể tìm thấy quán ăn nào gần vị trí của bạn dựa trên tiêu chí ({', '.join(criteria)}).\n\n"
-                "Tuy nhiên, tôi có thể gợi ý một số món ăn phù hợp với tiêu chí của bạn:\n\n"
-            )
-            
-            # Gọi Gemini để gợi ý món ăn dựa trên tiêu chí
-            food_suggestions = generate_food_suggestions(criteria, count=3)
+            # Tra danh mục món ăn; chỉ gọi Gemini khi được bật
+            food_suggestions = None
+            if FALLBACK_USE_LLM and (deadline is None or deadline.allows(BUDGET_LLM_MIN_S, "fallback_llm")):
+                try:
+                    food_suggestions = generate_food_suggestions(criteria, count=3, deadline=deadline)
+                except LLMUnavailableError as e:
+                    logger.error(f"Không gọi được Gemini để gợi ý món ăn, dùng danh mục: {e}")
+            if not food_suggestions:
+                food_suggestions = DishCatalog.format_suggestions(DishCatalog.suggest(criteria, count=3))
             
             # Kết hợp thông báo và gợi ý
-            message += food_suggestions
-            message += "\n\nBạn có thể hỏi tôi về việc gợi ý món ăn bất cứ lúc nào."
-            
-            return message
+            return "".join((no_restaurants_header(criteria), food_suggestions, "\n\n", FOLLOW_UP))
             
         except Exception as e:
             logger.error(f"Lỗi khi xử lý trường hợp không tìm thấy quán ăn: {e}")
@@ -90,15 +96,14 @@ class FallbackHandler:
             Chuỗi văn bản chứa gợi ý món ăn
         """
         try:
-            # Xây dựng prompt cho Gemini
-            system_message = """Bạn là trợ lý AI giúp gợi ý món ăn.
-Hãy gợi ý 3 món ăn phổ biến và được nhiều người yêu thích.
-Đối với mỗi món, hãy cung cấp tên món và mô tả ngắn gọn."""
-            
-            user_message = "Gợi ý 3 món ăn phổ biến và được nhiều người yêu thích ở Việt Nam."
-            
-            # Gọi Gemini để gợi ý
-            response = get_model_response(client, system_message, user_message)
+            response = None
+            if FALLBACK_USE_LLM:
+                try:
+                    response = FallbackHandler._get_llm_generic_suggestions()
+                except LLMUnavailableError as e:
+                    logger.error(f"Không gọi được Gemini để gợi ý món ăn, dùng danh mục: {e}")
+            if not response:
+                response = DishCatalog.format_suggestions(DishCatalog.suggest([], count=3))
             
             # Tạo thông báo
             message = (
@@ -116,6 +121,19 @@ Hãy gợi ý 3 món ăn phổ biến và được nhiều người yêu thích.
                 "để tôi có thể gợi ý phù hợp hơn."
             )
     
+    @staticmethod
+    def _get_llm_generic_suggestions() -> str:
+        """Gợi ý 3 món ăn phổ biến bằng Gemini"""
+        # Xây dựng prompt cho Gemini
+        system_message = """Bạn là trợ lý AI giúp gợi ý món ăn.
+Hãy gợi ý 3 món ăn phổ biến và được nhiều người yêu thích.
+Đối với mỗi món, hãy cung cấp tên món và mô tả ngắn gọn."""
+        
+        user_message = "Gợi ý 3 món ăn phổ biến và được nhiều người yêu thích ở Việt Nam."
+        
+        # Gọi Gemini để gợi ý
+        return get_model_response(get_client(), system_message, user_message, task="food_suggestions")
+    
     @staticmethod
     def format_error_message(error: Exception) -> str:
         """
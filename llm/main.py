@@ -1,23 +1,441 @@
 import os
+import json
+import math
+import time
 import logging
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Optional, Tuple
+from metrics.main import inc, timed
+from budget.main import Deadline, BUDGET_LLM_MIN_S
+from render.templates import CRITERIA_CHOICES, CRITERIA_SUGGESTIONS_HINT, FOLLOW_UP
+from prompts.criteria import SUGGEST_CRITERIA_SYSTEM, SUGGEST_CRITERIA_USER
+from prompts.recommendation import RANK_RESTAURANTS_SYSTEM, RANK_RESTAURANTS_USER
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# Configure logging
-logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Load environment variables
 API_KEY = os.getenv("GOOGLE_API_KEY")
 MODEL_NAME = os.getenv("MODEL_NAME", "gemini-2.0-flash")
 
-# Initialize OpenAI client
-client = OpenAI(
-    api_key=API_KEY,
-    base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
+# Số lần thử lại khi gọi model lỗi; mỗi lần thử có thời gian chờ riêng, giới hạn bởi hạn chót của lượt
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "1"))
+# Thời gian chờ (giây) trước lần thử lại đầu tiên, gấp đôi sau mỗi lần
+LLM_RETRY_BACKOFF_S = float(os.getenv("LLM_RETRY_BACKOFF_S", "0.5"))
+
+# OpenAI client được tạo khi gọi model lần đầu (import openai mất vài trăm mili giây)
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Lấy OpenAI client dùng chung, tạo mới ở lần gọi đầu tiên"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(
+                    api_key=API_KEY,
+                    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
+                    # _complete tự thử lại để tính lại thời gian chờ theo hạn chót của lượt
+                    max_retries=0
+                )
+    return _client
+
+def __getattr__(name: str) -> Any:
+    """Giữ tương thích với llm.main.client: client chỉ được tạo khi được truy cập"""
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Circuit breaker: số lỗi liên tiếp để ngắt và thời gian (giây) trước khi thử lại
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_S = float(os.getenv("LLM_BREAKER_RESET_S", "30"))
+# Gửi thêm một yêu cầu song song nếu yêu cầu đầu chưa xong sau số giây này (0 để tắt)
+LLM_HEDGE_AFTER_S = float(os.getenv("LLM_HEDGE_AFTER_S", "0"))
+
+# Model nhỏ, nhanh cho các tác vụ phân loại/trích xuất ngắn
+FAST_MODEL_NAME = os.getenv("FAST_MODEL_NAME", "gemini-2.0-flash-lite")
+
+def _task_profile(task: str, model: str, max_tokens: Optional[int], temperature: Optional[float], timeout: float) -> Dict[str, Any]:
+    """
+    Cấu hình gọi model cho một tác vụ, ghi đè được bằng biến môi trường
+    LLM_<TASK>_MODEL, LLM_<TASK>_MAX_TOKENS, LLM_<TASK>_TEMPERATURE, LLM_<TASK>_TIMEOUT
+    """
+    prefix = f"LLM_{task.upper()}_"
+    max_tokens = os.getenv(prefix + "MAX_TOKENS", max_tokens)
+    temperature = os.getenv(prefix + "TEMPERATURE", temperature)
+    return {
+        "model": os.getenv(prefix + "MODEL", model),
+        "max_tokens": int(max_tokens) if max_tokens not in (None, "") else None,
+        "temperature": float(temperature) if temperature not in (None, "") else None,
+        "timeout": float(os.getenv(prefix + "TIMEOUT", timeout)),
+    }
+
+# Cấu hình theo tác vụ: phân loại/trích xuất dùng model nhanh với giới hạn đầu ra chặt,
+# các tác vụ sinh văn bản dùng model chính
+TASK_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default": _task_profile("default", MODEL_NAME, None, None, 30),
+    "intent": _task_profile("intent", FAST_MODEL_NAME, 5, 0.0, 5),
+    "extract_criteria": _task_profile("extract_criteria", FAST_MODEL_NAME, 100, 0.0, 10),
+    "criteria_suggestions": _task_profile("criteria_suggestions", FAST_MODEL_NAME, 100, 0.3, 10),
+    "analysis": _task_profile("analysis", FAST_MODEL_NAME, 300, 0.0, 15),
+    "summary": _task_profile("summary", FAST_MODEL_NAME, 500, 0.2, 30),
+    "ranking": _task_profile("ranking", FAST_MODEL_NAME, 100, 0.0, 15),
+    "confirmation": _task_profile("confirmation", MODEL_NAME, 300, 0.7, 15),
+    "food_suggestions": _task_profile("food_suggestions", MODEL_NAME, 800, 0.8, 30),
+    "chat": _task_profile("chat", MODEL_NAME, 800, 0.7, 30),
+}
+
+# Ngân sách token cho prompt
+LLM_HISTORY_TOKEN_BUDGET = int(os.getenv("LLM_HISTORY_TOKEN_BUDGET", "1500"))
+LLM_PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", "6000"))
+LLM_BOT_MESSAGE_MAX_CHARS = int(os.getenv("LLM_BOT_MESSAGE_MAX_CHARS", "400"))
+LLM_RANKING_MAX_RESTAURANTS = int(os.getenv("LLM_RANKING_MAX_RESTAURANTS", "10"))
+
+# Gom các yêu cầu nhỏ của nhiều người dùng vào một lần gọi model (0 để tắt)
+LLM_BATCH_WINDOW_MS = int(os.getenv("LLM_BATCH_WINDOW_MS", "0"))
+LLM_BATCH_MAX_ITEMS = int(os.getenv("LLM_BATCH_MAX_ITEMS", "16"))
+
+# Hướng dẫn bổ sung cho prompt gộp nhiều yêu cầu
+BATCH_SYSTEM_SUFFIX = """
+
+Bạn sẽ nhận nhiều yêu cầu độc lập, mỗi yêu cầu nằm trong thẻ <item id="..."> riêng.
+Hãy xử lý từng yêu cầu riêng biệt theo hướng dẫn ở trên.
+Chỉ trả về một đối tượng JSON, khóa là id của yêu cầu và giá trị là câu trả lời cho yêu cầu đó, không có giải thích hay định dạng khác."""
+
+# Yêu cầu model trả về JSON theo schema (response_format); tắt nếu API không hỗ trợ
+LLM_JSON_MODE = os.getenv("LLM_JSON_MODE", "true").lower() in ("1", "true", "yes")
+
+# Schema JSON cho các kết quả có cấu trúc
+_STRING_LIST = {"type": "array", "items": {"type": "string"}}
+
+CRITERIA_SCHEMA = {
+    "type": "object",
+    "properties": {"criteria": _STRING_LIST},
+    "required": ["criteria"],
+}
+
+RANKING_SCHEMA = {
+    "type": "object",
+    "properties": {"ranked_ids": {"type": "array", "items": {"type": "integer"}}},
+    "required": ["ranked_ids"],
+}
+
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "mentioned_foods": _STRING_LIST,
+        "mentioned_criteria": _STRING_LIST,
+        "user_preferences": _STRING_LIST,
+        "conversation_stage": {
+            "type": "string",
+            "enum": ["GREETING", "COLLECTING_CRITERIA", "CONFIRMING_CRITERIA", "WAITING_FOR_LOCATION", "SUGGESTING"],
+        },
+    },
+    "required": ["mentioned_foods", "mentioned_criteria", "user_preferences", "conversation_stage"],
+}
+
+SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "mentioned_foods": _STRING_LIST,
+        "mentioned_criteria": _STRING_LIST,
+        "user_preferences": _STRING_LIST,
+    },
+    "required": ["summary", "mentioned_foods", "mentioned_criteria", "user_preferences"],
+}
+
+# Các đoạn văn bản cố định trong tin nhắn của bot, không mang thông tin cho model.
+# Lấy từ render/templates.py để luôn khớp với câu chữ bot đang gửi.
+BOT_BOILERPLATE = (
+    CRITERIA_CHOICES,
+    CRITERIA_SUGGESTIONS_HINT,
+    "\n\n" + FOLLOW_UP,
 )
 
-def get_model_response(client, system_message, user_message):
+class PromptBudget:
+    """Ước lượng token và rút gọn lịch sử hội thoại để prompt không vượt ngân sách"""
+    
+    # Số ký tự trung bình của một token với văn bản tiếng Việt
+    CHARS_PER_TOKEN = 3
+    
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Ước lượng số token của văn bản"""
+        return math.ceil(len(text) / PromptBudget.CHARS_PER_TOKEN) if text else 0
+    
+    @staticmethod
+    def truncate(text: str, max_tokens: int) -> str:
+        """Cắt văn bản để không vượt quá max_tokens"""
+        max_chars = max_tokens * PromptBudget.CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        return text[:max_chars].rstrip() + "…"
+    
+    @staticmethod
+    def _compact_bot_message(content: str) -> str:
+        """Bỏ các đoạn văn bản cố định và cắt ngắn tin nhắn dài của bot"""
+        for boilerplate in BOT_BOILERPLATE:
+            content = content.replace(boilerplate, "")
+        if len(content) > LLM_BOT_MESSAGE_MAX_CHARS:
+            content = content[:LLM_BOT_MESSAGE_MAX_CHARS].rstrip() + "…"
+        return content
+    
+    @staticmethod
+    def compact_history(conversation_history: List[Dict[str, str]], budget: int = LLM_HISTORY_TOKEN_BUDGET) -> List[Dict[str, str]]:
+        """
+        Rút gọn lịch sử hội thoại trong giới hạn budget token
+        
+        Tin nhắn của bot được bỏ phần văn bản cố định và cắt ngắn; tin nhắn trùng
+        lặp của bot chỉ giữ lần gần nhất; sau đó giữ các tin nhắn gần đây nhất
+        vừa với ngân sách.
+        
+        Args:
+            conversation_history: Lịch sử hội thoại (role, content)
+            budget: Số token tối đa của lịch sử
+            
+        Returns:
+            Lịch sử hội thoại đã rút gọn, theo thứ tự thời gian
+        """
+        compacted: List[Dict[str, str]] = []
+        seen_bot_messages = set()
+        used = 0
+        
+        # Duyệt từ tin nhắn mới nhất về cũ nhất
+        for message in reversed(conversation_history):
+            content = message["content"]
+            if message["role"] != "user":
+                content = PromptBudget._compact_bot_message(content)
+                if content in seen_bot_messages:
+                    continue
+                seen_bot_messages.add(content)
+            
+            tokens = PromptBudget.estimate_tokens(content)
+            if used + tokens > budget:
+                break
+            used += tokens
+            compacted.append({**message, "content": content})
+        
+        compacted.reverse()
+        return compacted
+    
+    @staticmethod
+    def format_history_text(conversation_history: List[Dict[str, str]], budget: int = LLM_HISTORY_TOKEN_BUDGET) -> str:
+        """Chuyển lịch sử hội thoại đã rút gọn thành văn bản User/Bot"""
+        lines = []
+        for message in PromptBudget.compact_history(conversation_history, budget):
+            role = "User" if message["role"] == "user" else "Bot"
+            lines.append(f"{role}: {message['content']}")
+        return "\n\n".join(lines)
+
+def _record_usage(completion, messages: List[Dict[str, str]], model: str) -> None:
+    """Ghi nhận số token prompt/completion của một lần gọi model"""
+    usage = getattr(completion, "usage", None)
+    if usage is not None:
+        prompt_tokens = usage.prompt_tokens or 0
+        completion_tokens = usage.completion_tokens or 0
+    else:
+        # Ước lượng khi API không trả về số token
+        prompt_tokens = sum(PromptBudget.estimate_tokens(message["content"]) for message in messages)
+        completion_tokens = PromptBudget.estimate_tokens(completion.choices[0].message.content or "")
+    
+    # Ghi log cả khi metrics bị tắt để vẫn theo dõi được số token đã dùng
+    logger.info(f"LLM call ({model}): prompt_tokens={prompt_tokens}, completion_tokens={completion_tokens}")
+    inc("llm_tokens_total", prompt_tokens, model=model, kind="prompt")
+    inc("llm_tokens_total", completion_tokens, model=model, kind="completion")
+
+class LLMUnavailableError(Exception):
+    """Không gọi được model: lỗi API, hết thời gian chờ hoặc circuit breaker đang ngắt"""
+
+class CircuitBreaker:
+    """
+    Circuit breaker cho một model
+    
+    Sau LLM_BREAKER_FAILURES lỗi liên tiếp, mọi lần gọi bị từ chối ngay trong
+    LLM_BREAKER_RESET_S giây. Hết thời gian đó, một lần gọi thử được cho qua:
+    thành công thì đóng lại, lỗi thì ngắt tiếp.
+    """
+    
+    def __init__(self, name: str, failure_threshold: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET_S):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self) -> str:
+        """closed, open hoặc half_open"""
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+    
+    def allow(self) -> bool:
+        """Cho phép gọi model hay không"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._probing:
+                return False
+            # Chỉ một lần gọi thử tại một thời điểm
+            self._probing = True
+            return True
+    
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+    
+    def release(self) -> None:
+        """
+        Kết thúc lần gọi mà không tính là thành công hay lỗi (ví dụ: lỗi do chính yêu cầu)
+        
+        Giữ nguyên số lỗi và trạng thái ngắt, chỉ cho phép một lần gọi thử khác.
+        """
+        with self._lock:
+            self._probing = False
+    
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    logger.error(f"Ngắt circuit breaker của model {self.name} sau {self.failures} lỗi")
+                    inc("llm_breaker_open_total", model=self.name)
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+# Circuit breaker theo model
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(model: str) -> CircuitBreaker:
+    """Lấy circuit breaker của model"""
+    with _breakers_lock:
+        breaker = _breakers.get(model)
+        if breaker is None:
+            breaker = _breakers[model] = CircuitBreaker(model)
+        return breaker
+
+def _client_errors() -> Tuple[type, ...]:
+    """Lỗi do chính yêu cầu (không phải do model quá tải/sập), không tính vào circuit breaker"""
+    import openai
+    return (openai.BadRequestError, openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError)
+
+# Thread pool cho các yêu cầu gửi song song (hedging)
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_lock = threading.Lock()
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    global _hedge_executor
+    with _hedge_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="llm-hedge")
+        return _hedge_executor
+
+def _create_completion(client, request: Dict[str, Any]):
+    """
+    Gọi API; nếu bật hedging và yêu cầu đầu chưa xong sau LLM_HEDGE_AFTER_S giây,
+    gửi thêm một yêu cầu giống hệt và dùng kết quả thành công đầu tiên
+    """
+    if LLM_HEDGE_AFTER_S <= 0:
+        return client.chat.completions.create(**request)
+    
+    executor = _get_hedge_executor()
+    first = executor.submit(client.chat.completions.create, **request)
+    done, _ = wait([first], timeout=LLM_HEDGE_AFTER_S)
+    if done:
+        return first.result()
+    
+    inc("llm_hedged_total", model=request["model"])
+    pending = {first, executor.submit(client.chat.completions.create, **request)}
+    error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    raise error
+
+def _complete(client, messages: List[Dict[str, str]], task: str = "default", batch_size: int = 1, deadline: Optional[Deadline] = None, **kwargs: Any) -> str:
+    """
+    Gọi model với danh sách tin nhắn theo cấu hình của tác vụ, ghi nhận số liệu
+    và trả về nội dung câu trả lời
+    
+    Args:
+        client: OpenAI client
+        messages: Danh sách tin nhắn
+        task: Tên tác vụ trong TASK_PROFILES
+        batch_size: Số yêu cầu được gộp trong prompt (giới hạn token đầu ra được nhân lên tương ứng)
+        deadline: Hạn chót của lượt hội thoại, giới hạn thời gian chờ (không bắt buộc)
+    
+    Lỗi không phải do yêu cầu được thử lại tối đa LLM_MAX_RETRIES lần. Thời gian chờ
+    của mỗi lần thử được tính lại theo thời gian còn lại của lượt, và không thử lại
+    khi thời gian còn lại ít hơn BUDGET_LLM_MIN_S.
+    """
+    profile = TASK_PROFILES.get(task, TASK_PROFILES["default"])
+    model = profile["model"]
+    if profile["max_tokens"] is not None:
+        # Prompt gộp cần thêm chỗ cho khung JSON bao quanh từng câu trả lời
+        overhead = 20 * batch_size if batch_size > 1 else 0
+        kwargs.setdefault("max_tokens", profile["max_tokens"] * batch_size + overhead)
+    if profile["temperature"] is not None:
+        kwargs.setdefault("temperature", profile["temperature"])
+    timeout = kwargs.pop("timeout", None)
+    
+    breaker = get_breaker(model)
+    if not breaker.allow():
+        inc("llm_requests_total", model=model, task=task, outcome="rejected")
+        raise LLMUnavailableError(f"Circuit breaker của model {model} đang ngắt")
+    
+    completion = None
+    error: Optional[Exception] = None
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        if attempt:
+            if deadline is not None and not deadline.allows(BUDGET_LLM_MIN_S, "llm_retry"):
+                break
+            inc("llm_retries_total", model=model, task=task)
+            time.sleep(LLM_RETRY_BACKOFF_S * 2 ** (attempt - 1))
+        
+        request = {"model": model, "messages": messages, **kwargs}
+        request["timeout"] = Deadline.timeout_for(deadline, profile["timeout"]) if timeout is None else timeout
+        try:
+            completion = _create_completion(client, request)
+            break
+        except _client_errors() as e:
+            # Yêu cầu sai không cho biết model còn hoạt động hay không
+            breaker.release()
+            inc("llm_requests_total", model=model, task=task, outcome="error")
+            raise LLMUnavailableError(f"Model {model} từ chối yêu cầu: {e}") from e
+        except Exception as e:
+            logger.warning(f"Lần gọi model {model} thứ {attempt + 1} lỗi: {e}")
+            error = e
+    
+    if completion is None:
+        breaker.record_failure()
+        inc("llm_requests_total", model=model, task=task, outcome="error")
+        raise LLMUnavailableError(f"Không gọi được model {model}: {error}") from error
+    breaker.record_success()
+    inc("llm_requests_total", model=model, task=task, outcome="ok")
+    _record_usage(completion, messages, model)
+    return completion.choices[0].message.content
+
+@timed("llm")
+def get_model_response(client, system_message, user_message, task="default", batch_size=1, deadline=None):
     """
     Get response from the model using the provided client and messages.
     
@@ -25,23 +443,27 @@ def get_model_response(client, system_message, user_message):
         client: OpenAI client instance
         system_message (str): System message to set model behavior
         user_message (str): User's input message
+        task (str): Task name in TASK_PROFILES (model, max_tokens, temperature, timeout)
+        batch_size (int): Number of requests packed into the prompt
+        deadline (Deadline): Turn deadline bounding the call timeout (optional)
     
     Returns:
         str: Model's response content
+    
+    Raises:
+        LLMUnavailableError: If the model call failed or the circuit breaker is open
     """
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": PromptBudget.truncate(user_message, LLM_PROMPT_TOKEN_BUDGET)},
+    ]
     try:
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message},
-            ]
-        )
-        return completion.choices[0].message.content
-    except Exception as e:
+        return _complete(client, messages, task, batch_size, deadline)
+    except LLMUnavailableError as e:
         logger.error(f"Error getting model response: {e}")
-        return "Xin lỗi, tôi đang gặp sự cố khi xử lý yêu cầu của bạn. Vui lòng thử lại sau."
+        raise
 
+@timed("chat")
 def get_model_response_with_history(client, system_message, conversation_history, user_message):
     """
     Get response from the model using the provided client, conversation history, and messages.
@@ -54,28 +476,250 @@ def get_model_response_with_history(client, system_message, conversation_history
     
     Returns:
         str: Model's response content
+    
+    Raises:
+        LLMUnavailableError: If the model call failed or the circuit breaker is open
+    """
+    # Prepare messages with conversation history
+    messages = [{"role": "system", "content": system_message}]
+    
+    # Add conversation history (trimmed to the token budget)
+    messages.extend(PromptBudget.compact_history(conversation_history))
+    
+    # Add current user message
+    messages.append({"role": "user", "content": user_message})
+    
+    # Get completion
+    try:
+        return _complete(client, messages, "chat")
+    except LLMUnavailableError as e:
+        logger.error(f"Error getting model response with history: {e}")
+        raise
+
+class StructuredOutputError(ValueError):
+    """Model không trả về JSON hợp lệ theo schema, kể cả sau lần sửa lỗi"""
+
+def _loads_json(text: str) -> Any:
+    """Giải mã JSON trong câu trả lời của model (bỏ khối ```json nếu có)"""
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.startswith("json"):
+            text = text[4:]
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def _validate(value: Any, schema: Dict[str, Any], path: str = "$") -> None:
+    """
+    Kiểm tra giá trị theo tập con của JSON Schema dùng trong module này
+    (type, properties, required, items, enum)
+    
+    Raises:
+        StructuredOutputError: Nếu giá trị không khớp schema
+    """
+    expected = schema.get("type")
+    checks = {
+        "object": lambda v: isinstance(v, dict),
+        "array": lambda v: isinstance(v, list),
+        "string": lambda v: isinstance(v, str),
+        "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+        "boolean": lambda v: isinstance(v, bool),
+    }
+    if expected in checks and not checks[expected](value):
+        raise StructuredOutputError(f"{path}: cần kiểu {expected}")
+    if "enum" in schema and value not in schema["enum"]:
+        raise StructuredOutputError(f"{path}: giá trị phải thuộc {schema['enum']}")
+    if expected == "object":
+        for key in schema.get("required", []):
+            if key not in value:
+                raise StructuredOutputError(f"{path}: thiếu trường {key}")
+        for key, property_schema in schema.get("properties", {}).items():
+            if key in value:
+                _validate(value[key], property_schema, f"{path}.{key}")
+    elif expected == "array" and "items" in schema:
+        for index, item in enumerate(value):
+            _validate(item, schema["items"], f"{path}[{index}]")
+
+@timed("llm")
+def get_structured_response(client, system_message: str, user_message: str, schema_name: str, schema: Dict[str, Any], task: Optional[str] = None, batch_size: int = 1, deadline: Optional[Deadline] = None) -> Any:
     """
+    Gọi model ở chế độ JSON theo schema và trả về kết quả đã kiểm tra
+    
+    Nếu kết quả không hợp lệ, model được yêu cầu sửa lại đúng một lần (nếu còn thời gian).
+    
+    Args:
+        client: OpenAI client
+        system_message: System prompt
+        user_message: Nội dung yêu cầu
+        schema_name: Tên schema (dùng cho response_format và số liệu)
+        schema: JSON Schema của kết quả
+        task: Tên tác vụ trong TASK_PROFILES (mặc định là schema_name)
+        batch_size: Số yêu cầu được gộp trong prompt
+        deadline: Hạn chót của lượt hội thoại (không bắt buộc)
+        
+    Returns:
+        Giá trị JSON đã giải mã và khớp schema
+        
+    Raises:
+        StructuredOutputError: Nếu cả hai lần đều không hợp lệ
+        LLMUnavailableError: Nếu không gọi được model
+    """
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": PromptBudget.truncate(user_message, LLM_PROMPT_TOKEN_BUDGET)},
+    ]
+    kwargs: Dict[str, Any] = {}
+    if LLM_JSON_MODE:
+        kwargs["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": schema_name, "schema": schema},
+        }
+    
+    response = _complete(client, messages, task or schema_name, batch_size, deadline, **kwargs)
+    try:
+        result = _loads_json(response)
+        _validate(result, schema)
+        inc("llm_structured_total", schema=schema_name, outcome="ok")
+        return result
+    except ValueError as e:
+        error = e
+    
+    # Sửa lỗi một lần: gửi lại câu trả lời sai kèm mô tả lỗi
+    logger.warning(f"Kết quả JSON không hợp lệ ({schema_name}): {error}")
+    if deadline is not None and not deadline.allows(BUDGET_LLM_MIN_S, "llm_repair"):
+        inc("llm_structured_total", schema=schema_name, outcome="invalid")
+        raise StructuredOutputError(f"{schema_name}: {error}")
+    messages += [
+        {"role": "assistant", "content": response or ""},
+        {"role": "user", "content": f"Kết quả trên không hợp lệ ({error}). Hãy trả lại chỉ một đối tượng JSON đúng theo schema: {json.dumps(schema, ensure_ascii=False)}"},
+    ]
+    response = _complete(client, messages, task or schema_name, batch_size, deadline, **kwargs)
     try:
-        # Prepare messages with conversation history
-        messages = [{"role": "system", "content": system_message}]
+        result = _loads_json(response)
+        _validate(result, schema)
+    except ValueError as e:
+        inc("llm_structured_total", schema=schema_name, outcome="invalid")
+        raise StructuredOutputError(f"{schema_name}: {e}") from e
+    inc("llm_structured_total", schema=schema_name, outcome="repaired")
+    return result
+
+# Câu trả lời dạng văn bản trong kết quả của một nhóm: danh sách các dòng
+_TEXT_ANSWER_SCHEMA = {"type": "array", "items": {"type": "string"}}
+
+class MicroBatcher:
+    """
+    Gom các yêu cầu giống nhau (cùng system prompt) từ nhiều thread trong một cửa sổ ngắn
+    và gửi chúng trong một lần gọi model, sau đó tách câu trả lời cho từng yêu cầu.
+    
+    Yêu cầu đầu tiên của cửa sổ chờ hết cửa sổ rồi gửi cả nhóm; nhóm đầy thì gửi ngay.
+    submit() chặn thread gọi cho đến khi có câu trả lời, nên cần được gọi ngoài event loop
+    (ví dụ qua asyncio.to_thread) thì mới gom được yêu cầu của nhiều người dùng.
+    
+    Nếu có schema, mỗi câu trả lời là JSON đã kiểm tra theo schema thay vì văn bản.
+    """
+    
+    def __init__(self, name: str, system_message: str, schema: Optional[Dict[str, Any]] = None, window_ms: int = LLM_BATCH_WINDOW_MS, max_items: int = LLM_BATCH_MAX_ITEMS):
+        self.name = name
+        self.system_message = system_message
+        self.schema = schema
+        self.window = window_ms / 1000
+        self.max_items = max(1, max_items)
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, Future]] = []
+        self._generation = 0
+    
+    def submit(self, user_message: str) -> Any:
+        """
+        Gửi một yêu cầu và chờ câu trả lời
         
-        # Add conversation history
-        for message in conversation_history:
-            messages.append(message)
+        Args:
+            user_message: Nội dung yêu cầu
+            
+        Returns:
+            Câu trả lời của model cho yêu cầu này (văn bản, hoặc JSON nếu có schema)
+            
+        Raises:
+            ValueError: Nếu không tách được câu trả lời từ kết quả của cả nhóm
+        """
+        if self.window <= 0:
+            return self._call_single(user_message)
         
-        # Add current user message
-        messages.append({"role": "user", "content": user_message})
+        future: Future = Future()
+        batch = None
+        with self._lock:
+            self._pending.append((user_message, future))
+            generation = self._generation
+            leader = len(self._pending) == 1
+            if len(self._pending) >= self.max_items:
+                batch = self._take()
         
-        # Get completion
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=messages
-        )
+        if batch is None and leader:
+            # Chờ hết cửa sổ, hoặc đến khi nhóm được gửi sớm vì đầy và đã có câu trả lời
+            wait([future], timeout=self.window)
+            with self._lock:
+                # Nhóm có thể đã được gửi sớm vì đầy
+                if self._generation == generation:
+                    batch = self._take()
         
-        return completion.choices[0].message.content
-    except Exception as e:
-        logger.error(f"Error getting model response with history: {e}")
-        return "Xin lỗi, tôi đang gặp sự cố khi xử lý yêu cầu của bạn. Vui lòng thử lại sau."
+        if batch:
+            self._run(batch)
+        return future.result()
+    
+    def _take(self) -> List[Tuple[str, Future]]:
+        """Lấy nhóm yêu cầu đang chờ (gọi khi đang giữ lock)"""
+        batch, self._pending = self._pending, []
+        self._generation += 1
+        return batch
+    
+    def _call_single(self, user_message: str) -> Any:
+        """Gửi riêng một yêu cầu"""
+        if self.schema is not None:
+            return get_structured_response(get_client(), self.system_message, user_message, self.name, self.schema)
+        return get_model_response(get_client(), self.system_message, user_message, self.name)
+    
+    def _call_batch(self, prompt: str, size: int) -> Dict[str, Any]:
+        """
+        Gửi prompt gộp và trả về câu trả lời theo id
+        
+        Kết quả của nhóm luôn được kiểm tra theo schema (và được sửa lại một lần nếu sai).
+        Không có schema thì mỗi câu trả lời là danh sách các dòng, được ghép lại thành văn bản.
+        """
+        system_message = self.system_message + BATCH_SYSTEM_SUFFIX
+        ids = [str(i) for i in range(1, size + 1)]
+        item_schema = self.schema if self.schema is not None else _TEXT_ANSWER_SCHEMA
+        schema = {"type": "object", "properties": {i: item_schema for i in ids}, "required": ids}
+        answers = get_structured_response(get_client(), system_message, prompt, f"{self.name}_batch", schema, self.name, size)
+        if self.schema is None:
+            return {key: "\n".join(answers[key]) for key in ids}
+        return answers
+    
+    def _run(self, batch: List[Tuple[str, Future]]) -> None:
+        """Gửi một nhóm yêu cầu và trả kết quả cho từng yêu cầu"""
+        inc("llm_batches_total", batcher=self.name)
+        inc("llm_batch_items_total", len(batch), batcher=self.name)
+        
+        if len(batch) == 1:
+            user_message, future = batch[0]
+            try:
+                future.set_result(self._call_single(user_message))
+            except Exception as e:
+                future.set_exception(e)
+            return
+        
+        prompt = "\n\n".join(f'<item id="{i}">\n{user_message}\n</item>' for i, (user_message, _) in enumerate(batch, 1))
+        try:
+            answers = self._call_batch(prompt, len(batch))
+        except Exception as e:
+            logger.error(f"Lỗi khi xử lý nhóm yêu cầu {self.name}: {e}")
+            answers = {}
+        
+        for i, (_, future) in enumerate(batch, 1):
+            answer = answers.get(str(i))
+            if answer is None:
+                future.set_exception(ValueError(f"Không có câu trả lời cho yêu cầu {i} trong nhóm {self.name}"))
+            else:
+                future.set_result(answer)
 
 def analyze_conversation_history(conversation_history: List[Dict[str, str]]) -> Dict[str, Any]:
     """
@@ -93,11 +737,8 @@ def analyze_conversation_history(conversation_history: List[Dict[str, str]]) ->
 Nhiệm vụ của bạn là phân tích lịch sử hội thoại và trích xuất thông tin quan trọng.
 Hãy trả về kết quả dưới dạng JSON với các trường: mentioned_foods, mentioned_criteria, user_preferences, và conversation_stage."""
         
-        # Chuyển đổi lịch sử hội thoại thành văn bản
-        conversation_text = ""
-        for message in conversation_history:
-            role = "User" if message["role"] == "user" else "Bot"
-            conversation_text += f"{role}: {message['content']}\n\n"
+        # Chuyển đổi lịch sử hội thoại thành văn bản (trong giới hạn ngân sách token)
+        conversation_text = PromptBudget.format_history_text(conversation_history)
         
         user_message = f"""Phân tích lịch sử hội thoại sau và trích xuất thông tin quan trọng:
 
@@ -106,36 +747,58 @@ Hãy trả về kết quả dưới dạng JSON với các trường: mentioned_
 Trả về kết quả dưới dạng JSON với các trường:
 - mentioned_foods: Danh sách các món ăn được nhắc đến
 - mentioned_criteria: Danh sách các tiêu chí món ăn được nhắc đến
-- user_preferences: Các sở thích của người dùng
+- user_preferences: Danh sách các sở thích của người dùng
 - conversation_stage: Giai đoạn hiện tại của hội thoại (GREETING, COLLECTING_CRITERIA, CONFIRMING_CRITERIA, WAITING_FOR_LOCATION, SUGGESTING)"""
         
-        # Gọi Gemini để phân tích
-        response = get_model_response(client, system_message, user_message)
-        
-        # Xử lý kết quả (giả định kết quả là JSON)
-        # Trong thực tế, bạn nên thêm xử lý lỗi và parsing JSON ở đây
-        import json
-        try:
-            analysis = json.loads(response)
-            return analysis
-        except json.JSONDecodeError:
-            logger.error(f"Error parsing JSON response: {response}")
-            return {
-                "mentioned_foods": [],
-                "mentioned_criteria": [],
-                "user_preferences": {},
-                "conversation_stage": "UNKNOWN"
-            }
+        # Gọi Gemini để phân tích (kết quả JSON theo schema)
+        return get_structured_response(get_client(), system_message, user_message, "conversation_analysis", ANALYSIS_SCHEMA, "analysis")
             
     except Exception as e:
         logger.error(f"Error analyzing conversation history: {e}")
         return {
             "mentioned_foods": [],
             "mentioned_criteria": [],
-            "user_preferences": {},
+            "user_preferences": [],
             "conversation_stage": "UNKNOWN"
         }
 
+def summarize_conversation(previous_summary: Optional[Dict[str, Any]], conversation_history: List[Dict[str, str]]) -> Dict[str, Any]:
+    """
+    Tóm tắt các lượt hội thoại cũ, kết hợp với bản tóm tắt trước đó.
+    
+    Dùng cùng các trường như analyze_conversation_history, thêm trường summary.
+    
+    Args:
+        previous_summary: Bản tóm tắt trước đó (summary, mentioned_foods, mentioned_criteria, user_preferences) hoặc None
+        conversation_history: Các tin nhắn cần tóm tắt
+        
+    Returns:
+        Dict gồm summary, mentioned_foods, mentioned_criteria, user_preferences
+    """
+    previous_summary = previous_summary or {}
+    system_message = """Bạn là trợ lý AI tóm tắt hội thoại.
+Nhiệm vụ của bạn là gộp bản tóm tắt trước đó với các tin nhắn mới thành một bản tóm tắt ngắn gọn.
+Hãy trả về kết quả dưới dạng JSON với các trường: summary, mentioned_foods, mentioned_criteria, user_preferences."""
+    
+    # Các tin nhắn được tóm tắt đã nằm ngoài ngân sách của lịch sử gần đây nên không cần rút gọn thêm
+    conversation_text = PromptBudget.format_history_text(conversation_history, LLM_PROMPT_TOKEN_BUDGET)
+    
+    user_message = f"""Bản tóm tắt trước đó:
+{json.dumps(previous_summary, ensure_ascii=False) if previous_summary else "Chưa có"}
+
+Các tin nhắn mới:
+
+{conversation_text}
+
+Trả về kết quả dưới dạng JSON với các trường:
+- summary: Tóm tắt hội thoại, tối đa 3 câu
+- mentioned_foods: Danh sách các món ăn được nhắc đến
+- mentioned_criteria: Danh sách các tiêu chí món ăn được nhắc đến
+- user_preferences: Danh sách các sở thích của người dùng"""
+    
+    result = get_structured_response(get_client(), system_message, user_message, "conversation_summary", SUMMARY_SCHEMA, "summary")
+    return {field: result[field] for field in SUMMARY_SCHEMA["required"]}
+
 def suggest_additional_criteria(current_criteria: List[str], conversation_history: List[Dict[str, str]], max_suggestions: int = 2) -> List[str]:
     """
     Sử dụng Gemini để gợi ý thêm tiêu chí dựa trên lịch sử hội thoại và tiêu chí hiện có.
@@ -149,31 +812,18 @@ def suggest_additional_criteria(current_criteria: List[str], conversation_histor
         Danh sách các tiêu chí được gợi ý thêm
     """
     try:
-        # Xây dựng prompt cho Gemini
-        system_message = """Bạn là trợ lý AI giúp gợi ý tiêu chí cho món ăn.
-Dựa vào các tiêu chí hiện có và lịch sử hội thoại, hãy gợi ý thêm tiêu chí phù hợp.
-Chỉ trả về danh sách các tiêu chí, mỗi tiêu chí một dòng, không có giải thích hay định dạng khác."""
-        
-        # Chuyển đổi lịch sử hội thoại thành văn bản
-        conversation_text = ""
-        for message in conversation_history:
-            role = "User" if message["role"] == "user" else "Bot"
-            conversation_text += f"{role}: {message['content']}\n\n"
+        # Chuyển đổi lịch sử hội thoại thành văn bản (trong giới hạn ngân sách token)
+        conversation_text = PromptBudget.format_history_text(conversation_history)
         
-        user_message = f"""Dựa vào lịch sử hội thoại sau:
-
-{conversation_text}
-
-Và các tiêu chí hiện có: {', '.join(current_criteria) if current_criteria else 'Chưa có tiêu chí nào'}
-
-Hãy gợi ý thêm {max_suggestions} tiêu chí phù hợp để tìm kiếm món ăn.
-Chỉ trả về danh sách các tiêu chí, mỗi tiêu chí một dòng, không có giải thích hay định dạng khác."""
+        user_message = SUGGEST_CRITERIA_USER.format(
+            conversation_text=conversation_text,
+            current_criteria=', '.join(current_criteria) if current_criteria else 'Chưa có tiêu chí nào',
+            max_suggestions=max_suggestions
+        )
         
         # Gọi Gemini để gợi ý
-        response = get_model_response(client, system_message, user_message)
-        
-        # Xử lý kết quả
-        suggested_criteria = [line.strip() for line in response.strip().split('\n') if line.strip()]
+        result = get_structured_response(get_client(), SUGGEST_CRITERIA_SYSTEM, user_message, "criteria", CRITERIA_SCHEMA, "criteria_suggestions")
+        suggested_criteria = [criterion.strip() for criterion in result["criteria"] if criterion.strip()]
         
         # Giới hạn số lượng gợi ý
         return suggested_criteria[:max_suggestions]
@@ -182,13 +832,15 @@ Chỉ trả về danh sách các tiêu chí, mỗi tiêu chí một dòng, khôn
         logger.error(f"Error suggesting additional criteria: {e}")
         return []
 
-def rank_restaurants_by_criteria(restaurants: List[Dict[str, Any]], criteria: List[str]) -> List[Dict[str, Any]]:
+@timed("ranking")
+def rank_restaurants_by_criteria(restaurants: List[Dict[str, Any]], criteria: List[str], deadline: Optional[Deadline] = None) -> List[Dict[str, Any]]:
     """
     Sử dụng Gemini để xếp hạng các quán ăn dựa trên tiêu chí.
     
     Args:
         restaurants: Danh sách quán ăn
         criteria: Danh sách tiêu chí
+        deadline: Hạn chót của lượt hội thoại; giữ nguyên thứ tự nếu không đủ thời gian gọi model
         
     Returns:
         Danh sách quán ăn đã được xếp hạng
@@ -196,15 +848,17 @@ def rank_restaurants_by_criteria(restaurants: List[Dict[str, Any]], criteria: Li
     if not restaurants or len(restaurants) <= 1:
         return restaurants
     
+    if deadline is not None and not deadline.allows(BUDGET_LLM_MIN_S, "llm_ranking"):
+        return restaurants
+    
+    # Chỉ gửi các quán đầu danh sách cho model, các quán còn lại giữ nguyên thứ tự
+    candidates = restaurants[:LLM_RANKING_MAX_RESTAURANTS]
+    remaining = restaurants[LLM_RANKING_MAX_RESTAURANTS:]
+    
     try:
-        # Xây dựng prompt cho Gemini
-        system_message = """Bạn là trợ lý AI giúp xếp hạng các quán ăn dựa trên tiêu chí.
-Nhiệm vụ của bạn là phân tích thông tin các quán ăn và xếp hạng chúng dựa trên mức độ phù hợp với tiêu chí.
-Hãy trả về danh sách các ID quán ăn theo thứ tự từ phù hợp nhất đến ít phù hợp nhất, mỗi ID một dòng."""
-        
         # Chuẩn bị thông tin quán ăn
         restaurants_info = ""
-        for i, restaurant in enumerate(restaurants):
+        for i, restaurant in enumerate(candidates):
             restaurants_info += f"ID: {i}\n"
             restaurants_info += f"Tên: {restaurant.get('name', 'Không có tên')}\n"
             restaurants_info += f"Loại: {restaurant.get('type', 'Không xác định')}\n"
@@ -212,44 +866,27 @@ Hãy trả về danh sách các ID quán ăn theo thứ tự từ phù hợp nh
             restaurants_info += f"Địa chỉ: {restaurant.get('address', 'Không có địa chỉ')}\n"
             restaurants_info += f"Khoảng cách: {restaurant.get('distance', 'Không xác định')} mét\n"
             if restaurant.get('opening_hours'):
-                restaurants_info += f"Giờ mở cửa: {restaurant['opening_hours']}\n"
+                restaurants_info += f"Giờ mở cửa: {PromptBudget.truncate(restaurant['opening_hours'], 20)}\n"
             restaurants_info += "\n"
         
-        user_message = f"""Dựa vào danh sách quán ăn sau:
-
-{restaurants_info}
-
-Và các tiêu chí: {', '.join(criteria)}
-
-Hãy xếp hạng các quán ăn dựa trên mức độ phù hợp với tiêu chí.
-Chỉ trả về danh sách các ID quán ăn theo thứ tự từ phù hợp nhất đến ít phù hợp nhất, mỗi ID một dòng."""
+        user_message = RANK_RESTAURANTS_USER.format(restaurants_info=restaurants_info, criteria=', '.join(criteria))
         
         # Gọi Gemini để xếp hạng
-        response = get_model_response(client, system_message, user_message)
+        result = get_structured_response(get_client(), RANK_RESTAURANTS_SYSTEM, user_message, "ranking", RANKING_SCHEMA, deadline=deadline)
         
-        # Xử lý kết quả
-        ranked_ids = []
-        for line in response.strip().split('\n'):
-            try:
-                # Trích xuất ID từ mỗi dòng
-                id_str = line.strip()
-                # Loại bỏ các ký tự không phải số
-                id_str = ''.join(c for c in id_str if c.isdigit())
-                if id_str:
-                    ranked_ids.append(int(id_str))
-            except ValueError:
-                continue
-        
-        # Lọc các ID hợp lệ
-        valid_ids = [i for i in ranked_ids if 0 <= i < len(restaurants)]
+        # Lọc các ID hợp lệ (bỏ ID trùng)
+        valid_ids = []
+        for i in result["ranked_ids"]:
+            if 0 <= i < len(candidates) and i not in valid_ids:
+                valid_ids.append(i)
         
         # Thêm các ID còn lại nếu có
-        for i in range(len(restaurants)):
+        for i in range(len(candidates)):
             if i not in valid_ids:
                 valid_ids.append(i)
         
         # Xếp hạng quán ăn theo thứ tự ID
-        ranked_restaurants = [restaurants[i] for i in valid_ids]
+        ranked_restaurants = [candidates[i] for i in valid_ids] + remaining
         
         return ranked_restaurants
         
@@ -257,24 +894,27 @@ Chỉ trả về danh sách các ID quán ăn theo thứ tự từ phù hợp nh
         logger.error(f"Error ranking restaurants: {e}")
         return restaurants
 
-def generate_food_suggestions(criteria: List[str], count: int = 3) -> str:
+def generate_food_suggestions(criteria: List[str], count: int = 3, deadline: Optional[Deadline] = None) -> str:
     """
     Sử dụng Gemini để gợi ý món ăn dựa trên tiêu chí.
     
     Args:
         criteria: Danh sách tiêu chí
         count: Số lượng món ăn cần gợi ý
+        deadline: Hạn chót của lượt hội thoại (không bắt buộc)
         
     Returns:
         Chuỗi văn bản chứa gợi ý món ăn
+        
+    Raises:
+        LLMUnavailableError: Nếu không gọi được model
     """
-    try:
-        # Xây dựng prompt cho Gemini
-        system_message = """Bạn là trợ lý AI giúp gợi ý món ăn.
+    # Xây dựng prompt cho Gemini
+    system_message = """Bạn là trợ lý AI giúp gợi ý món ăn.
 Nhiệm vụ của bạn là gợi ý các món ăn phù hợp với tiêu chí của người dùng.
 Hãy cung cấp tên món, mô tả ngắn gọn, và lý do tại sao món đó phù hợp với tiêu chí."""
-        
-        user_message = f"""Dựa vào các tiêu chí: {', '.join(criteria)}
+    
+    user_message = f"""Dựa vào các tiêu chí: {', '.join(criteria)}
 
 Hãy gợi ý {count} món ăn phù hợp.
 Đối với mỗi món, hãy cung cấp:
@@ -283,13 +923,8 @@ Hãy gợi ý {count} món ăn phù hợp.
 3. Lý do tại sao món đó phù hợp với tiêu chí
 
 Hãy định dạng kết quả rõ ràng và dễ đọc."""
-        
-        # Gọi Gemini để gợi ý
-        response = get_model_response(client, system_message, user_message)
-        
-        return response
-        
-    except Exception as e:
-        logger.error(f"Error generating food suggestions: {e}")
-        return "Xin lỗi, tôi không thể gợi ý món ăn lúc này. Vui lòng thử lại sau."
-
+    
+    # Gọi Gemini để gợi ý
+    response = get_model_response(get_client(), system_message, user_message, task="food_suggestions", deadline=deadline)
+    
+    return response
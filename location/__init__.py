@@ -1,2 +1,2 @@
 # Location services package 
-from .main import LocationService
+from .main import LocationService, Restaurant
\ No newline at end of file
@@ -1,37 +1,204 @@
-import requests
+import os
+import sys
+import json
+import asyncio
+import heapq
+import math
+import time
+import threading
 import logging
-from typing import List, Dict, Any, Tuple, Optional
-from geopy.distance import geodesic
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from operator import itemgetter
+from typing import List, Dict, Any, Tuple, Optional, Iterable, Iterator
+from metrics.main import inc
+from budget.main import Deadline, BUDGET_NETWORK_MIN_S, BUDGET_RADIUS_EXPANSION_S
+from render.templates import FOLLOW_UP, NO_RESTAURANT_RESULTS, restaurant_results_header, restaurant_results_item
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-# Cấu hình logging
-logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Cấu hình API
 OVERPASS_API_URL = "https://overpass-api.de/api/interpreter"
 NOMINATIM_API_URL = "https://nominatim.openstreetmap.org/search"
 
-class LocationService:
-    """Dịch vụ xử lý vị trí và tìm kiếm quán ăn"""
+# Danh sách các máy chủ Overpass (phân tách bằng dấu phẩy), dùng lần lượt khi máy chủ lỗi
+OVERPASS_API_URLS = [url.strip() for url in os.getenv("OVERPASS_API_URLS", OVERPASS_API_URL).split(",") if url.strip()]
+# Giới hạn tốc độ cho mỗi máy chủ: số yêu cầu mỗi giây và số yêu cầu tối đa liên tiếp
+OVERPASS_RATE_LIMIT = float(os.getenv("OVERPASS_RATE_LIMIT", "1"))
+OVERPASS_RATE_BURST = int(os.getenv("OVERPASS_RATE_BURST", "3"))
+# Thời gian chờ tối đa cho một yêu cầu và cho việc chờ lượt gửi (giây)
+OVERPASS_TIMEOUT = float(os.getenv("OVERPASS_TIMEOUT", "30"))
+OVERPASS_QUEUE_TIMEOUT = float(os.getenv("OVERPASS_QUEUE_TIMEOUT", "5"))
+# Thời gian giữ kết quả để dùng lại cho các truy vấn giống nhau (giây)
+OVERPASS_CACHE_TTL = float(os.getenv("OVERPASS_CACHE_TTL", "120"))
+# Số chữ số thập phân khi làm tròn tọa độ: người dùng ở gần nhau dùng chung một truy vấn
+OVERPASS_COORD_PRECISION = int(os.getenv("OVERPASS_COORD_PRECISION", "3"))
+# Các mã lỗi cho thấy máy chủ đang quá tải
+OVERPASS_OVERLOAD_STATUSES = (429, 502, 503, 504)
+
+# Cấu hình xử lý kết quả: "process" (ProcessPoolExecutor), "thread" (ThreadPoolExecutor)
+# hoặc "none" (xử lý ngay trên event loop)
+LOCATION_EXECUTOR = os.getenv("LOCATION_EXECUTOR", "thread").lower()
+LOCATION_EXECUTOR_WORKERS = int(os.getenv("LOCATION_EXECUTOR_WORKERS", "2"))
+# Bộ giải mã JSON: "orjson" (nhanh hơn, dùng json nếu chưa cài) hoặc "json"
+LOCATION_JSON_DECODER = os.getenv("LOCATION_JSON_DECODER", "orjson").lower()
+
+# Giá trị hiển thị khi thiếu thông tin
+NO_NAME = "Không có tên"
+UNKNOWN_VALUE = "Không xác định"
+NO_ADDRESS = "Không có địa chỉ"
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """Intern các giá trị lặp lại nhiều (loại hình, ẩm thực) để tiết kiệm bộ nhớ"""
+    return sys.intern(value) if value else None
+
+class Restaurant:
+    """
+    Thông tin một quán ăn
     
-    @staticmethod
-    def search_restaurants_by_coordinates(latitude: float, longitude: float, criteria: List[str] = None, radius: int = 1000) -> List[Dict[str, Any]]:
-        """
-        Tìm kiếm quán ăn gần vị trí được chỉ định
-        
-        Args:
-            latitude: Vĩ độ
-            longitude: Kinh độ
-            criteria: Danh sách tiêu chí để lọc kết quả
-            radius: Bán kính tìm kiếm (mét)
-            
-        Returns:
-            Danh sách các quán ăn tìm thấy
-        """
-        try:
-            # Xây dựng truy vấn Overpass QL
-            # Mở rộng truy vấn để tìm kiếm nhiều loại địa điểm ăn uống
-            overpass_query = f"""
+    Dùng __slots__ thay cho dict để giảm bộ nhớ khi có nhiều kết quả. Thông tin
+    thiếu được lưu là None thay vì chuỗi thay thế. Hỗ trợ truy cập như dict
+    (restaurant["name"], restaurant.get("cuisine", ...)) để tương thích với mã cũ;
+    get() trả về giá trị mặc định khi trường không có giá trị.
+    """
+    
+    __slots__ = (
+        "id", "name", "type", "cuisine", "address", "distance", "latitude", "longitude",
+        "phone", "website", "opening_hours", "description"
+    )
+    
+    def __init__(self, id: int, name: Optional[str] = None, type: Optional[str] = None,
+                 cuisine: Optional[str] = None, address: Optional[str] = None,
+                 distance: Optional[int] = None, latitude: Optional[float] = None,
+                 longitude: Optional[float] = None, phone: Optional[str] = None,
+                 website: Optional[str] = None, opening_hours: Optional[str] = None,
+                 description: Optional[str] = None):
+        self.id = id
+        self.name = name
+        self.type = _intern(type)
+        self.cuisine = _intern(cuisine)
+        self.address = address
+        self.distance = distance
+        self.latitude = latitude
+        self.longitude = longitude
+        self.phone = phone
+        self.website = website
+        self.opening_hours = opening_hours
+        self.description = description
+    
+    @classmethod
+    def from_element(cls, element: Dict[str, Any], distance: Optional[float]) -> "Restaurant":
+        """Tạo Restaurant từ một phần tử Overpass"""
+        tags = element.get("tags", {})
+        center = element.get("center", {})
+        return cls(
+            id=element["id"],
+            name=tags.get("name"),
+            type=tags.get("amenity", tags.get("shop", "restaurant")),
+            cuisine=tags.get("cuisine"),
+            address=tags.get("addr:full", tags.get("addr:street")),
+            distance=round(distance) if distance is not None else None,
+            latitude=element.get("lat", center.get("lat")),
+            longitude=element.get("lon", center.get("lon")),
+            phone=tags.get("phone"),
+            website=tags.get("website"),
+            opening_hours=tags.get("opening_hours"),
+            description=tags.get("description")
+        )
+    
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+    
+    def keys(self) -> Tuple[str, ...]:
+        return self.__slots__
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Chuyển thành dict"""
+        return {key: getattr(self, key) for key in self.__slots__}
+    
+    def __getstate__(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, key) for key in self.__slots__)
+    
+    def __setstate__(self, state: Tuple[Any, ...]) -> None:
+        for key, value in zip(self.__slots__, state):
+            setattr(self, key, value)
+        self.type = _intern(self.type)
+        self.cuisine = _intern(self.cuisine)
+    
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Restaurant):
+            return self.__getstate__() == other.__getstate__()
+        return NotImplemented
+    
+    def __hash__(self) -> int:
+        # Định nghĩa __eq__ làm mất __hash__ mặc định; băm theo id (không đổi sau khi tạo)
+        # để vẫn dùng được Restaurant trong set hoặc làm khóa dict. Hai quán bằng nhau có cùng id.
+        return hash(self.id)
+    
+    def __repr__(self) -> str:
+        return f"Restaurant(id={self.id!r}, name={self.name!r}, distance={self.distance!r})"
+
+# Sai số tối đa (mét) do làm tròn tọa độ trong truy vấn Overpass
+_SNAP_SLACK_METERS = math.ceil(0.5 * 10 ** -OVERPASS_COORD_PRECISION * 111320 * math.sqrt(2))
+
+_executor: Optional[Executor] = None
+
+def _get_executor() -> Optional[Executor]:
+    """Lấy executor dùng để xử lý kết quả Overpass, khởi tạo khi cần"""
+    global _executor
+    if _executor is None:
+        # Tiến trình daemon không tạo được tiến trình con: dùng thread thay cho process
+        use_process = LOCATION_EXECUTOR == "process" and not multiprocessing.current_process().daemon
+        if LOCATION_EXECUTOR == "process" and not use_process:
+            logger.warning("Tiến trình hiện tại là daemon, xử lý kết quả Overpass bằng thread thay cho process")
+        if use_process:
+            _executor = ProcessPoolExecutor(max_workers=LOCATION_EXECUTOR_WORKERS)
+            # Khi một tiến trình worker kết thúc, multiprocessing chờ các tiến trình con trước
+            # khi chạy atexit của ProcessPoolExecutor: phải dừng pool trước để worker không bị treo.
+            # exitpriority cao hơn của các hàng đợi trong pool (10), để hàng đợi chưa bị đóng
+            multiprocessing.util.Finalize(None, _executor.shutdown, exitpriority=100)
+        elif LOCATION_EXECUTOR in ("process", "thread"):
+            _executor = ThreadPoolExecutor(max_workers=LOCATION_EXECUTOR_WORKERS, thread_name_prefix="location")
+    return _executor
+
+def _decode_json(raw: bytes) -> Any:
+    """Giải mã JSON bằng bộ giải mã đã cấu hình"""
+    if LOCATION_JSON_DECODER == "orjson" and orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def _build_overpass_query(latitude: float, longitude: float, radius: int) -> str:
+    """
+    Xây dựng truy vấn Overpass QL tìm các địa điểm ăn uống quanh tọa độ
+    
+    Tọa độ được làm tròn và bán kính được nới thêm phần sai số làm tròn, nhờ đó
+    các người dùng ở gần nhau tạo ra cùng một truy vấn và có thể dùng chung kết quả.
+    """
+    latitude = round(latitude, OVERPASS_COORD_PRECISION)
+    longitude = round(longitude, OVERPASS_COORD_PRECISION)
+    radius = int(radius + _SNAP_SLACK_METERS)
+    # Mở rộng truy vấn để tìm kiếm nhiều loại địa điểm ăn uống
+    return f"""
             [out:json];
             (
               node["amenity"="restaurant"](around:{radius},{latitude},{longitude});
@@ -50,106 +217,425 @@ class LocationService:
             >;
             out skel qt;
             """
+
+class OverpassUnavailableError(OSError):
+    """Không máy chủ Overpass nào trả về kết quả"""
+
+def _network_errors() -> Tuple[type, ...]:
+    """
+    Các lỗi mạng khi gọi Overpass/Nominatim
+    
+    requests chỉ được import khi thật sự gọi mạng (hoặc khi có lỗi), để import module nhanh.
+    """
+    import requests
+    return (requests.exceptions.RequestException, OverpassUnavailableError)
+
+class TokenBucket:
+    """Bộ giới hạn tốc độ token bucket, an toàn khi dùng từ nhiều thread"""
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def acquire(self, timeout: float) -> bool:
+        """
+        Lấy một token, chờ tối đa timeout giây
+        
+        Mỗi lần ngủ không vượt quá thời gian chờ còn lại; không chờ nếu token tiếp
+        theo chỉ có sau khi hết thời gian chờ.
+        
+        Returns:
+            True nếu lấy được token, False nếu hết thời gian chờ
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                if self.rate <= 0:
+                    return False
+                wait = (1 - self._tokens) / self.rate
+            remaining = deadline - now
+            if remaining <= 0 or wait > remaining:
+                return False
+            time.sleep(min(wait, remaining))
+
+class OverpassEndpoint:
+    """Một máy chủ Overpass cùng bộ giới hạn tốc độ và điểm sức khỏe"""
+    
+    def __init__(self, url: str, rate: float, burst: int):
+        self.url = url
+        self.bucket = TokenBucket(rate, burst)
+        # Điểm sức khỏe trong khoảng 0..1, trung bình trượt của các lần gọi gần đây
+        self.health = 1.0
+        self.cooldown_until = 0.0
+    
+    def is_cooling_down(self, now: float) -> bool:
+        return now < self.cooldown_until
+    
+    def record_success(self) -> None:
+        self.health = 0.8 * self.health + 0.2
+    
+    def record_failure(self, retry_after: Optional[float] = None) -> None:
+        self.health = 0.8 * self.health
+        if retry_after:
+            self.cooldown_until = time.monotonic() + retry_after
+
+class OverpassClient:
+    """
+    Lớp gửi truy vấn Overpass
+    
+    - Gộp các truy vấn giống nhau đang chạy thành một yêu cầu duy nhất và giữ kết
+      quả trong thời gian ngắn
+    - Giới hạn tốc độ gửi cho từng máy chủ bằng token bucket
+    - Chuyển sang máy chủ dự phòng khi máy chủ quá tải hoặc lỗi, ưu tiên máy chủ
+      có điểm sức khỏe cao
+    """
+    
+    def __init__(self, urls: List[str], rate: float = OVERPASS_RATE_LIMIT, burst: int = OVERPASS_RATE_BURST,
+                 timeout: float = OVERPASS_TIMEOUT, queue_timeout: float = OVERPASS_QUEUE_TIMEOUT,
+                 cache_ttl: float = OVERPASS_CACHE_TTL):
+        self.endpoints = [OverpassEndpoint(url, rate, burst) for url in urls]
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._cache: Dict[str, Tuple[float, bytes]] = {}
+    
+    def _get_cached(self, query: str, now: float) -> Optional[bytes]:
+        cached = self._cache.get(query)
+        if cached and now - cached[0] < self.cache_ttl:
+            return cached[1]
+        return None
+    
+    def _store(self, query: str, content: bytes, now: float) -> None:
+        # Dọn các kết quả đã hết hạn
+        expired = [key for key, (stored_at, _) in self._cache.items() if now - stored_at >= self.cache_ttl]
+        for key in expired:
+            del self._cache[key]
+        self._cache[query] = (now, content)
+    
+    def _ordered_endpoints(self) -> List[OverpassEndpoint]:
+        """Sắp xếp máy chủ: máy chủ không bị tạm ngưng và có điểm sức khỏe cao trước"""
+        now = time.monotonic()
+        return sorted(self.endpoints, key=lambda endpoint: (endpoint.is_cooling_down(now), -endpoint.health))
+    
+    def _request(self, query: str, timeout: Optional[float] = None) -> bytes:
+        """Gửi truy vấn, lần lượt thử các máy chủ cho đến khi thành công hoặc hết thời gian chờ"""
+        import requests
+        
+        last_error: Optional[Exception] = None
+        started = time.monotonic()
+        timeout = self.timeout if timeout is None else min(self.timeout, timeout)
+        
+        for endpoint in self._ordered_endpoints():
+            remaining = timeout - (time.monotonic() - started)
+            if remaining <= 0:
+                last_error = last_error or OverpassUnavailableError("Hết thời gian chờ Overpass")
+                break
+            if not endpoint.bucket.acquire(min(self.queue_timeout, remaining)):
+                logger.warning(f"Máy chủ Overpass {endpoint.url} đã đạt giới hạn tốc độ, thử máy chủ khác")
+                continue
             
-            # Gửi yêu cầu đến Overpass API
-            response = requests.post(OVERPASS_API_URL, data={"data": overpass_query})
-            response.raise_for_status()
-            data = response.json()
+            try:
+                response = requests.post(endpoint.url, data={"data": query}, timeout=max(0.1, timeout - (time.monotonic() - started)))
+                if response.status_code in OVERPASS_OVERLOAD_STATUSES:
+                    retry_after = response.headers.get("Retry-After")
+                    endpoint.record_failure(float(retry_after) if retry_after and retry_after.isdigit() else self.queue_timeout)
+                    inc("overpass_requests_total", endpoint=endpoint.url, outcome=str(response.status_code))
+                    last_error = requests.exceptions.HTTPError(f"{response.status_code} từ {endpoint.url}", response=response)
+                    logger.warning(f"Máy chủ Overpass {endpoint.url} quá tải ({response.status_code}), thử máy chủ khác")
+                    continue
+                response.raise_for_status()
+                endpoint.record_success()
+                inc("overpass_requests_total", endpoint=endpoint.url, outcome="ok")
+                inc("overpass_response_bytes_total", len(response.content), endpoint=endpoint.url)
+                return response.content
+            except requests.exceptions.RequestException as e:
+                endpoint.record_failure()
+                inc("overpass_requests_total", endpoint=endpoint.url, outcome="error")
+                last_error = e
+                logger.warning(f"Lỗi khi gọi máy chủ Overpass {endpoint.url}: {e}")
+        
+        if last_error:
+            raise last_error
+        raise OverpassUnavailableError("Tất cả máy chủ Overpass đều đạt giới hạn tốc độ")
+    
+    def fetch(self, query: str, timeout: Optional[float] = None, cache_only: bool = False) -> bytes:
+        """
+        Gửi truy vấn Overpass và trả về nội dung phản hồi chưa giải mã
+        
+        Args:
+            query: Truy vấn Overpass QL
+            timeout: Thời gian chờ tối đa (giây), mặc định là OVERPASS_TIMEOUT
+            cache_only: Chỉ dùng kết quả đã lưu, không gọi máy chủ
             
-            # Xử lý kết quả
-            restaurants = []
-            for element in data.get("elements", []):
-                if element.get("type") in ["node", "way"]:
-                    tags = element.get("tags", {})
-                    
-                    # Chỉ lấy các địa điểm có tên
-                    if "name" in tags:
-                        # Tính khoảng cách từ vị trí người dùng
-                        if "lat" in element and "lon" in element:
-                            distance = geodesic(
-                                (latitude, longitude),
-                                (element["lat"], element["lon"])
-                            ).meters
-                        else:
-                            # Đối với way, sử dụng tọa độ trung tâm nếu có
-                            center = element.get("center", {})
-                            if "lat" in center and "lon" in center:
-                                distance = geodesic(
-                                    (latitude, longitude),
-                                    (center["lat"], center["lon"])
-                                ).meters
-                            else:
-                                distance = None
-                        
-                        # Lấy thông tin về ẩm thực và loại hình
-                        cuisine = tags.get("cuisine", "").lower()
-                        amenity = tags.get("amenity", "").lower()
-                        food_type = tags.get("food", "").lower()
-                        description = tags.get("description", "").lower()
-                        
-                        # Kiểm tra xem địa điểm có phù hợp với tiêu chí không
-                        is_relevant = True
-                        if criteria:
-                            # Nếu là quán cà phê và không có tiêu chí liên quan đến cà phê, bỏ qua
-                            if amenity == "cafe" and not any(c.lower() in ["cafe", "cà phê", "coffee"] for c in criteria):
-                                is_relevant = False
-                            
-                            # Kiểm tra xem có tiêu chí nào phù hợp không
-                            criteria_matched = False
-                            for criterion in criteria:
-                                criterion_lower = criterion.lower()
-                                # Kiểm tra trong các trường thông tin
-                                if (criterion_lower in cuisine or 
-                                    criterion_lower in amenity or 
-                                    criterion_lower in food_type or 
-                                    criterion_lower in description or
-                                    criterion_lower in tags.get("name", "").lower()):
-                                    criteria_matched = True
-                                    break
-                            
-                            # Nếu không có tiêu chí nào phù hợp, đánh dấu là không liên quan
-                            if not criteria_matched:
-                                is_relevant = False
-                        
-                        # Chỉ thêm địa điểm liên quan
-                        if is_relevant:
-                            restaurant = {
-                                "id": element["id"],
-                                "name": tags.get("name", "Không có tên"),
-                                "type": tags.get("amenity", tags.get("shop", "restaurant")),
-                                "cuisine": tags.get("cuisine", "Không xác định"),
-                                "address": tags.get("addr:full", tags.get("addr:street", "Không có địa chỉ")),
-                                "distance": round(distance) if distance else None,
-                                "latitude": element.get("lat", center.get("lat") if "center" in element else None),
-                                "longitude": element.get("lon", center.get("lon") if "center" in element else None),
-                                "phone": tags.get("phone", None),
-                                "website": tags.get("website", None),
-                                "opening_hours": tags.get("opening_hours", None),
-                                "description": tags.get("description", None)
-                            }
-                            
-                            restaurants.append(restaurant)
-            
-            # Sắp xếp theo khoảng cách
-            restaurants = [r for r in restaurants if r["distance"] is not None]
-            restaurants.sort(key=lambda x: x["distance"])
-            
-            # Nếu không tìm thấy kết quả phù hợp, mở rộng bán kính tìm kiếm
-            if not restaurants and criteria and radius < 5000:
-                logger.info(f"Không tìm thấy kết quả với bán kính {radius}m, mở rộng tìm kiếm đến 5000m")
-                return LocationService.search_restaurants_by_coordinates(latitude, longitude, criteria, 5000)
-            
-            return restaurants
-            
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Lỗi khi gọi Overpass API: {e}")
-            return []
+        Returns:
+            Nội dung phản hồi
+        """
+        with self._lock:
+            cached = self._get_cached(query, time.monotonic())
+            if cached is not None:
+                inc("overpass_coalesced_total", kind="cache")
+                return cached
+            
+            if cache_only:
+                raise OverpassUnavailableError("Không có kết quả Overpass đã lưu cho truy vấn này")
+            
+            future = self._inflight.get(query)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[query] = future
+        
+        # Các yêu cầu trùng lặp chờ kết quả của yêu cầu đầu tiên
+        if not is_leader:
+            inc("overpass_coalesced_total", kind="inflight")
+            try:
+                return future.result(timeout)
+            except FutureTimeoutError:
+                raise OverpassUnavailableError("Hết thời gian chờ kết quả Overpass")
+        
+        try:
+            content = self._request(query, timeout)
+            with self._lock:
+                self._store(query, content, time.monotonic())
+            future.set_result(content)
+            return content
         except Exception as e:
-            logger.error(f"Lỗi không xác định: {e}")
-            return []
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(query, None)
+
+_overpass_client: Optional[OverpassClient] = None
+
+def _get_overpass_client() -> OverpassClient:
+    """Lấy OverpassClient của tiến trình hiện tại, khởi tạo khi cần"""
+    global _overpass_client
+    if _overpass_client is None:
+        _overpass_client = OverpassClient(OVERPASS_API_URLS)
+    return _overpass_client
+
+def _fetch_overpass(query: str, timeout: Optional[float] = None, cache_only: bool = False) -> bytes:
+    """Gửi truy vấn đến Overpass API và trả về nội dung phản hồi chưa giải mã"""
+    return _get_overpass_client().fetch(query, timeout, cache_only)
+
+def _fetch_options(deadline: Optional[Deadline]) -> Tuple[float, bool]:
+    """Thời gian chờ Overpass và chế độ chỉ dùng cache theo thời gian còn lại của lượt"""
+    cache_only = deadline is not None and not deadline.allows(BUDGET_NETWORK_MIN_S, "overpass")
+    return Deadline.timeout_for(deadline, OVERPASS_TIMEOUT), cache_only
+
+def _can_expand_radius(deadline: Optional[Deadline]) -> bool:
+    """Còn đủ thời gian để tìm lại với bán kính lớn hơn hay không"""
+    return deadline is None or deadline.allows(BUDGET_RADIUS_EXPANSION_S, "radius_expansion")
+
+def _iter_named_places(elements: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Lọc các node/way có tên"""
+    for element in elements:
+        # Chỉ lấy các địa điểm có tên
+        if element.get("type") in ("node", "way") and "name" in element.get("tags", {}):
+            yield element
+
+def _is_relevant(tags: Dict[str, str], criteria: List[str]) -> bool:
+    """Kiểm tra xem địa điểm có phù hợp với tiêu chí không"""
+    # Lấy thông tin về ẩm thực và loại hình
+    cuisine = tags.get("cuisine", "").lower()
+    amenity = tags.get("amenity", "").lower()
+    food_type = tags.get("food", "").lower()
+    description = tags.get("description", "").lower()
+    name = tags.get("name", "").lower()
+    
+    # Nếu là quán cà phê và không có tiêu chí liên quan đến cà phê, bỏ qua
+    if amenity == "cafe" and not any(c.lower() in ["cafe", "cà phê", "coffee"] for c in criteria):
+        return False
+    
+    # Kiểm tra xem có tiêu chí nào phù hợp không
+    for criterion in criteria:
+        criterion_lower = criterion.lower()
+        # Kiểm tra trong các trường thông tin
+        if (criterion_lower in cuisine or 
+            criterion_lower in amenity or 
+            criterion_lower in food_type or 
+            criterion_lower in description or
+            criterion_lower in name):
+            return True
+    
+    # Nếu không có tiêu chí nào phù hợp, đánh dấu là không liên quan
+    return False
+
+def _iter_relevant(elements: Iterable[Dict[str, Any]], criteria: Optional[List[str]]) -> Iterator[Dict[str, Any]]:
+    """Lọc các địa điểm phù hợp với tiêu chí"""
+    if not criteria:
+        yield from elements
+        return
+    for element in elements:
+        if _is_relevant(element["tags"], criteria):
+            yield element
+
+def _iter_with_distance(elements: Iterable[Dict[str, Any]], latitude: float, longitude: float) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    """Tính khoảng cách từ vị trí người dùng, bỏ qua địa điểm không có tọa độ"""
+    from geopy.distance import geodesic
+    
+    origin = (latitude, longitude)
+    for element in elements:
+        if "lat" in element and "lon" in element:
+            yield geodesic(origin, (element["lat"], element["lon"])).meters, element
+        else:
+            # Đối với way, sử dụng tọa độ trung tâm nếu có
+            center = element.get("center", {})
+            if "lat" in center and "lon" in center:
+                yield geodesic(origin, (center["lat"], center["lon"])).meters, element
+
+def _iter_within(candidates: Iterable[Tuple[float, Dict[str, Any]]], radius: Optional[float]) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    """Bỏ các địa điểm xa hơn bán kính tìm kiếm (None = giữ tất cả)"""
+    if radius is None:
+        yield from candidates
+        return
+    for distance, element in candidates:
+        if distance <= radius:
+            yield distance, element
+
+def process_overpass_response(raw: bytes, latitude: float, longitude: float, criteria: List[str] = None, top_k: Optional[int] = None, radius: Optional[float] = None) -> List[Restaurant]:
+    """
+    Xử lý phản hồi Overpass thành danh sách quán ăn sắp xếp theo khoảng cách
+    
+    Các phần tử đi qua pipeline generator: lọc theo tên và tiêu chí, tính khoảng
+    cách, bỏ các địa điểm ngoài bán kính, rồi chọn top_k gần nhất bằng heap.
+    Restaurant chỉ được tạo cho các kết quả được giữ lại. Hàm ở cấp module để có
+    thể chạy trong ProcessPoolExecutor.
+    
+    Args:
+        raw: Nội dung phản hồi Overpass (JSON chưa giải mã)
+        latitude: Vĩ độ người dùng
+        longitude: Kinh độ người dùng
+        criteria: Danh sách tiêu chí để lọc kết quả
+        top_k: Số quán ăn gần nhất cần giữ lại (None = giữ tất cả)
+        radius: Bán kính tìm kiếm (mét), tính từ tọa độ người dùng (None = không lọc)
+        
+    Returns:
+        Danh sách các quán ăn tìm thấy
+    """
+    data = _decode_json(raw)
+    
+    # Truy vấn dùng tọa độ đã làm tròn và bán kính nới thêm _SNAP_SLACK_METERS, nên
+    # phản hồi có thể chứa địa điểm nằm ngoài bán kính tính từ tọa độ thật
+    candidates = _iter_within(_iter_with_distance(
+        _iter_relevant(_iter_named_places(data.get("elements", [])), criteria),
+        latitude,
+        longitude
+    ), radius)
+    
+    # Sắp xếp theo khoảng cách
+    if top_k is not None:
+        survivors = heapq.nsmallest(top_k, candidates, key=itemgetter(0))
+    else:
+        survivors = sorted(candidates, key=itemgetter(0))
+    
+    return [Restaurant.from_element(element, distance) for distance, element in survivors]
+
+async def _search_restaurants(latitude: float, longitude: float, criteria: Optional[List[str]], radius: int,
+                              top_k: Optional[int], deadline: Optional[Deadline], offload: bool) -> List[Restaurant]:
+    """
+    Gọi Overpass, xử lý kết quả và mở rộng bán kính khi không tìm thấy quán phù hợp
+    
+    Dùng chung cho hai phiên bản của LocationService.search_restaurants_by_coordinates.
+    Với offload=True, việc gọi Overpass chạy trong thread và việc xử lý kết quả chạy
+    trong executor đã cấu hình (LOCATION_EXECUTOR); với offload=False mọi việc chạy
+    ngay trong thread hiện tại.
+    """
+    try:
+        # Gửi truy vấn đến Overpass API
+        timeout, cache_only = _fetch_options(deadline)
+        query = _build_overpass_query(latitude, longitude, radius)
+        if offload:
+            raw = await asyncio.to_thread(_fetch_overpass, query, timeout, cache_only)
+        else:
+            raw = _fetch_overpass(query, timeout, cache_only)
+        
+        # Xử lý kết quả
+        executor = _get_executor() if offload else None
+        if executor is None:
+            restaurants = process_overpass_response(raw, latitude, longitude, criteria, top_k, radius)
+        else:
+            restaurants = await asyncio.get_running_loop().run_in_executor(
+                executor, process_overpass_response, raw, latitude, longitude, criteria, top_k, radius
+            )
+        
+        # Nếu không tìm thấy kết quả phù hợp, mở rộng bán kính tìm kiếm
+        if not restaurants and criteria and radius < 5000 and _can_expand_radius(deadline):
+            logger.info(f"Không tìm thấy kết quả với bán kính {radius}m, mở rộng tìm kiếm đến 5000m")
+            return await _search_restaurants(latitude, longitude, criteria, 5000, top_k, deadline, offload)
+        
+        return restaurants
+        
+    except _network_errors() as e:
+        logger.error(f"Lỗi khi gọi Overpass API: {e}")
+        return []
+    except Exception as e:
+        logger.error(f"Lỗi không xác định: {e}")
+        return []
+
+class LocationService:
+    """Dịch vụ xử lý vị trí và tìm kiếm quán ăn"""
+    
+    @staticmethod
+    def search_restaurants_by_coordinates(latitude: float, longitude: float, criteria: List[str] = None, radius: int = 1000, top_k: Optional[int] = None, deadline: Optional[Deadline] = None) -> List[Restaurant]:
+        """
+        Tìm kiếm quán ăn gần vị trí được chỉ định
+        
+        Chạy trong event loop riêng (asyncio.run), nên không gọi được từ một event loop
+        đang chạy; khi đó dùng search_restaurants_by_coordinates_async.
+        
+        Args:
+            latitude: Vĩ độ
+            longitude: Kinh độ
+            criteria: Danh sách tiêu chí để lọc kết quả
+            radius: Bán kính tìm kiếm (mét)
+            top_k: Số quán ăn gần nhất cần trả về (None = trả về tất cả)
+            deadline: Hạn chót của lượt hội thoại (không bắt buộc)
+            
+        Returns:
+            Danh sách các quán ăn tìm thấy
+        """
+        return asyncio.run(_search_restaurants(latitude, longitude, criteria, radius, top_k, deadline, offload=False))
+    
+    @staticmethod
+    async def search_restaurants_by_coordinates_async(latitude: float, longitude: float, criteria: List[str] = None, radius: int = 1000, top_k: Optional[int] = None, deadline: Optional[Deadline] = None) -> List[Restaurant]:
+        """
+        Phiên bản bất đồng bộ của search_restaurants_by_coordinates
+        
+        Việc gọi Overpass chạy trong thread, việc giải mã và xử lý kết quả chạy
+        trong executor đã cấu hình (LOCATION_EXECUTOR) để không chặn event loop
+        khi kết quả lớn.
+        
+        Args:
+            latitude: Vĩ độ
+            longitude: Kinh độ
+            criteria: Danh sách tiêu chí để lọc kết quả
+            radius: Bán kính tìm kiếm (mét)
+            top_k: Số quán ăn gần nhất cần trả về (None = trả về tất cả)
+            deadline: Hạn chót của lượt hội thoại (không bắt buộc)
+            
+        Returns:
+            Danh sách các quán ăn tìm thấy
+        """
+        return await _search_restaurants(latitude, longitude, criteria, radius, top_k, deadline, offload=True)
     
     @staticmethod
-    def search_restaurants_by_address(address: str, criteria: List[str] = None, radius: int = 1000) -> List[Dict[str, Any]]:
+    def search_restaurants_by_address(address: str, criteria: List[str] = None, radius: int = 1000, top_k: Optional[int] = None, deadline: Optional[Deadline] = None) -> List[Restaurant]:
         """
         Tìm kiếm quán ăn gần địa chỉ được chỉ định
         
@@ -157,11 +643,15 @@ class LocationService:
             address: Địa chỉ cần tìm
             criteria: Danh sách tiêu chí để lọc kết quả
             radius: Bán kính tìm kiếm (mét)
+            top_k: Số quán ăn gần nhất cần trả về (None = trả về tất cả)
+            deadline: Hạn chót của lượt hội thoại (không bắt buộc)
             
         Returns:
             Danh sách các quán ăn tìm thấy
         """
         try:
+            import requests
+            
             # Chuyển đổi địa chỉ thành tọa độ sử dụng Nominatim API
             params = {
                 "q": address,
@@ -169,7 +659,7 @@ class LocationService:
                 "limit": 1
             }
             
-            response = requests.get(NOMINATIM_API_URL, params=params, headers={"User-Agent": "FoodChatbot/1.0"})
+            response = requests.get(NOMINATIM_API_URL, params=params, headers={"User-Agent": "FoodChatbot/1.0"}, timeout=Deadline.timeout_for(deadline, OVERPASS_TIMEOUT))
             response.raise_for_status()
             data = response.json()
             
@@ -183,9 +673,9 @@ class LocationService:
             longitude = float(location["lon"])
             
             # Tìm kiếm quán ăn gần tọa độ này
-            return LocationService.search_restaurants_by_coordinates(latitude, longitude, criteria, radius)
+            return LocationService.search_restaurants_by_coordinates(latitude, longitude, criteria, radius, top_k, deadline)
             
-        except requests.exceptions.RequestException as e:
+        except _network_errors() as e:
             logger.error(f"Lỗi khi gọi Nominatim API: {e}")
             return []
         except Exception as e:
@@ -203,19 +693,43 @@ class LocationService:
         Returns:
             Chuỗi văn bản đã định dạng
         """
-        name = restaurant["name"]
-        cuisine = f"Loại: {restaurant['cuisine']}" if restaurant["cuisine"] != "Không xác định" else ""
-        address = f"Địa chỉ: {restaurant['address']}" if restaurant["address"] != "Không có địa chỉ" else ""
-        distance = f"Khoảng cách: {restaurant['distance']}m" if restaurant["distance"] is not None else ""
-        phone = f"Điện thoại: {restaurant['phone']}" if restaurant["phone"] else ""
-        website = f"Website: {restaurant['website']}" if restaurant["website"] else ""
-        opening_hours = f"Giờ mở cửa: {restaurant['opening_hours']}" if restaurant["opening_hours"] else ""
-        description = f"Mô tả: {restaurant['description']}" if restaurant["description"] else ""
+        name = restaurant.get("name", NO_NAME)
+        cuisine = f"Loại: {restaurant['cuisine']}" if restaurant.get("cuisine", UNKNOWN_VALUE) != UNKNOWN_VALUE else ""
+        address = f"Địa chỉ: {restaurant['address']}" if restaurant.get("address", NO_ADDRESS) != NO_ADDRESS else ""
+        distance = f"Khoảng cách: {restaurant['distance']}m" if restaurant.get("distance") is not None else ""
+        phone = f"Điện thoại: {restaurant['phone']}" if restaurant.get("phone") else ""
+        website = f"Website: {restaurant['website']}" if restaurant.get("website") else ""
+        opening_hours = f"Giờ mở cửa: {restaurant['opening_hours']}" if restaurant.get("opening_hours") else ""
+        description = f"Mô tả: {restaurant['description']}" if restaurant.get("description") else ""
         
         # Kết hợp các thông tin có sẵn
         info_parts = [part for part in [name, cuisine, address, distance, phone, website, opening_hours, description] if part]
         return "\n".join(info_parts)
     
+    @staticmethod
+    def rank_by_criteria(restaurants: List[Restaurant], criteria: List[str]) -> List[Restaurant]:
+        """
+        Xếp hạng quán ăn theo số tiêu chí khớp với tên, ẩm thực và mô tả, không dùng LLM
+        
+        Các quán khớp cùng số tiêu chí giữ nguyên thứ tự (theo khoảng cách).
+        
+        Args:
+            restaurants: Danh sách quán ăn
+            criteria: Danh sách tiêu chí
+            
+        Returns:
+            Danh sách quán ăn đã được xếp hạng
+        """
+        criteria_lower = [criterion.lower() for criterion in criteria]
+        
+        def score(restaurant: Restaurant) -> int:
+            text = " ".join(
+                value.lower() for value in (restaurant.get("name"), restaurant.get("cuisine"), restaurant.get("description")) if value
+            )
+            return sum(1 for criterion in criteria_lower if criterion in text)
+        
+        return sorted(restaurants, key=lambda restaurant: -score(restaurant))
+    
     @staticmethod
     def get_top_restaurants(restaurants: List[Dict[str, Any]], limit: int = 3) -> List[Dict[str, Any]]:
         """
@@ -243,13 +757,10 @@ class LocationService:
             Chuỗi văn bản đã định dạng
         """
         if not restaurants:
-            return "Không tìm thấy quán ăn nào phù hợp với tiêu chí của bạn."
-            
-        result = f"Dựa trên tiêu chí của bạn ({', '.join(criteria)}), đây là top {len(restaurants)} quán ăn gần bạn:\n\n"
-        
-        for i, restaurant in enumerate(restaurants, 1):
-            result += f"#{i}: {LocationService.format_restaurant_info(restaurant)}\n\n"
-        
-        result += "Bạn có thể hỏi tôi về việc gợi ý món ăn bất cứ lúc nào."
+            return NO_RESTAURANT_RESULTS
         
-        return result 
\ No newline at end of file
+        return "".join([
+            restaurant_results_header(criteria, len(restaurants)),
+            *[restaurant_results_item(i, LocationService.format_restaurant_info(restaurant)) for i, restaurant in enumerate(restaurants, 1)],
+            FOLLOW_UP,
+        ])
\ No newline at end of file
@@ -1,10 +1,24 @@
 import os
+import logging
 from dotenv import load_dotenv
-from bot.main import run_bot
 
 env_path = ".env"
+# Nạp .env trước khi import các module khác, vì chúng đọc cấu hình (BOT_WORKERS, DB_*,
+# LLM_*, METRICS_*, TELEGRAM_*...) bằng os.getenv ngay khi được import
 load_dotenv()
 
+from bot.main import run_bot
+from worker.main import run_supervisor
+
+# Cấu hình logging một lần cho cả ứng dụng (kể cả các tiến trình worker, vốn import lại module này)
+logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+# Số tiến trình worker (1 = chạy một tiến trình như trước)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+
 if __name__ == "__main__":
     # Run the Telegram bot
-    run_bot()
+    if BOT_WORKERS > 1:
+        run_supervisor(BOT_WORKERS)
+    else:
+        run_bot()
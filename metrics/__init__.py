@@ -0,0 +1 @@
+# Metrics package 
\ No newline at end of file
@@ -0,0 +1,256 @@
+import os
+import time
+import inspect
+import logging
+import threading
+import functools
+import contextvars
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Tuple, List, Optional, Callable, Any
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+
+# Các mốc (giây) của histogram thời gian xử lý
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Nhãn của lượt hội thoại hiện tại (ví dụ: trạng thái hội thoại), được gắn vào mọi span trong lượt
+_turn_labels: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar("turn_labels", default=None)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class _Histogram:
+    """Histogram theo định dạng Prometheus"""
+    
+    __slots__ = ("bucket_counts", "total", "count")
+    
+    def __init__(self):
+        self.bucket_counts = [0] * len(DURATION_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+    
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.bucket_counts[index] += 1
+        self.total += value
+        self.count += 1
+
+class _Span:
+    """Đo thời gian của một giai đoạn xử lý"""
+    
+    __slots__ = ("_registry", "_stage", "_labels", "_started")
+    
+    def __init__(self, registry: "MetricsRegistry", stage: str, labels: Dict[str, Any]):
+        self._registry = registry
+        self._stage = stage
+        self._labels = labels
+        self._started = 0.0
+    
+    def __enter__(self) -> "_Span":
+        self._started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        labels = dict(_turn_labels.get() or {})
+        labels.update(self._labels)
+        labels["stage"] = self._stage
+        labels["outcome"] = "error" if exc_type else "ok"
+        self._registry.observe("bot_stage_duration_seconds", time.perf_counter() - self._started, **labels)
+
+class _NoopSpan:
+    """Span không làm gì khi metrics bị tắt"""
+    
+    __slots__ = ()
+    
+    def __enter__(self) -> "_NoopSpan":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+_NOOP_SPAN = _NoopSpan()
+
+class MetricsRegistry:
+    """Lưu các counter và histogram, xuất ra định dạng văn bản Prometheus"""
+    
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+    
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """Tăng counter"""
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+    
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Ghi nhận một giá trị vào histogram"""
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram()
+            histogram.observe(value)
+    
+    def span(self, stage: str, **labels: Any):
+        """Context manager đo thời gian của một giai đoạn"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return _Span(self, stage, labels)
+    
+    def render(self) -> str:
+        """Xuất toàn bộ số liệu theo định dạng văn bản Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    for bound, bucket_count in zip(DURATION_BUCKETS, histogram.bucket_counts):
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', str(bound)))} {bucket_count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+# Registry dùng chung trong tiến trình
+registry = MetricsRegistry()
+
+def inc(name: str, value: float = 1, **labels: Any) -> None:
+    """Tăng counter trong registry dùng chung"""
+    if registry.enabled:
+        registry.inc(name, value, **labels)
+
+def span(stage: str, **labels: Any):
+    """Đo thời gian của một giai đoạn trong registry dùng chung"""
+    if not registry.enabled:
+        return _NOOP_SPAN
+    return _Span(registry, stage, labels)
+
+def set_turn_label(name: str, value: Any) -> None:
+    """Gắn nhãn cho lượt hội thoại hiện tại, áp dụng cho các span tiếp theo trong lượt"""
+    if not registry.enabled:
+        return
+    labels = _turn_labels.get()
+    if labels is not None:
+        labels[name] = str(value)
+
+def timed(stage: str) -> Callable:
+    """
+    Decorator đo thời gian thực thi của hàm (đồng bộ hoặc bất đồng bộ)
+    
+    Args:
+        stage: Tên giai đoạn
+    """
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not registry.enabled:
+                    return await func(*args, **kwargs)
+                with _Span(registry, stage, {}):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            with _Span(registry, stage, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timed_turn(handler: str) -> Callable:
+    """
+    Decorator cho handler của Telegram: đo thời gian của cả lượt hội thoại
+    
+    Các nhãn được gắn bằng set_turn_label trong lượt (ví dụ: state) được dùng cho
+    cả số liệu của lượt và của các span bên trong.
+    
+    Args:
+        handler: Tên handler
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return await func(*args, **kwargs)
+            labels: Dict[str, str] = {"handler": handler}
+            token = _turn_labels.set(labels)
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                registry.observe("bot_turn_duration_seconds", time.perf_counter() - started, **labels)
+                registry.inc("bot_turns_total", **labels)
+                _turn_labels.reset(token)
+        return wrapper
+    return decorator
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """Trả về số liệu tại /metrics"""
+    
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format: str, *args: Any) -> None:
+        return
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """
+    Khởi động HTTP server xuất số liệu trong một thread nền
+    
+    Không làm gì nếu metrics bị tắt.
+    
+    Args:
+        port: Cổng lắng nghe
+        host: Địa chỉ lắng nghe
+        
+    Returns:
+        Server đã khởi động, hoặc None nếu metrics bị tắt hoặc không thể khởi động
+    """
+    if not registry.enabled:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Không thể khởi động metrics server tại {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
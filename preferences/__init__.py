@@ -0,0 +1 @@
+# User preferences package 
\ No newline at end of file
@@ -0,0 +1,63 @@
+from typing import List, Dict, Any, Optional
+from database.main import get_user_preferences, record_confirmed_criteria, set_last_restaurant
+
+class PreferenceStore:
+    """Lưu và tra cứu sở thích của người dùng, học từ các tiêu chí đã xác nhận và các quán đã gợi ý"""
+    
+    @staticmethod
+    def record_confirmed_criteria(user_id: str, criteria: List[str]) -> None:
+        """
+        Ghi nhận bộ tiêu chí người dùng đã xác nhận
+        
+        Args:
+            user_id: ID người dùng
+            criteria: Danh sách tiêu chí đã xác nhận
+        """
+        if not criteria:
+            return
+        
+        record_confirmed_criteria(user_id, criteria)
+    
+    @staticmethod
+    def record_restaurant(user_id: str, restaurant: Any) -> None:
+        """
+        Ghi nhận quán ăn được gợi ý đầu tiên cho người dùng
+        
+        Args:
+            user_id: ID người dùng
+            restaurant: Thông tin quán ăn (Restaurant hoặc dict)
+        """
+        set_last_restaurant(user_id, {"id": restaurant.get("id"), "name": restaurant.get("name")})
+    
+    @staticmethod
+    def get_last_criteria(user_id: str) -> Optional[List[str]]:
+        """Lấy bộ tiêu chí người dùng đã xác nhận lần gần nhất"""
+        preferences = get_user_preferences(user_id)
+        return preferences["last_criteria"] if preferences else None
+    
+    @staticmethod
+    def get_last_restaurant(user_id: str) -> Optional[Dict[str, Any]]:
+        """Lấy quán ăn được gợi ý cho người dùng lần gần nhất"""
+        preferences = get_user_preferences(user_id)
+        return preferences["last_restaurant"] if preferences else None
+    
+    @staticmethod
+    def get_favorite_criteria(user_id: str, exclude: Optional[List[str]] = None, limit: int = 2) -> List[str]:
+        """
+        Lấy các tiêu chí người dùng chọn nhiều nhất
+        
+        Args:
+            user_id: ID người dùng
+            exclude: Các tiêu chí cần bỏ qua (ví dụ: tiêu chí đã chọn)
+            limit: Số lượng tiêu chí tối đa
+            
+        Returns:
+            Danh sách tiêu chí, chọn nhiều nhất trước
+        """
+        preferences = get_user_preferences(user_id)
+        if not preferences or not preferences["criteria_counts"]:
+            return []
+        
+        exclude = exclude or []
+        ranked = sorted(preferences["criteria_counts"].items(), key=lambda item: -item[1])
+        return [criterion for criterion, _ in ranked if criterion not in exclude][:limit]
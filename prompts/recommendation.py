@@ -5,7 +5,7 @@ Các template prompt cho việc gợi ý món ăn và quán ăn.
 # Template cho việc xếp hạng quán ăn dựa trên tiêu chí
 RANK_RESTAURANTS_SYSTEM = """Bạn là trợ lý AI giúp xếp hạng các quán ăn dựa trên tiêu chí.
 Nhiệm vụ của bạn là phân tích thông tin các quán ăn và xếp hạng chúng dựa trên mức độ phù hợp với tiêu chí.
-Hãy trả về danh sách các ID quán ăn theo thứ tự từ phù hợp nhất đến ít phù hợp nhất, mỗi ID một dòng."""
+Hãy trả về JSON với trường ranked_ids là danh sách các ID quán ăn theo thứ tự từ phù hợp nhất đến ít phù hợp nhất."""
 
 RANK_RESTAURANTS_USER = """Dựa vào danh sách quán ăn sau:
 
@@ -14,7 +14,7 @@ RANK_RESTAURANTS_USER = """Dựa vào danh sách quán ăn sau:
 Và các tiêu chí: {criteria}
 
 Hãy xếp hạng các quán ăn dựa trên mức độ phù hợp với tiêu chí.
-Chỉ trả về danh sách các ID quán ăn theo thứ tự từ phù hợp nhất đến ít phù hợp nhất, mỗi ID một dòng."""
+Trả về JSON với trường ranked_ids là danh sách các ID quán ăn theo thứ tự từ phù hợp nhất đến ít phù hợp nhất."""
 
 # Template cho việc gợi ý món ăn dựa trên tiêu chí
 SUGGEST_FOODS_SYSTEM = """Bạn là trợ lý AI giúp gợi ý món ăn.
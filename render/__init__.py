@@ -0,0 +1,2 @@
+# Response rendering package
+from .main import strip_markdown, to_markdown_v2, to_html, render_message, split_message
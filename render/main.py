@@ -0,0 +1,168 @@
+import re
+import html
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Độ dài tối đa của một tin nhắn Telegram (tính sau khi phân tích định dạng)
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Chế độ định dạng của Telegram được hỗ trợ (None: văn bản thuần, bỏ dấu markdown)
+PARSE_MODE_MARKDOWN_V2 = "MarkdownV2"
+PARSE_MODE_HTML = "HTML"
+
+# Một đoạn markdown trong câu trả lời của model, mỗi loại là một nhóm:
+# **đậm**, __gạch chân__, ~~gạch ngang~~, *nghiêng*, `code`.
+# ** đứng trước * để ** không bị đọc thành hai dấu nghiêng; không đoạn nào kéo qua dòng mới.
+_MARKDOWN_SPAN = re.compile(r"\*\*(.*?)\*\*|__(.*?)__|~~(.*?)~~|\*(.*?)\*|`(.*?)`")
+_BOLD, _UNDERLINE, _STRIKE, _ITALIC, _CODE = range(1, 6)
+
+# Ký tự đặc biệt của MarkdownV2 (ngoài đoạn code) và trong đoạn code; \\ phải được thoát trước.
+# Với văn bản tiếng Việt, chuỗi str.replace nhanh hơn nhiều so với str.translate hoặc re.sub.
+_MARKDOWN_V2_SPECIAL = "\\_*[]()~`>#+-=|{}.!"
+_MARKDOWN_V2_CODE_SPECIAL = "\\`"
+# Ký tự có thể mở đầu một đoạn markdown
+_MARKDOWN_MARKERS = re.compile(r"[*_~`]")
+
+# Cách bọc nội dung của từng loại đoạn trong mỗi chế độ
+_MARKDOWN_V2_SPANS = {_BOLD: "*{}*", _UNDERLINE: "__{}__", _STRIKE: "~{}~", _ITALIC: "_{}_", _CODE: "`{}`"}
+_HTML_SPANS = {_BOLD: "<b>{}</b>", _UNDERLINE: "<u>{}</u>", _STRIKE: "<s>{}</s>", _ITALIC: "<i>{}</i>", _CODE: "<code>{}</code>"}
+
+# Dấu phân cách được ưu tiên khi tách tin nhắn dài: đoạn văn, dòng, từ
+_SPLIT_BOUNDARIES = ("\n\n", "\n", " ")
+
+def _escape_chars(text: str, chars: str) -> str:
+    for char in chars:
+        if char in text:
+            text = text.replace(char, "\\" + char)
+    return text
+
+def _escape_markdown_v2(text: str) -> str:
+    return _escape_chars(text, _MARKDOWN_V2_SPECIAL)
+
+def _escape_markdown_v2_code(text: str) -> str:
+    return _escape_chars(text, _MARKDOWN_V2_CODE_SPECIAL)
+
+def _escape_html(text: str) -> str:
+    return html.escape(text, quote=False)
+
+def _strip_span(match: "re.Match[str]") -> str:
+    inner = match.group(match.lastindex)
+    # Đoạn code giữ nguyên nội dung, các đoạn khác có thể lồng nhau (**đậm *nghiêng***)
+    if match.lastindex == _CODE or not _MARKDOWN_MARKERS.search(inner):
+        return inner
+    return strip_markdown(inner)
+
+def strip_markdown(text: str) -> str:
+    """
+    Bỏ các dấu markdown (**, *, __, ~~, `) trong một lần quét, giữ lại nội dung
+
+    Args:
+        text: Văn bản cần xử lý
+
+    Returns:
+        Văn bản đã bỏ dấu markdown
+    """
+    return _MARKDOWN_SPAN.sub(_strip_span, text)
+
+def _convert(text: str, escape: Callable[[str], str], escape_code: Callable[[str], str], spans: Dict[int, str]) -> str:
+    """Chuyển markdown sang định dạng của Telegram trong một lần quét, thoát phần văn bản còn lại"""
+    parts: List[str] = []
+    position = 0
+    for match in _MARKDOWN_SPAN.finditer(text):
+        parts.append(escape(text[position:match.start()]))
+        kind = match.lastindex
+        inner = match.group(kind)
+        # Telegram từ chối đoạn định dạng rỗng
+        if inner:
+            content = escape_code(inner) if kind == _CODE else _convert(inner, escape, escape_code, spans)
+            parts.append(spans[kind].format(content))
+        position = match.end()
+    parts.append(escape(text[position:]))
+    return "".join(parts)
+
+def to_markdown_v2(text: str) -> str:
+    """Chuyển markdown trong câu trả lời của model sang MarkdownV2 của Telegram"""
+    return _convert(text, _escape_markdown_v2, _escape_markdown_v2_code, _MARKDOWN_V2_SPANS)
+
+def to_html(text: str) -> str:
+    """Chuyển markdown trong câu trả lời của model sang HTML của Telegram"""
+    return _convert(text, _escape_html, _escape_html, _HTML_SPANS)
+
+def render_message(text: str, parse_mode: Optional[str] = None) -> str:
+    """
+    Chuẩn bị nội dung tin nhắn để gửi qua Telegram
+
+    Args:
+        text: Văn bản có thể chứa markdown
+        parse_mode: PARSE_MODE_MARKDOWN_V2, PARSE_MODE_HTML hoặc None (bỏ dấu markdown)
+
+    Returns:
+        Văn bản đã định dạng theo parse_mode
+    """
+    if parse_mode == PARSE_MODE_MARKDOWN_V2:
+        return to_markdown_v2(text)
+    if parse_mode == PARSE_MODE_HTML:
+        return to_html(text)
+    return strip_markdown(text)
+
+def _span_start(spans: List[Tuple[int, int]], starts: List[int], position: int) -> Optional[int]:
+    """Vị trí bắt đầu của đoạn markdown chứa position (nằm hẳn bên trong), None nếu không có"""
+    index = bisect_left(starts, position) - 1
+    if index >= 0 and spans[index][1] > position:
+        return spans[index][0]
+    return None
+
+def _find_cut(text: str, start: int, limit: int, spans: List[Tuple[int, int]], starts: List[int]) -> Tuple[int, int]:
+    """Chọn chỗ tách phần bắt đầu tại start, trả về (vị trí tách, số ký tự phân cách cần bỏ)"""
+    end = start + limit
+    low = start + limit // 2
+    for boundary in _SPLIT_BOUNDARIES:
+        # Dấu phân cách bị bỏ đi, nên có thể bắt đầu ngay tại end
+        index = text.rfind(boundary, low, end + len(boundary))
+        while index != -1:
+            span_start = _span_start(spans, starts, index)
+            if span_start is None:
+                return index, len(boundary)
+            # Chỗ tách nằm trong một đoạn markdown, tìm tiếp trước đoạn đó
+            index = text.rfind(boundary, low, span_start)
+    # Không có chỗ tách: cắt ngang từ, nhưng không cắt ngang đoạn markdown nếu còn tránh được
+    span_start = _span_start(spans, starts, end)
+    if span_start is not None and span_start > start:
+        # Bỏ luôn dấu phân cách ngay trước đoạn markdown (nếu có)
+        for boundary in _SPLIT_BOUNDARIES:
+            if span_start - len(boundary) > start and text.endswith(boundary, start, span_start):
+                return span_start - len(boundary), len(boundary)
+        return span_start, 0
+    return end, 0
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    """
+    Tách tin nhắn dài thành nhiều phần không quá limit ký tự
+
+    Ưu tiên tách giữa các đoạn văn, sau đó giữa các dòng, rồi giữa các từ; chỉ cắt
+    ngang từ khi không có chỗ tách nào trong nửa sau của phần. Không tách bên trong
+    một đoạn markdown (**đậm**, `code`...), để mỗi phần vẫn đủ cặp dấu khi được định dạng
+    (trừ khi một đoạn dài hơn limit). Nên tách văn bản gốc trước khi gọi render_message,
+    vì phần định dạng không tính vào giới hạn của Telegram.
+
+    Args:
+        text: Văn bản cần tách
+        limit: Số ký tự tối đa của mỗi phần
+
+    Returns:
+        Danh sách các phần, theo thứ tự
+    """
+    if len(text) <= limit:
+        return [text]
+
+    # Các đoạn markdown không kéo qua dòng mới, nên chỉ các chỗ tách giữa từ cần kiểm tra
+    spans = [match.span() for match in _MARKDOWN_SPAN.finditer(text)]
+    starts = [span[0] for span in spans]
+    chunks = []
+    start = 0
+    while len(text) - start > limit:
+        cut, skip = _find_cut(text, start, limit, spans, starts)
+        chunks.append(text[start:cut])
+        start = cut + skip
+    chunks.append(text[start:])
+    return chunks
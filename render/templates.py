@@ -0,0 +1,48 @@
+"""
+Mẫu tin nhắn của bot, dùng chung cho các module tạo câu trả lời.
+
+Mẫu có tham số là hàm trả về f-string (được biên dịch cùng module, nhanh hơn
+str.format), mẫu cố định là hằng chuỗi. Tin nhắn nhiều phần được ghép một lần bằng
+str.join. Các đoạn cố định (CRITERIA_CHOICES, CRITERIA_SUGGESTIONS_HINT, FOLLOW_UP)
+còn được llm/main.py bỏ khỏi lịch sử hội thoại gửi cho model (BOT_BOILERPLATE).
+
+Từ điển nén của database/codec.py được dựng từ câu chữ của các mẫu (python -m
+database.zdict) và không được sửa theo; đổi câu chữ ở đây chỉ làm tin nhắn mới nén kém
+đi một chút, không ảnh hưởng việc giải nén.
+"""
+from typing import List
+
+# Lời nhắc ở cuối các tin nhắn kết quả
+FOLLOW_UP = "Bạn có thể hỏi tôi về việc gợi ý món ăn bất cứ lúc nào."
+
+# Kết quả tìm quán ăn (LocationService.format_restaurant_results)
+NO_RESTAURANT_RESULTS = "Không tìm thấy quán ăn nào phù hợp với tiêu chí của bạn."
+
+def restaurant_results_header(criteria: List[str], count: int) -> str:
+    return f"Dựa trên tiêu chí của bạn ({', '.join(criteria)}), đây là top {count} quán ăn gần bạn:\n\n"
+
+def restaurant_results_item(index: int, info: str) -> str:
+    return f"#{index}: {info}\n\n"
+
+# Gợi ý món ăn khi không tìm thấy quán (FallbackHandler.handle_no_restaurants)
+def no_restaurants_header(criteria: List[str]) -> str:
+    return (
+        f"Tôi không thể tìm thấy quán ăn nào gần vị trí của bạn dựa trên tiêu chí ({', '.join(criteria)}).\n\n"
+        "Tuy nhiên, tôi có thể gợi ý một số món ăn phù hợp với tiêu chí của bạn:\n\n"
+    )
+
+# Xác nhận tiêu chí (CriteriaProcessor.format_criteria_for_confirmation)
+CRITERIA_SUGGESTIONS_HINT = "\nBạn có thể nhập thêm các tiêu chí này nếu muốn."
+
+def criteria_suggestions(suggested_criteria: List[str]) -> str:
+    return f"\n\nTôi cũng gợi ý thêm các tiêu chí: {', '.join(suggested_criteria)}{CRITERIA_SUGGESTIONS_HINT}"
+
+CRITERIA_CHOICES = (
+    "\n\n**Bạn có thể:**\n1. Nhấn nút 'Xác nhận' hoặc gõ 'xác nhận' để tiếp tục\n"
+    "2. Hoặc nhập thêm tiêu chí nếu bạn muốn, hay nhấn vào các tiêu chí bên dưới để thêm hoặc bỏ"
+)
+
+# Tin nhắn của bàn phím chọn tiêu chí sau mỗi lần bật/tắt tiêu chí (bot/criteria_editor.py)
+def criteria_editor_text(criteria: List[str]) -> str:
+    selected = f"Tiêu chí bạn đã chọn: {', '.join(criteria)}" if criteria else "Bạn chưa chọn tiêu chí nào."
+    return f"{selected}\n\nNhấn vào tiêu chí để thêm hoặc bỏ, rồi nhấn 'Xác nhận' để tiếp tục."
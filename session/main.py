@@ -1,15 +1,35 @@
+import os
 import json
+import logging
+import threading
 from typing import List, Dict, Any, Optional, Tuple
 from enum import Enum
 from database.main import (
     get_active_session,
     create_session,
-    add_message,
-    get_session_messages,
-    get_user_state,
-    set_user_state,
-    clear_user_state
+    close_active_session,
+    get_session_summary,
+    save_session_summary
 )
+# Tin nhắn và trạng thái được ghi qua journal (ghi nền, gộp commit)
+from database.journal import journal
+
+logger = logging.getLogger(__name__)
+
+# Tóm tắt hội thoại: khi số tin nhắn chưa tóm tắt vượt quá SESSION_SUMMARY_TRIGGER,
+# các tin nhắn cũ được gộp vào bản tóm tắt, chỉ giữ lại SESSION_SUMMARY_KEEP_RECENT tin nhắn gần nhất
+SESSION_SUMMARY_TRIGGER = int(os.getenv("SESSION_SUMMARY_TRIGGER", "12"))
+SESSION_SUMMARY_KEEP_RECENT = int(os.getenv("SESSION_SUMMARY_KEEP_RECENT", "6"))
+# Thời gian chờ tối đa (giây) để ghi xong journal trước khi tóm tắt; quá thời gian thì bỏ qua lượt này
+SESSION_SUMMARY_FLUSH_TIMEOUT = float(os.getenv("SESSION_SUMMARY_FLUSH_TIMEOUT", "5"))
+
+# Các người dùng đang được tóm tắt hội thoại, tránh tóm tắt trùng lặp
+_summarizing_users = set()
+_summarizing_lock = threading.Lock()
+# Số tin nhắn chưa tóm tắt của mỗi người dùng (ước lượng trong bộ nhớ), để chỉ chờ ghi
+# journal và đọc cơ sở dữ liệu khi thật sự cần tóm tắt. Sau khi khởi động lại, bộ đếm bắt
+# đầu từ 0 nên lần tóm tắt đầu tiên có thể chậm thêm tối đa SESSION_SUMMARY_TRIGGER tin nhắn.
+_unsummarized_counts: Dict[str, int] = {}
 
 # Định nghĩa các trạng thái hội thoại
 class ConversationState(str, Enum):
@@ -24,37 +44,65 @@ class SessionManager:
     """Quản lý phiên hội thoại và trạng thái của người dùng"""
     
     @staticmethod
-    def get_or_create_session(user_id: str) -> str:
-        """Lấy phiên hiện tại hoặc tạo phiên mới nếu chưa có"""
+    def get_or_create_session(user_id: str) -> int:
+        """Lấy phiên hiện tại hoặc tạo phiên mới nếu chưa có, phiên cũ đã đóng hoặc đã quá hạn"""
         session_id = get_active_session(user_id)
         if not session_id:
             session_id = create_session(user_id)
         return session_id
     
+    @staticmethod
+    def close_session(user_id: str) -> None:
+        """Đóng phiên hiện tại, lịch sử và bản tóm tắt của phiên mới bắt đầu lại từ đầu"""
+        close_active_session(user_id)
+        with _summarizing_lock:
+            _unsummarized_counts.pop(user_id, None)
+    
+    @staticmethod
+    def _count_message(user_id: str) -> None:
+        with _summarizing_lock:
+            _unsummarized_counts[user_id] = _unsummarized_counts.get(user_id, 0) + 1
+    
     @staticmethod
     def add_user_message(user_id: str, content: str) -> None:
         """Thêm tin nhắn của người dùng vào lịch sử hội thoại"""
         session_id = SessionManager.get_or_create_session(user_id)
-        add_message(session_id, user_id, "user", content)
+        journal.add_message(session_id, user_id, "user", content)
+        SessionManager._count_message(user_id)
     
     @staticmethod
     def add_bot_message(user_id: str, content: str) -> None:
         """Thêm tin nhắn của bot vào lịch sử hội thoại"""
         session_id = SessionManager.get_or_create_session(user_id)
-        add_message(session_id, user_id, "bot", content)
+        journal.add_message(session_id, user_id, "bot", content)
+        SessionManager._count_message(user_id)
     
     @staticmethod
     def get_conversation_history(user_id: str) -> List[Dict[str, Any]]:
         """Lấy lịch sử hội thoại của người dùng"""
         session_id = SessionManager.get_or_create_session(user_id)
-        return get_session_messages(session_id)
+        return journal.get_session_messages(session_id)
     
     @staticmethod
     def get_formatted_history(user_id: str) -> List[Dict[str, str]]:
-        """Lấy lịch sử hội thoại định dạng phù hợp cho LLM"""
-        history = SessionManager.get_conversation_history(user_id)
+        """
+        Lấy lịch sử hội thoại định dạng phù hợp cho LLM
+        
+        Gồm bản tóm tắt các tin nhắn cũ (nếu có) và các tin nhắn chưa được tóm tắt.
+        """
+        session_id = SessionManager.get_or_create_session(user_id)
+        summary = get_session_summary(session_id)
         formatted_history = []
         
+        if summary:
+            history = journal.get_session_messages(session_id, after_seq=summary["summarized_until"])
+            formatted_history.append({
+                "role": "assistant",
+                "content": f"Tóm tắt hội thoại trước đó: {summary['summary'].get('summary', '')}"
+            })
+        else:
+            history = journal.get_session_messages(session_id)
+        
         for message in history:
             role = "user" if message["role"] == "user" else "assistant"
             formatted_history.append({
@@ -64,10 +112,75 @@ class SessionManager:
         
         return formatted_history
     
+    @staticmethod
+    def get_summary(user_id: str) -> Optional[Dict[str, Any]]:
+        """Lấy bản tóm tắt hội thoại (summary, mentioned_foods, mentioned_criteria, user_preferences)"""
+        session_id = SessionManager.get_or_create_session(user_id)
+        summary = get_session_summary(session_id)
+        return summary["summary"] if summary else None
+    
+    @staticmethod
+    def needs_summary(user_id: str) -> bool:
+        """
+        Kiểm tra nhanh (không đọc cơ sở dữ liệu) xem có thể cần tóm tắt hội thoại không
+        
+        Dựa trên số tin nhắn đã thêm kể từ lần kiểm tra gần nhất.
+        """
+        with _summarizing_lock:
+            return user_id not in _summarizing_users and _unsummarized_counts.get(user_id, 0) > SESSION_SUMMARY_TRIGGER
+    
+    @staticmethod
+    def summarize_history(user_id: str) -> None:
+        """
+        Gộp các tin nhắn cũ của phiên vào bản tóm tắt
+        
+        Chỉ chạy khi số tin nhắn chưa tóm tắt vượt quá SESSION_SUMMARY_TRIGGER; điều kiện
+        được kiểm tra trước bằng bộ đếm trong bộ nhớ (needs_summary), nên phần lớn các
+        lượt không phải chờ ghi journal hay đọc cơ sở dữ liệu. Hàm gọi LLM nên được chạy
+        nền sau khi đã trả lời người dùng.
+        """
+        with _summarizing_lock:
+            if user_id in _summarizing_users or _unsummarized_counts.get(user_id, 0) <= SESSION_SUMMARY_TRIGGER:
+                return
+            _summarizing_users.add(user_id)
+        
+        try:
+            # Import tại đây để module session không phụ thuộc vào LLM khi import
+            from llm.main import summarize_conversation
+            
+            # Chờ ghi xong các tin nhắn đang trong journal để mọi tin nhắn đều có seq
+            if not journal.flush(SESSION_SUMMARY_FLUSH_TIMEOUT):
+                logger.warning(f"Journal chưa ghi xong, bỏ qua tóm tắt hội thoại của {user_id} lượt này")
+                return
+            
+            session_id = SessionManager.get_or_create_session(user_id)
+            previous = get_session_summary(session_id)
+            pending = journal.get_session_messages(session_id, after_seq=previous["summarized_until"] if previous else None)
+            # Đồng bộ bộ đếm với số tin nhắn thực tế chưa tóm tắt
+            with _summarizing_lock:
+                _unsummarized_counts[user_id] = len(pending)
+            if len(pending) <= SESSION_SUMMARY_TRIGGER:
+                return
+            
+            to_summarize = pending[:-SESSION_SUMMARY_KEEP_RECENT] if SESSION_SUMMARY_KEEP_RECENT else pending
+            conversation = [
+                {"role": "user" if message["role"] == "user" else "assistant", "content": message["content"]}
+                for message in to_summarize
+            ]
+            summary = summarize_conversation(previous["summary"] if previous else None, conversation)
+            save_session_summary(session_id, summary, to_summarize[-1]["seq"])
+            with _summarizing_lock:
+                _unsummarized_counts[user_id] = max(0, _unsummarized_counts.get(user_id, 0) - len(to_summarize))
+        except Exception as e:
+            logger.error(f"Lỗi khi tóm tắt hội thoại: {e}")
+        finally:
+            with _summarizing_lock:
+                _summarizing_users.discard(user_id)
+    
     @staticmethod
     def get_state(user_id: str) -> ConversationState:
         """Lấy trạng thái hiện tại của người dùng"""
-        state_data = get_user_state(user_id)
+        state_data = journal.get_user_state(user_id)
         if not state_data:
             # Nếu chưa có trạng thái, thiết lập trạng thái mặc định là IDLE
             SessionManager.set_state(user_id, ConversationState.IDLE)
@@ -78,12 +191,12 @@ class SessionManager:
     @staticmethod
     def set_state(user_id: str, state: ConversationState, criteria: Optional[List[str]] = None, location: Optional[Tuple[float, float]] = None) -> None:
         """Cập nhật trạng thái của người dùng"""
-        set_user_state(user_id, state.value, criteria, location)
+        journal.set_user_state(user_id, state.value, criteria, location)
     
     @staticmethod
     def get_criteria(user_id: str) -> Optional[List[str]]:
         """Lấy tiêu chí món ăn của người dùng"""
-        state_data = get_user_state(user_id)
+        state_data = journal.get_user_state(user_id)
         if not state_data or not state_data["criteria"]:
             return None
         
@@ -92,7 +205,7 @@ class SessionManager:
     @staticmethod
     def get_location(user_id: str) -> Optional[Tuple[float, float]]:
         """Lấy vị trí của người dùng"""
-        state_data = get_user_state(user_id)
+        state_data = journal.get_user_state(user_id)
         if not state_data or not state_data["location"]:
             return None
         
@@ -105,5 +218,5 @@ class SessionManager:
     
     @staticmethod
     def clear_state(user_id: str) -> None:
-        """Xóa hoàn toàn trạng thái của người dùng"""
-        clear_user_state(user_id) 
\ No newline at end of file
+        """Xóa trạng thái, tiêu chí và vị trí của người dùng; phiên hội thoại hiện tại vẫn được giữ"""
+        journal.clear_user_state(user_id) 
\ No newline at end of file
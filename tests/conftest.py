@@ -0,0 +1,18 @@
+"""
+Cấu hình chung cho pytest.
+
+Các bài kiểm tra không cần kết nối mạng, khóa API thật hay cơ sở dữ liệu của bot:
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import tempfile
+
+# Thêm thư mục gốc vào sys.path để import các module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Cơ sở dữ liệu tạm và khóa API giả phải được thiết lập trước khi import các module của bot
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="food-chatbot-test-"), "test.db"))
+os.environ.setdefault("DB_ARCHIVE_DIR", os.path.join(os.path.dirname(os.environ["DB_PATH"]), "archive"))
+os.environ.setdefault("GOOGLE_API_KEY", "test")
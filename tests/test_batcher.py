@@ -0,0 +1,82 @@
+"""MicroBatcher: gửi nhóm khi hết cửa sổ hoặc khi đủ max_items, kết quả theo schema và lỗi của cả nhóm"""
+import re
+import json
+import time
+import threading
+
+import pytest
+
+import llm.main as llm
+from llm.main import MicroBatcher, CRITERIA_SCHEMA
+from test_circuit_breaker import FakeClient, completion
+
+class BatchClient(FakeClient):
+    """Client giả trả lời từng <item> của prompt gộp bằng answer(nội dung item)"""
+    
+    def __init__(self, answer):
+        super().__init__()
+        self.answer = answer
+        self.requests = []
+    
+    def create(self, **request):
+        self.calls += 1
+        self.requests.append(request)
+        items = re.findall(r'<item id="(\d+)">\n(.*?)\n</item>', request["messages"][-1]["content"], re.S)
+        return completion(json.dumps({item_id: self.answer(text) for item_id, text in items}, ensure_ascii=False))
+
+@pytest.fixture
+def use_client(monkeypatch):
+    def install(client):
+        monkeypatch.setattr(llm, "get_client", lambda: client)
+        return client
+    return install
+
+def submit_all(batcher, messages):
+    """Gửi các yêu cầu từ nhiều thread cùng lúc, trả về kết quả (hoặc lỗi) theo thứ tự"""
+    results = [None] * len(messages)
+    
+    def worker(index, message):
+        try:
+            results[index] = batcher.submit(message)
+        except Exception as e:
+            results[index] = e
+    
+    threads = [threading.Thread(target=worker, args=item) for item in enumerate(messages)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+def test_requests_in_one_window_share_one_call(use_client):
+    client = use_client(BatchClient(lambda text: [text.upper(), "dòng 2"]))
+    batcher = MicroBatcher("intent", "Trả lời", window_ms=200, max_items=10)
+    
+    results = submit_all(batcher, ["một", "hai", "ba"])
+    
+    assert client.calls == 1
+    # Câu trả lời văn bản được kiểm tra theo schema danh sách các dòng rồi ghép lại
+    assert results == ["MỘT\ndòng 2", "HAI\ndòng 2", "BA\ndòng 2"]
+    schema = client.requests[0]["response_format"]["json_schema"]["schema"]
+    assert schema["required"] == ["1", "2", "3"] and schema["properties"]["1"]["type"] == "array"
+
+def test_full_batch_is_sent_before_the_window_ends(use_client):
+    client = use_client(BatchClient(lambda text: {"criteria": [text]}))
+    batcher = MicroBatcher("extract_criteria", "Trích xuất", CRITERIA_SCHEMA, window_ms=5000, max_items=3)
+    
+    started = time.monotonic()
+    results = submit_all(batcher, ["nướng", "cay", "hải sản"])
+    
+    assert time.monotonic() - started < 2
+    assert client.calls == 1
+    assert results == [{"criteria": ["nướng"]}, {"criteria": ["cay"]}, {"criteria": ["hải sản"]}]
+
+def test_invalid_batch_result_fails_every_request(use_client):
+    # Kết quả không phải JSON, kể cả sau lần yêu cầu sửa
+    client = use_client(FakeClient(completion("không phải JSON"), completion("vẫn không phải JSON")))
+    batcher = MicroBatcher("intent", "Trả lời", window_ms=200, max_items=10)
+    
+    results = submit_all(batcher, ["một", "hai"])
+    
+    assert client.calls == 2
+    assert all(isinstance(result, ValueError) for result in results)
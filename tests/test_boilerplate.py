@@ -0,0 +1,23 @@
+"""Lịch sử gửi cho model không còn các đoạn cố định trong tin nhắn của bot"""
+from criteria.main import CriteriaProcessor
+from llm.main import PromptBudget
+from location.main import LocationService
+from render.templates import CRITERIA_CHOICES, FOLLOW_UP, criteria_suggestions
+
+def test_confirmation_boilerplate_is_removed():
+    message = "Bạn muốn ăn: nướng, cay." + criteria_suggestions(["hải sản"]) + CRITERIA_CHOICES
+    assert PromptBudget._compact_bot_message(message) == "Bạn muốn ăn: nướng, cay.\n\nTôi cũng gợi ý thêm các tiêu chí: hải sản"
+
+def test_fallback_confirmation_uses_current_wording(monkeypatch):
+    # Khi model lỗi, tin nhắn xác nhận dự phòng vẫn dùng cùng lời hướng dẫn
+    def fail(*args, **kwargs):
+        raise RuntimeError("model lỗi")
+    monkeypatch.setattr("criteria.main.get_model_response", fail)
+    message = CriteriaProcessor.format_criteria_for_confirmation(["nướng"])
+    assert message.endswith(CRITERIA_CHOICES)
+    assert PromptBudget._compact_bot_message(message) == "Tiêu chí bạn đã chọn: nướng"
+
+def test_results_follow_up_is_removed():
+    message = LocationService.format_restaurant_results([{"name": "Quán Nướng", "tags": {}}], ["nướng"])
+    assert message.endswith(FOLLOW_UP)
+    assert FOLLOW_UP not in PromptBudget._compact_bot_message(message)
@@ -0,0 +1,41 @@
+"""Các bước hội thoại của bot với Telegram giả: luồng nhanh cho người dùng quay lại"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot.main as bot_main
+from preferences.main import PreferenceStore
+from session.main import SessionManager, ConversationState
+
+def make_update(user_id: int, text: str):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id, first_name="Lan"),
+        effective_chat=SimpleNamespace(id=user_id),
+        message=SimpleNamespace(text=text)
+    )
+
+@pytest.fixture
+def replies(monkeypatch):
+    sent = []
+    
+    async def reply(update, text, **kwargs):
+        sent.append(text)
+    monkeypatch.setattr(bot_main, "reply", reply)
+    return sent
+
+def confirm(user_id: int, text: str) -> dict:
+    """Người dùng đã chọn "nướng" lần trước, đang xác nhận lại "nướng" bằng tin nhắn text"""
+    PreferenceStore.record_confirmed_criteria(str(user_id), ["nướng"])
+    SessionManager.set_state(str(user_id), ConversationState.CONFIRMING_CRITERIA, ["nướng"])
+    context = SimpleNamespace(user_data={})
+    asyncio.run(bot_main.handle_message(make_update(user_id, text), context))
+    assert SessionManager.get_state(str(user_id)) == ConversationState.WAITING_FOR_LOCATION
+    return context.user_data
+
+def test_same_as_last_button_takes_fast_path(replies):
+    assert confirm(9001, bot_main.SAME_AS_LAST_BUTTON)["fast_path"] is True
+
+def test_typing_the_same_criteria_still_ranks_with_llm(replies):
+    # Tiêu chí giống lần trước nhưng người dùng tự xác nhận: vẫn xếp hạng bằng Gemini
+    assert confirm(9002, "xác nhận")["fast_path"] is False
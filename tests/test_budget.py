@@ -0,0 +1,63 @@
+"""Hạn chót của lượt: Deadline.allows, chế độ chỉ dùng cache của Overpass và lần thử lại LLM"""
+import pytest
+
+import llm.main as llm
+import location.main as location
+from budget.main import Deadline, BUDGET_REPLY_RESERVE_S
+from test_circuit_breaker import FakeClient, completion
+
+def test_allows_keeps_the_reply_reserve():
+    assert Deadline(BUDGET_REPLY_RESERVE_S + 5).allows(4, "test")
+    # Còn đủ 4 giây nhưng không đủ khi trừ phần dành để trả lời
+    assert not Deadline(BUDGET_REPLY_RESERVE_S + 3).allows(4, "test")
+    assert not Deadline(0).allows(0.5, "test")
+
+def test_timeout_is_capped_by_remaining_time():
+    assert Deadline.timeout_for(None, 7) == 7
+    assert Deadline(60).timeout(7) == 7
+    assert Deadline(BUDGET_REPLY_RESERVE_S + 2).timeout(7) <= 2
+    assert Deadline(0).timeout(7) == 0.1
+
+def test_fetch_options_switch_to_cache_only():
+    assert location._fetch_options(None) == (location.OVERPASS_TIMEOUT, False)
+    assert location._fetch_options(Deadline(60)) == (location.OVERPASS_TIMEOUT, False)
+    
+    timeout, cache_only = location._fetch_options(Deadline(BUDGET_REPLY_RESERVE_S + 1))
+    assert cache_only and timeout <= 1
+
+@pytest.fixture
+def retrying(monkeypatch):
+    """Một lần thử lại, không chờ giữa các lần thử, circuit breaker mới"""
+    monkeypatch.setattr(llm, "LLM_MAX_RETRIES", 1)
+    monkeypatch.setattr(llm, "LLM_RETRY_BACKOFF_S", 0)
+    monkeypatch.setattr(llm, "_breakers", {})
+
+def recording(client):
+    timeouts = []
+    create = client.create
+    
+    def recording_create(**request):
+        timeouts.append(request["timeout"])
+        return create(**request)
+    
+    client.chat.completions.create = recording_create
+    return timeouts
+
+def test_failed_attempt_is_retried_with_its_own_timeout(retrying):
+    client = FakeClient(RuntimeError("503"), completion())
+    timeouts = recording(client)
+    
+    assert llm._complete(client, [{"role": "user", "content": "xin chào"}], deadline=Deadline(60)) == "ok"
+    assert client.calls == 2
+    profile_timeout = llm.TASK_PROFILES["default"]["timeout"]
+    assert all(0 < timeout <= profile_timeout for timeout in timeouts)
+
+def test_no_retry_when_the_turn_budget_is_spent(retrying):
+    client = FakeClient(RuntimeError("503"), completion())
+    timeouts = recording(client)
+    
+    with pytest.raises(llm.LLMUnavailableError):
+        llm._complete(client, [{"role": "user", "content": "xin chào"}], deadline=Deadline(BUDGET_REPLY_RESERVE_S + 2))
+    # Thời gian chờ của lần thử không vượt quá thời gian còn lại trừ phần dành để trả lời
+    assert client.calls == 1
+    assert timeouts[0] <= 2
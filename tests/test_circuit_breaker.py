@@ -0,0 +1,101 @@
+"""CircuitBreaker và cách _complete ghi nhận kết quả vào circuit breaker"""
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+import llm.main as llm
+from llm.main import CircuitBreaker, LLMUnavailableError
+
+RESET_S = 0.05
+
+def completion(content="ok"):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(prompt_tokens=1, completion_tokens=1)
+    )
+
+def bad_request():
+    request = httpx.Request("POST", "http://llm.test/v1/chat/completions")
+    return openai.BadRequestError("yêu cầu không hợp lệ", response=httpx.Response(400, request=request), body=None)
+
+class FakeClient:
+    """OpenAI client giả: trả về hoặc ném lần lượt các kết quả trong outcomes"""
+    
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+    
+    def create(self, **request):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+@pytest.fixture
+def breaker(monkeypatch):
+    # Mỗi lần gọi là một lần thử duy nhất để đếm lỗi theo từng lần gọi
+    monkeypatch.setattr(llm, "LLM_MAX_RETRIES", 0)
+    model = llm.TASK_PROFILES["default"]["model"]
+    breaker = CircuitBreaker(model, failure_threshold=2, reset_timeout=RESET_S)
+    monkeypatch.setitem(llm._breakers, model, breaker)
+    return breaker
+
+def call(client):
+    return llm._complete(client, [{"role": "user", "content": "xin chào"}])
+
+def test_closed_open_half_open_closed(breaker):
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    
+    time.sleep(RESET_S)
+    assert breaker.state == "half_open"
+    # Chỉ một lần gọi thử tại một thời điểm
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+def test_failed_probe_opens_again(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(RESET_S)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+def test_client_error_on_probe_keeps_breaker_open(breaker):
+    client = FakeClient(RuntimeError("503"), RuntimeError("503"), bad_request(), completion())
+    for _ in range(2):
+        with pytest.raises(LLMUnavailableError):
+            call(client)
+    assert breaker.state == "open"
+    
+    # Bị từ chối ngay, không gọi model
+    with pytest.raises(LLMUnavailableError):
+        call(client)
+    assert client.calls == 2
+    
+    # Lần gọi thử gặp lỗi do yêu cầu: không đóng circuit breaker, nhưng cho phép thử lại
+    time.sleep(RESET_S)
+    with pytest.raises(LLMUnavailableError):
+        call(client)
+    assert client.calls == 3
+    assert breaker.state == "half_open" and breaker.failures == 2
+    
+    assert call(client) == "ok"
+    assert breaker.state == "closed" and breaker.failures == 0
+
+def test_client_error_does_not_reset_failure_count(breaker):
+    client = FakeClient(RuntimeError("503"), bad_request(), RuntimeError("503"))
+    for _ in range(3):
+        with pytest.raises(LLMUnavailableError):
+            call(client)
+    # Lỗi 400 ở giữa không xóa lỗi trước đó, nên hai lỗi 503 vẫn ngắt circuit breaker
+    assert breaker.state == "open"
@@ -0,0 +1,65 @@
+"""Bàn phím chọn tiêu chí: callback_data, đọc lại tiêu chí từ nhãn nút và nút bật/tắt trong bot"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot.main as bot_main
+from bot.criteria_editor import CriteriaEditor, CALLBACK_CONFIRM, CALLBACK_CANCEL, SELECTED_MARK, OPTION_MARK
+from session.main import SessionManager, ConversationState
+
+OPTIONS = ["nướng", "hải sản", "✅ lạ", "cay nồng 🌶"]
+
+def test_options_round_trip_through_the_keyboard():
+    markup = CriteriaEditor.build_keyboard(["hải sản"], OPTIONS)
+    
+    # Tiêu chí có dấu cách hoặc bắt đầu bằng ký tự giống dấu vẫn được đọc lại nguyên vẹn
+    assert CriteriaEditor.keyboard_options(markup) == OPTIONS
+    labels = [button.text for row in markup.inline_keyboard for button in row]
+    assert labels[:2] == [f"{OPTION_MARK} nướng", f"{SELECTED_MARK} hải sản"]
+    assert all(len(button.callback_data.encode("utf-8")) <= 64 for row in markup.inline_keyboard for button in row)
+    assert CriteriaEditor.keyboard_options(None) == []
+
+def test_label_without_mark_is_kept_whole():
+    assert CriteriaEditor._option("hải sản") == "hải sản"
+
+def test_parse_callback():
+    markup = CriteriaEditor.build_keyboard([], OPTIONS)
+    toggles = [button.callback_data for row in markup.inline_keyboard[:-1] for button in row]
+    
+    assert [CriteriaEditor.parse_callback(data) for data in toggles] == [("toggle", index) for index in range(len(OPTIONS))]
+    assert CriteriaEditor.parse_callback(CALLBACK_CONFIRM) == ("confirm", None)
+    assert CriteriaEditor.parse_callback(CALLBACK_CANCEL) == ("cancel", None)
+    with pytest.raises(ValueError):
+        CriteriaEditor.parse_callback("crit:khác")
+
+def test_toggle():
+    assert CriteriaEditor.toggle(["nướng"], "cay") == ["nướng", "cay"]
+    assert CriteriaEditor.toggle(["nướng", "cay"], "nướng") == ["cay"]
+
+def test_toggle_button_updates_criteria_and_keyboard(monkeypatch):
+    edits = []
+    
+    async def edit_message(update, text, reply_markup=None):
+        edits.append(reply_markup)
+    
+    async def answer(*args):
+        return None
+    monkeypatch.setattr(bot_main, "edit_message", edit_message)
+    
+    user_id = 9101
+    SessionManager.set_state(str(user_id), ConversationState.CONFIRMING_CRITERIA, ["nướng"])
+    markup = CriteriaEditor.build_keyboard(["nướng"], OPTIONS)
+    query = SimpleNamespace(
+        data=markup.inline_keyboard[0][1].callback_data,
+        message=SimpleNamespace(is_accessible=True, reply_markup=markup),
+        answer=answer
+    )
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id), effective_chat=SimpleNamespace(id=user_id), callback_query=query)
+    
+    asyncio.run(bot_main.handle_criteria_callback(update, SimpleNamespace(user_data={})))
+    
+    assert SessionManager.get_criteria(str(user_id)) == ["nướng", "hải sản"]
+    (new_markup,) = edits
+    assert CriteriaEditor.keyboard_options(new_markup) == OPTIONS
+    assert new_markup.inline_keyboard[0][1].text == f"{SELECTED_MARK} hải sản"
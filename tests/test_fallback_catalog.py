@@ -0,0 +1,29 @@
+"""Tra cứu món ăn theo tiêu chí trong fallback/catalog.py"""
+from fallback.catalog import DishCatalog
+
+def names(criteria, count=3):
+    return [dish["name"] for dish in DishCatalog.suggest(criteria, count)]
+
+def test_criterion_containing_a_tag_matches_it():
+    assert DishCatalog._matching_keys("đồ nướng") == ["nướng"]
+    assert DishCatalog._matching_keys("hải sản tươi") == ["hải sản"]
+    assert DishCatalog._matching_keys("món Ý") == ["ý"]
+
+def test_criterion_inside_a_dish_name_matches_it():
+    assert DishCatalog._matching_keys("phở") == ["phở bò"]
+
+def test_partial_words_do_not_match():
+    # 'ý' là một phần của 'quý', 'bò' một phần của 'bòn', không phải trọn từ
+    assert DishCatalog._matching_keys("quý khách") == []
+    assert DishCatalog._matching_keys("bòn bon") == []
+    assert DishCatalog._matching_keys("a") == []
+    assert DishCatalog._matching_keys("  ") == []
+
+def test_suggest_ranks_dishes_matching_most_criteria_first():
+    assert names(["cay", "hải sản", "nước"], 1) == ["Lẩu thái hải sản"]
+    suggestions = DishCatalog.suggest(["đồ chay", "có nước"], 1)
+    assert suggestions[0]["name"] == "Lẩu nấm chay"
+    assert suggestions[0]["matched"] == ["đồ chay", "có nước"]
+
+def test_unknown_criteria_fall_back_to_popular_dishes():
+    assert names(["quý khách"]) == ["Phở bò", "Bún chả", "Bánh mì thịt"]
@@ -0,0 +1,136 @@
+"""MessageJournal: đọc được bản ghi chưa commit, thứ tự ghi và việc bỏ bản ghi khi commit lỗi"""
+import sqlite3
+import threading
+
+import pytest
+
+import database.journal as journal_module
+from database.journal import MessageJournal
+from database.main import create_session, get_session_messages, get_user_state
+from metrics.main import registry
+
+@pytest.fixture
+def journal():
+    # Cửa sổ gom dài để các bản ghi còn nằm trong bộ nhớ khi được đọc lại
+    journal = MessageJournal(flush_ms=200)
+    yield journal
+    journal.close(timeout=5)
+
+@pytest.fixture
+def session_id():
+    return create_session("journal-user")
+
+def test_read_after_unflushed_write(journal, session_id):
+    journal.add_message(session_id, "journal-user", "user", "Tôi muốn ăn đồ nướng")
+    journal.set_user_state("journal-user", "COLLECTING_CRITERIA", ["nướng"])
+    
+    # Chưa có gì trong cơ sở dữ liệu, nhưng journal vẫn trả về những gì vừa ghi
+    assert get_session_messages(session_id) == []
+    messages = journal.get_session_messages(session_id)
+    assert [(message["seq"], message["content"]) for message in messages] == [(None, "Tôi muốn ăn đồ nướng")]
+    assert journal.get_user_state("journal-user")["current_state"] == "COLLECTING_CRITERIA"
+    
+    journal.clear_user_state("journal-user")
+    state = journal.get_user_state("journal-user")
+    assert state["current_state"] == "IDLE" and state["criteria"] is None
+
+def test_flush_commits_in_order(journal, session_id):
+    contents = [f"tin nhắn {index}" for index in range(50)]
+    for index, content in enumerate(contents):
+        journal.add_message(session_id, "journal-user", "user" if index % 2 == 0 else "bot", content)
+    journal.set_user_state("journal-user", "COLLECTING_CRITERIA")
+    journal.set_user_state("journal-user", "CONFIRMING_CRITERIA", ["cay"])
+    
+    assert journal.flush(timeout=5)
+    
+    stored = get_session_messages(session_id)
+    assert [message["content"] for message in stored] == contents
+    assert [message["seq"] for message in stored] == sorted(message["seq"] for message in stored)
+    # Trạng thái ghi sau cùng thắng
+    assert get_user_state("journal-user")["current_state"] == "CONFIRMING_CRITERIA"
+    # Bộ nhớ tạm đã được dọn, không đọc trùng tin nhắn
+    assert journal.get_session_messages(session_id) == stored
+    assert journal._pending_messages == {} and journal._pending_states == {}
+
+def test_unflushed_messages_stay_after_stored_ones(journal, session_id):
+    journal.add_message(session_id, "journal-user", "user", "đầu tiên")
+    journal.flush(timeout=5)
+    journal.add_message(session_id, "journal-user", "bot", "thứ hai")
+    
+    messages = journal.get_session_messages(session_id)
+    assert [message["content"] for message in messages] == ["đầu tiên", "thứ hai"]
+    assert messages[0]["seq"] is not None and messages[1]["seq"] is None
+
+def test_records_are_dropped_after_commit_keeps_failing(journal, session_id, monkeypatch, caplog):
+    attempts = []
+    
+    def failing_insert(*args, **kwargs):
+        attempts.append(threading.current_thread().name)
+        raise sqlite3.OperationalError("database is locked")
+    
+    monkeypatch.setattr(journal_module, "_insert_message", failing_insert)
+    monkeypatch.setattr(journal_module, "DB_JOURNAL_RETRIES", 1)
+    monkeypatch.setattr(registry, "enabled", True)
+    dropped_before = dict(registry._counters.get("db_journal_dropped_total", {}))
+    
+    journal.add_message(session_id, "journal-user", "user", "sẽ bị mất")
+    journal.set_user_state("journal-user", "IDLE")
+    # flush() báo việc mất dữ liệu, mỗi bản ghi bị bỏ chỉ được báo một lần
+    assert not journal.flush(timeout=5)
+    assert journal._dropped == set()
+    
+    # Một lần ghi và một lần thử lại, sau đó bản ghi bị bỏ khỏi bộ nhớ tạm
+    assert len(attempts) == 2
+    assert get_session_messages(session_id) == []
+    assert journal.get_session_messages(session_id) == []
+    assert journal._pending_messages == {} and journal._pending_states == {}
+    
+    # Mỗi bản ghi bị bỏ có một dòng log lỗi và được đếm theo loại
+    dropped_logs = [record for record in caplog.records if record.levelname == "ERROR" and "Mất" in record.getMessage()]
+    assert len(dropped_logs) == 2
+    dropped = registry._counters["db_journal_dropped_total"]
+    assert dropped[(("kind", "message"),)] - dropped_before.get((("kind", "message"),), 0) == 1
+    assert dropped[(("kind", "state"),)] - dropped_before.get((("kind", "state"),), 0) == 1
+    
+    # Journal vẫn hoạt động sau khi cơ sở dữ liệu trở lại bình thường
+    monkeypatch.undo()
+    journal.add_message(session_id, "journal-user", "user", "đã ghi")
+    assert journal.flush(timeout=5)
+    assert [message["content"] for message in get_session_messages(session_id)] == ["đã ghi"]
+
+def test_writer_failure_wakes_flush_and_falls_back_to_direct_writes(session_id, monkeypatch):
+    def broken_connection():
+        raise sqlite3.OperationalError("unable to open database file")
+    
+    monkeypatch.setattr(journal_module, "get_connection", broken_connection)
+    journal = MessageJournal(flush_ms=200)
+    journal.add_message(session_id, "journal-user", "user", "sẽ bị mất")
+    
+    # Không chờ mãi dù không có thời gian chờ
+    assert journal.flush() is False
+    assert isinstance(journal._failed, sqlite3.OperationalError)
+    assert journal._pending_messages == {}
+    
+    # Các lần ghi sau được ghi trực tiếp
+    journal.add_message(session_id, "journal-user", "user", "ghi trực tiếp")
+    assert [message["content"] for message in get_session_messages(session_id)] == ["ghi trực tiếp"]
+    journal.close(timeout=5)
+
+def test_summary_is_skipped_when_flush_fails(monkeypatch):
+    import llm.main
+    import session.main as session_module
+    
+    timeouts = []
+    
+    def failed_flush(timeout=None):
+        timeouts.append(timeout)
+        return False
+    
+    monkeypatch.setattr(session_module.journal, "flush", failed_flush)
+    monkeypatch.setattr(llm.main, "summarize_conversation", lambda *args: pytest.fail("không được tóm tắt"))
+    monkeypatch.setitem(session_module._unsummarized_counts, "journal-user", session_module.SESSION_SUMMARY_TRIGGER + 1)
+    
+    session_module.SessionManager.summarize_history("journal-user")
+    
+    assert timeouts == [session_module.SESSION_SUMMARY_FLUSH_TIMEOUT]
+    assert "journal-user" not in session_module._summarizing_users
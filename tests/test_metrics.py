@@ -0,0 +1,83 @@
+"""MetricsRegistry: counter, histogram, nhãn của lượt hội thoại và đường đi không làm gì khi tắt metrics"""
+import asyncio
+import urllib.request
+
+import pytest
+
+import metrics.main as metrics
+from metrics.main import MetricsRegistry
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = MetricsRegistry(enabled=True)
+    monkeypatch.setattr(metrics, "registry", registry)
+    return registry
+
+def test_counters_are_rendered_with_escaped_labels(registry):
+    metrics.inc("requests_total", endpoint="a")
+    metrics.inc("requests_total", 2, endpoint="a")
+    metrics.inc("requests_total", reason='say "hi"\n')
+    
+    lines = registry.render().splitlines()
+    assert lines[0] == "# TYPE requests_total counter"
+    assert 'requests_total{endpoint="a"} 3' in lines
+    assert 'requests_total{reason="say \\"hi\\"\\n"} 1' in lines
+
+def test_histogram_buckets_are_cumulative(registry):
+    registry.observe("duration_seconds", 0.02, stage="x")
+    registry.observe("duration_seconds", 3.0, stage="x")
+    
+    text = registry.render()
+    assert 'duration_seconds_bucket{stage="x",le="0.01"} 0' in text
+    assert 'duration_seconds_bucket{stage="x",le="0.025"} 1' in text
+    assert 'duration_seconds_bucket{stage="x",le="5.0"} 2' in text
+    assert 'duration_seconds_bucket{stage="x",le="+Inf"} 2' in text
+    assert 'duration_seconds_count{stage="x"} 2' in text
+
+def test_turn_labels_apply_to_inner_spans(registry):
+    @metrics.timed("lookup")
+    def lookup():
+        return "ok"
+    
+    @metrics.timed_turn("message")
+    async def handler():
+        metrics.set_turn_label("state", "IDLE")
+        return lookup()
+    
+    assert asyncio.run(handler()) == "ok"
+    text = registry.render()
+    assert 'bot_turns_total{handler="message",state="IDLE"} 1' in text
+    assert 'bot_stage_duration_seconds_count{handler="message",outcome="ok",stage="lookup",state="IDLE"} 1' in text
+
+def test_failed_span_is_labelled_error(registry):
+    with pytest.raises(ValueError):
+        with metrics.span("parse"):
+            raise ValueError("lỗi")
+    assert 'bot_stage_duration_seconds_count{outcome="error",stage="parse"} 1' in registry.render()
+
+def test_disabled_registry_records_nothing(monkeypatch):
+    registry = MetricsRegistry(enabled=False)
+    monkeypatch.setattr(metrics, "registry", registry)
+    
+    @metrics.timed("lookup")
+    def lookup():
+        return "ok"
+    
+    metrics.inc("requests_total")
+    registry.observe("duration_seconds", 1.0)
+    metrics.set_turn_label("state", "IDLE")
+    assert lookup() == "ok"
+    assert metrics.span("parse") is metrics._NOOP_SPAN
+    assert registry.render() == "\n"
+    assert metrics.start_metrics_server(port=0) is None
+
+def test_metrics_endpoint_serves_the_registry(registry):
+    metrics.inc("requests_total", endpoint="a")
+    server = metrics.start_metrics_server(port=0, host="127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.read().decode("utf-8") == registry.render()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,168 @@
+"""Chuyển cơ sở dữ liệu cũ (lược đồ 0 và 2) sang lược đồ hiện tại, codec nội dung tin nhắn và từ điển nén"""
+import json
+import zlib
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import database.main as db
+import database.codec as codec
+from database.codec import DB_COMPRESS_MIN_BYTES, encode_content, decode_content
+from database.zdict import build_dictionary
+from render.templates import FOLLOW_UP
+
+SHORT = "Tôi muốn ăn đồ nướng"
+LONG = (
+    "Dựa trên tiêu chí của bạn (nướng, cay), đây là top 3 quán ăn gần bạn:\n\n"
+    "#1: Tên: Quán Nướng Hàng Bạc\nĐịa chỉ: Phố Hàng Bạc, Hà Nội\nKhoảng cách: 120m\n\n"
+    + FOLLOW_UP
+)
+
+# Lược đồ 0: khóa uuid4 dạng TEXT, thời gian ISO-8601, nội dung không nén
+V0_SCHEMA = """
+CREATE TABLE sessions (session_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, created_at TEXT NOT NULL, last_updated TEXT NOT NULL);
+CREATE TABLE messages (message_id TEXT PRIMARY KEY, session_id TEXT NOT NULL, user_id TEXT NOT NULL, role TEXT NOT NULL,
+    content TEXT NOT NULL, timestamp TEXT NOT NULL, FOREIGN KEY (session_id) REFERENCES sessions (session_id));
+CREATE TABLE session_summaries (session_id TEXT PRIMARY KEY, summary TEXT NOT NULL, summarized_until INTEGER NOT NULL,
+    last_updated TEXT NOT NULL, FOREIGN KEY (session_id) REFERENCES sessions (session_id));
+CREATE TABLE user_preferences (user_id TEXT PRIMARY KEY, last_criteria TEXT, criteria_counts TEXT, last_restaurant TEXT, last_updated TEXT NOT NULL);
+CREATE TABLE user_states (user_id TEXT PRIMARY KEY, current_state TEXT NOT NULL, criteria TEXT, location TEXT, last_updated TEXT NOT NULL);
+"""
+
+def iso(minutes_ago: int) -> str:
+    return (datetime.now() - timedelta(minutes=minutes_ago)).isoformat()
+
+@pytest.fixture
+def v0_database(tmp_path, monkeypatch):
+    """Cơ sở dữ liệu lược đồ 0: hai người dùng, ba phiên, bảy tin nhắn và một bản tóm tắt"""
+    path = str(tmp_path / "v0.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(V0_SCHEMA)
+    sessions = [("uuid-a1", "alice", 60), ("uuid-b1", "bob", 50), ("uuid-a2", "alice", 10)]
+    for session_id, user_id, minutes_ago in sessions:
+        conn.execute("INSERT INTO sessions VALUES (?, ?, ?, ?)", (session_id, user_id, iso(minutes_ago + 5), iso(minutes_ago)))
+    messages = [
+        ("uuid-a1", "alice", "user", SHORT), ("uuid-a1", "alice", "bot", LONG),
+        ("uuid-b1", "bob", "user", "Gợi ý món ăn"), ("uuid-a2", "alice", "user", "cay"),
+        ("uuid-a2", "alice", "bot", LONG), ("uuid-b1", "bob", "bot", SHORT), ("uuid-a2", "alice", "user", "Xác nhận"),
+    ]
+    for index, (session_id, user_id, role, content) in enumerate(messages):
+        conn.execute("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)",
+                     (f"uuid-m{index}", session_id, user_id, role, content, iso(40 - index)))
+    # summarized_until là rowid của tin nhắn cuối cùng đã được tóm tắt
+    conn.execute("INSERT INTO session_summaries VALUES (?, ?, ?, ?)",
+                 ("uuid-a2", json.dumps({"summary": "Alice thích đồ cay"}), 4, iso(5)))
+    for user_id in ("alice", "bob"):
+        conn.execute("INSERT INTO user_states VALUES (?, 'IDLE', NULL, NULL, ?)", (user_id, iso(1)))
+    conn.commit()
+    conn.close()
+    
+    monkeypatch.setattr(db, "DB_PATH", path)
+    return path
+
+def test_migrate_v0_to_current_schema(v0_database):
+    before = sqlite3.connect(v0_database)
+    old_messages = before.execute(
+        "SELECT m.rowid, s.rowid, m.role, m.content FROM messages m JOIN sessions s USING (session_id) ORDER BY m.rowid"
+    ).fetchall()
+    old_sessions = before.execute("SELECT rowid, user_id FROM sessions ORDER BY rowid").fetchall()
+    before.close()
+    
+    db.init_database()
+    
+    conn = sqlite3.connect(v0_database)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == db.SCHEMA_VERSION == 3
+    # Khóa mới chính là rowid cũ
+    assert conn.execute("SELECT session_id, user_id FROM sessions ORDER BY session_id").fetchall() == old_sessions
+    new_messages = conn.execute("SELECT message_id, session_id, role, content FROM messages ORDER BY message_id").fetchall()
+    assert len(new_messages) == len(old_messages) == 7
+    assert [row[:3] for row in new_messages] == [row[:3] for row in old_messages]
+    assert [decode_content(row[3]) for row in new_messages] == [row[3] for row in old_messages]
+    # Tin nhắn dài được nén thành BLOB, tin nhắn ngắn giữ nguyên TEXT
+    stored_types = {content: type(row[3]) for content, row in zip((row[3] for row in old_messages), new_messages)}
+    assert stored_types[LONG] is bytes and stored_types[SHORT] is str
+    assert conn.execute("SELECT session_id, summarized_until FROM session_summaries").fetchall() == [(3, 4)]
+    # Con trỏ phiên hiện tại trỏ tới phiên được cập nhật gần nhất của mỗi người dùng
+    assert dict(conn.execute("SELECT user_id, active_session_id FROM user_states")) == {"alice": 3, "bob": 2}
+    assert {type(value) for (value,) in conn.execute("SELECT last_updated FROM user_states")} == {int}
+    assert not conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%_compact'").fetchall()
+    conn.close()
+    
+    # Các hàm đọc của bot dùng được lược đồ mới
+    assert db.get_active_session("alice") == 3
+    messages = db.get_session_messages(3, after_seq=4)
+    assert [(message["seq"], message["content"]) for message in messages] == [(5, LONG), (7, "Xác nhận")]
+    assert db.get_session_summary(3)["summary"] == {"summary": "Alice thích đồ cay"}
+    
+    # Chạy lại không thay đổi gì
+    db.init_database()
+    conn = sqlite3.connect(v0_database)
+    assert conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == 7
+    conn.close()
+
+def test_codec_round_trips_below_and_above_threshold():
+    below = "a" * (DB_COMPRESS_MIN_BYTES - 1)
+    assert encode_content(below) == below
+    assert decode_content(encode_content(below)) == below
+    assert encode_content(SHORT) == SHORT
+    
+    encoded = encode_content(LONG)
+    assert isinstance(encoded, bytes)
+    assert len(encoded) < len(LONG.encode("utf-8")) // 2
+    assert decode_content(encoded) == LONG
+    
+    # Nội dung không nén được nhỏ hơn vẫn được lưu dạng TEXT
+    noise = "".join(chr(0x4E00 + (index * 7919) % 20000) for index in range(100))
+    assert decode_content(encode_content(noise)) == noise
+
+def test_migrate_v2_state_timestamps_to_epoch(tmp_path, monkeypatch):
+    path = str(tmp_path / "v2.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+    CREATE TABLE user_preferences (user_id TEXT PRIMARY KEY, last_criteria TEXT, criteria_counts TEXT, last_restaurant TEXT, last_updated TEXT NOT NULL);
+    CREATE TABLE user_states (user_id TEXT PRIMARY KEY, current_state TEXT NOT NULL, criteria TEXT, location TEXT,
+        last_updated TEXT NOT NULL, active_session_id INTEGER);
+    """)
+    for statement in db.compact_tables():
+        conn.execute(statement)
+    updated = datetime(2024, 5, 1, 12, 30)
+    conn.execute("INSERT INTO sessions (session_id, user_id, created_at, last_updated) VALUES (7, 'alice', 1, 1)")
+    conn.execute("INSERT INTO user_states VALUES ('alice', 'IDLE', NULL, NULL, ?, 7)", (updated.isoformat(),))
+    conn.execute("INSERT INTO user_preferences VALUES ('alice', ?, NULL, NULL, ?)", (json.dumps(["cay"]), updated.isoformat()))
+    conn.execute("PRAGMA user_version = 2")
+    conn.commit()
+    conn.close()
+    
+    db.init_database()
+    
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 3
+    expected = int(updated.timestamp())
+    assert conn.execute("SELECT last_updated, active_session_id FROM user_states").fetchall() == [(expected, 7)]
+    assert conn.execute("SELECT last_criteria, last_updated FROM user_preferences").fetchall() == [('["cay"]', expected)]
+    assert conn.execute("SELECT type FROM pragma_table_info('user_states') WHERE name = 'last_updated'").fetchone() == ("INTEGER",)
+    conn.close()
+
+def test_content_compressed_with_v1_dictionary_still_decodes():
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=codec._ZDICT_V1)
+    stored = bytes((codec._FORMAT_ZLIB_V1,)) + compressor.compress(LONG.encode("utf-8")) + compressor.flush()
+    assert decode_content(stored) == LONG
+    
+    # Nội dung mới được nén bằng từ điển mới nhất
+    assert encode_content(LONG)[0] == codec._FORMAT_ZLIB_V2
+    with pytest.raises(ValueError):
+        decode_content(bytes((99,)) + stored[1:])
+
+def test_dictionary_keeps_only_fixed_pieces_that_occur():
+    pieces = ["Khoảng cách: ", "Địa chỉ: ", "không bao giờ xuất hiện", FOLLOW_UP]
+    samples = [LONG, LONG.replace("Hàng Bạc", "Hàng Gai")]
+    
+    dictionary = build_dictionary(pieces, samples).decode("utf-8")
+    
+    # Chỉ có câu chữ cố định, không có dữ liệu của quán (tên, địa chỉ); đoạn tiết kiệm nhiều nhất nằm cuối
+    assert dictionary == "Địa chỉ: " + "Khoảng cách: " + FOLLOW_UP
+    assert "Hàng Bạc" not in dictionary
+    assert build_dictionary(reversed(pieces), samples).decode("utf-8") == dictionary
+    assert len(build_dictionary(pieces, samples, size=len(FOLLOW_UP.encode("utf-8")))) == len(FOLLOW_UP.encode("utf-8"))
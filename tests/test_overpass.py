@@ -0,0 +1,197 @@
+"""OverpassClient với máy chủ Overpass giả chạy bằng http.server"""
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+import pytest
+
+import location.main as location
+from location.main import LocationService, OverpassClient, _build_overpass_query
+from benchmark.fixtures import HOAN_KIEM, generate_overpass_response
+
+PAYLOAD = json.dumps(generate_overpass_response(HOAN_KIEM, 50)).encode("utf-8")
+
+class StubOverpass:
+    """
+    Máy chủ Overpass giả: mỗi đường dẫn (/a, /b, ...) là một máy chủ, trả về
+    PAYLOAD sau `delay` giây hoặc mã lỗi đã cấu hình cho đường dẫn đó
+    """
+    
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.statuses: Dict[str, Tuple[int, Dict[str, str]]] = {}
+        self.requests: List[str] = []
+        self._lock = threading.Lock()
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    stub.requests.append(self.path)
+                time.sleep(stub.delay)
+                status, headers = stub.statuses.get(self.path, (200, {}))
+                body = PAYLOAD if status == 200 else b"{}"
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+    
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+    
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub(monkeypatch):
+    # Máy chủ giả chạy trên localhost, không đi qua proxy của môi trường
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+    server = StubOverpass()
+    yield server
+    server.close()
+
+def test_concurrent_identical_queries_make_one_request(stub):
+    stub.delay = 0.3
+    client = OverpassClient([stub.url("/a")])
+    query = _build_overpass_query(*HOAN_KIEM, 1000)
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: client.fetch(query), range(8)))
+    
+    assert stub.requests == ["/a"]
+    assert all(result == PAYLOAD for result in results)
+
+def test_retry_after_moves_traffic_to_next_endpoint(stub):
+    stub.statuses["/a"] = (429, {"Retry-After": "60"})
+    client = OverpassClient([stub.url("/a"), stub.url("/b")])
+    
+    assert client.fetch(_build_overpass_query(*HOAN_KIEM, 1000)) == PAYLOAD
+    assert stub.requests == ["/a", "/b"]
+    assert client.endpoints[0].is_cooling_down(time.monotonic())
+    
+    # Máy chủ đang tạm ngưng theo Retry-After được xếp sau, truy vấn tiếp theo đi thẳng đến /b
+    assert client.fetch(_build_overpass_query(*HOAN_KIEM, 2000)) == PAYLOAD
+    assert stub.requests == ["/a", "/b", "/b"]
+
+def test_cache_hit_within_ttl_makes_no_request(stub):
+    client = OverpassClient([stub.url("/a")], cache_ttl=60)
+    query = _build_overpass_query(*HOAN_KIEM, 1000)
+    
+    client.fetch(query)
+    assert client.fetch(query) == PAYLOAD
+    assert client.fetch(query, cache_only=True) == PAYLOAD
+    assert stub.requests == ["/a"]
+
+def test_expired_cache_entry_is_fetched_again(stub):
+    client = OverpassClient([stub.url("/a")], cache_ttl=0.05)
+    query = _build_overpass_query(*HOAN_KIEM, 1000)
+    
+    client.fetch(query)
+    time.sleep(0.1)
+    client.fetch(query)
+    assert stub.requests == ["/a", "/a"]
+
+def test_rate_limited_endpoint_is_skipped(stub):
+    client = OverpassClient([stub.url("/a"), stub.url("/b")], rate=0.01, burst=1, queue_timeout=0.05, cache_ttl=0)
+    
+    client.fetch(_build_overpass_query(*HOAN_KIEM, 1000))
+    client.fetch(_build_overpass_query(*HOAN_KIEM, 2000))
+    assert stub.requests == ["/a", "/b"]
+
+def test_nearby_coordinates_share_one_query(stub, monkeypatch):
+    stub.delay = 0.2
+    monkeypatch.setattr(location, "_overpass_client", OverpassClient([stub.url("/a")]))
+    latitude, longitude = HOAN_KIEM
+    # Hai người dùng cách nhau vài mét được làm tròn về cùng một tọa độ
+    nearby = (latitude + 0.00002, longitude - 0.00002)
+    assert _build_overpass_query(latitude, longitude, 1000) == _build_overpass_query(*nearby, 1000)
+    
+    async def search_both():
+        return await asyncio.gather(
+            LocationService.search_restaurants_by_coordinates_async(latitude, longitude, top_k=5),
+            LocationService.search_restaurants_by_coordinates_async(*nearby, top_k=5),
+        )
+    
+    first, second = asyncio.run(search_both())
+    assert stub.requests == ["/a"]
+    assert len(first) == 5 and len(second) == 5
+    # Khoảng cách vẫn được tính từ tọa độ gốc của từng người dùng
+    assert [restaurant.id for restaurant in first] == [restaurant.id for restaurant in second]
+
+def test_async_search_matches_sync_and_expands_radius(monkeypatch):
+    queries = []
+    threads = []
+    process = location.process_overpass_response
+    
+    def fetch(query, timeout=None, cache_only=False):
+        queries.append(query)
+        return PAYLOAD
+    
+    def recording_process(*args):
+        threads.append(threading.current_thread().name)
+        return process(*args)
+    
+    monkeypatch.setattr(location, "_fetch_overpass", fetch)
+    monkeypatch.setattr(location, "process_overpass_response", recording_process)
+    monkeypatch.setattr(location, "_executor", ThreadPoolExecutor(max_workers=1, thread_name_prefix="location"))
+    
+    expected = LocationService.search_restaurants_by_coordinates(*HOAN_KIEM, top_k=5)
+    assert asyncio.run(LocationService.search_restaurants_by_coordinates_async(*HOAN_KIEM, top_k=5)) == expected
+    # Phiên bản bất đồng bộ xử lý kết quả trong executor, phiên bản đồng bộ trong thread hiện tại
+    assert threads[0] == threading.current_thread().name and threads[1].startswith("location")
+    
+    # Không có quán phù hợp: cả hai phiên bản tìm lại với bán kính 5000m
+    queries.clear()
+    assert asyncio.run(LocationService.search_restaurants_by_coordinates_async(*HOAN_KIEM, criteria=["không-có-món-này"])) == []
+    assert LocationService.search_restaurants_by_coordinates(*HOAN_KIEM, criteria=["không-có-món-này"]) == []
+    expected_queries = [_build_overpass_query(*HOAN_KIEM, 1000), _build_overpass_query(*HOAN_KIEM, 5000)]
+    assert queries == expected_queries * 2
+    location._executor.shutdown()
+
+def test_results_outside_radius_are_dropped():
+    everything = location.process_overpass_response(PAYLOAD, *HOAN_KIEM)
+    within = location.process_overpass_response(PAYLOAD, *HOAN_KIEM, radius=1000)
+    
+    assert within and len(within) < len(everything)
+    assert all(restaurant.distance <= 1000 for restaurant in within)
+    assert within == [restaurant for restaurant in everything if restaurant.distance <= 1000]
+
+def test_token_bucket_wait_is_bounded_by_timeout(monkeypatch):
+    clock = [100.0]
+    sleeps = []
+    
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock[0] += seconds
+    monkeypatch.setattr(location.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(location.time, "sleep", sleep)
+    
+    bucket = location.TokenBucket(rate=2, burst=1)
+    assert bucket.acquire(0)
+    # Token tiếp theo có sau 0.5 giây: không chờ khi thời gian chờ ngắn hơn
+    assert not bucket.acquire(0.4)
+    assert sleeps == []
+    # Đủ thời gian chờ: ngủ đúng đến khi có token
+    assert bucket.acquire(1)
+    assert sleeps == [0.5]
+    
+    # Không bao giờ có thêm token: trả về ngay, không ngủ
+    empty = location.TokenBucket(rate=0, burst=1)
+    assert empty.acquire(0)
+    assert not empty.acquire(10)
+    assert sleeps == [0.5]
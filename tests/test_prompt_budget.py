@@ -0,0 +1,53 @@
+"""PromptBudget: ước lượng token, rút gọn lịch sử hội thoại và ghi nhận số token của mỗi lần gọi"""
+import logging
+
+import llm.main as llm
+from llm.main import PromptBudget
+from metrics.main import registry
+from test_circuit_breaker import completion
+
+def user(content):
+    return {"role": "user", "content": content}
+
+def bot(content):
+    return {"role": "bot", "content": content}
+
+def test_estimate_and_truncate():
+    assert PromptBudget.estimate_tokens("") == 0
+    assert PromptBudget.estimate_tokens("abcd") == 2
+    assert PromptBudget.truncate("ngắn", 10) == "ngắn"
+    assert PromptBudget.truncate("a" * 10, 2) == "a" * 6 + "…"
+
+def test_history_keeps_the_most_recent_messages_within_budget():
+    history = [user("a" * 30), bot("b" * 30), user("c" * 30), bot("d" * 30)]
+    
+    # Mỗi tin nhắn 10 token: ngân sách 25 token chỉ đủ cho hai tin nhắn mới nhất
+    assert PromptBudget.compact_history(history, budget=25) == history[2:]
+    assert PromptBudget.compact_history(history, budget=40) == history
+    assert PromptBudget.compact_history(history, budget=5) == []
+
+def test_repeated_bot_messages_keep_only_the_latest():
+    history = [bot("Bạn muốn ăn gì?"), user("nướng"), bot("Bạn muốn ăn gì?"), user("nướng")]
+    
+    # Tin nhắn trùng của người dùng vẫn được giữ
+    assert PromptBudget.compact_history(history) == history[1:]
+
+def test_long_bot_messages_are_cut(monkeypatch):
+    monkeypatch.setattr(llm, "LLM_BOT_MESSAGE_MAX_CHARS", 10)
+    history = [user("x" * 20), bot("y" * 20)]
+    
+    assert PromptBudget.compact_history(history) == [user("x" * 20), bot("y" * 10 + "…")]
+
+def test_token_usage_is_logged_without_metrics(monkeypatch, caplog):
+    monkeypatch.setattr(registry, "enabled", False)
+    with caplog.at_level(logging.INFO, logger="llm.main"):
+        llm._record_usage(completion(), [user("xin chào")], "model-a")
+    assert "prompt_tokens=1, completion_tokens=1" in caplog.text
+    
+    # Không có usage trong câu trả lời: ước lượng từ nội dung
+    caplog.clear()
+    answer = completion("a" * 9)
+    answer.usage = None
+    with caplog.at_level(logging.INFO, logger="llm.main"):
+        llm._record_usage(answer, [user("b" * 6)], "model-a")
+    assert "prompt_tokens=2, completion_tokens=3" in caplog.text
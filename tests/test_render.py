@@ -0,0 +1,60 @@
+"""Định dạng markdown cho Telegram và việc tách tin nhắn dài"""
+import re
+
+from render.main import split_message, strip_markdown, to_html, to_markdown_v2
+
+def balanced(chunk: str) -> bool:
+    """Phần đã tách không còn dấu markdown lẻ sau khi bỏ các đoạn hoàn chỉnh"""
+    return not re.search(r"\*\*|`", strip_markdown(chunk))
+
+def test_short_message_is_not_split():
+    assert split_message("Xin chào", limit=20) == ["Xin chào"]
+
+def test_split_prefers_paragraphs_then_lines_then_words():
+    paragraphs = "Đoạn một khá dài\n\nĐoạn hai"
+    assert split_message(paragraphs, limit=20) == ["Đoạn một khá dài", "Đoạn hai"]
+    lines = "Dòng một khá dài\nDòng hai"
+    assert split_message(lines, limit=20) == ["Dòng một khá dài", "Dòng hai"]
+    words = "một hai ba bốn năm sáu bảy"
+    chunks = split_message(words, limit=12)
+    assert all(len(chunk) <= 12 for chunk in chunks)
+    assert " ".join(chunks) == words
+
+def test_split_never_breaks_a_span():
+    text = "Quán ngon: **Bún chả Hàng Mành** và `Phở Thìn 13 Lò Đúc` gần bạn"
+    for limit in range(24, len(text)):
+        chunks = split_message(text, limit=limit)
+        assert all(len(chunk) <= limit for chunk in chunks), limit
+        assert all(balanced(chunk) for chunk in chunks), (limit, chunks)
+        assert " ".join(chunks) == text
+
+def test_split_moves_a_span_to_the_next_chunk_without_spaces():
+    # Không có chỗ tách giữa từ: cắt ngay trước đoạn markdown thay vì cắt ngang nó
+    text = "a" * 15 + "**đậm**" + "b" * 15
+    chunks = split_message(text, limit=20)
+    assert chunks[0] == "a" * 15
+    assert all(balanced(chunk) for chunk in chunks)
+    assert "".join(chunks) == text
+
+def test_span_longer_than_limit_is_still_split():
+    text = "`" + "x" * 30 + "`"
+    chunks = split_message(text, limit=10)
+    assert all(len(chunk) <= 10 for chunk in chunks)
+    assert "".join(chunks) == text
+
+def test_markdown_v2_escapes_special_characters():
+    assert to_markdown_v2("Giá 30.000đ (đã giảm 10%) - ngon!") == "Giá 30\\.000đ \\(đã giảm 10%\\) \\- ngon\\!"
+    assert to_markdown_v2("a_b [c] {d} #e +f =g |h >i") == "a\\_b \\[c\\] \\{d\\} \\#e \\+f \\=g \\|h \\>i"
+    assert to_markdown_v2("đường dẫn C:\\mon-an") == "đường dẫn C:\\\\mon\\-an"
+
+def test_markdown_v2_formats_spans():
+    assert to_markdown_v2("**Phở bò.** và *nghiêng!*") == "*Phở bò\\.* và _nghiêng\\!_"
+    assert to_markdown_v2("__gạch__ ~~ngang~~") == "__gạch__ ~ngang~"
+    # Trong đoạn code chỉ thoát \\ và `
+    assert to_markdown_v2("`a.b-c\\d`") == "`a.b-c\\\\d`"
+    # Dấu lẻ và đoạn rỗng được thoát hoặc bỏ qua, không tạo định dạng hỏng
+    assert to_markdown_v2("5 * 3 = 15") == "5 \\* 3 \\= 15"
+    assert to_markdown_v2("****") == ""
+
+def test_html_escapes_text():
+    assert to_html("**<Quán & Bếp>**") == "<b>&lt;Quán &amp; Bếp&gt;</b>"
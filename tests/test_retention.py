@@ -0,0 +1,103 @@
+"""Dọn dữ liệu quá hạn: bản ghi được lưu trữ trước rồi mới bị xóa"""
+import gzip
+import json
+import time
+
+import pytest
+
+import database.main as db
+import database.retention as retention
+
+DAY = 86400
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Cơ sở dữ liệu và thư mục lưu trữ riêng, chỉ dọn phiên và tin nhắn"""
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "retention.db"))
+    monkeypatch.setattr(db, "_database_ready", False)
+    monkeypatch.setattr(retention, "DB_ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(retention, "RETENTION_TTL_DAYS", {"sessions": 90, "messages": 30})
+    return tmp_path
+
+def make_session(user_id: str, contents, days_ago: float) -> int:
+    """Tạo phiên có các tin nhắn, rồi lùi thời gian của phiên và tin nhắn về days_ago ngày trước"""
+    session_id = db.create_session(user_id)
+    for content in contents:
+        db.add_message(session_id, user_id, "user", content)
+    timestamp = int(time.time() - days_ago * DAY)
+    conn = db.get_connection()
+    conn.execute("UPDATE sessions SET created_at = ?, last_updated = ? WHERE session_id = ?", (timestamp, timestamp, session_id))
+    conn.execute("UPDATE messages SET timestamp = ? WHERE session_id = ?", (timestamp, session_id))
+    conn.commit()
+    conn.close()
+    return session_id
+
+def read_archive(tmp_path, table: str):
+    records = []
+    for path in sorted((tmp_path / "archive").glob(f"{table}-*.jsonl.gz")):
+        with gzip.open(path, "rt", encoding="utf-8") as archive:
+            records.extend(json.loads(line) for line in archive)
+    return records
+
+def session_ids():
+    conn = db.get_connection()
+    ids = {row[0] for row in conn.execute("SELECT session_id FROM sessions")}
+    conn.close()
+    return ids
+
+def test_expired_sessions_are_archived_then_deleted(database):
+    old = make_session("alice", ["Tôi muốn ăn đồ nướng", "Có quán nào cay không? " * 20], days_ago=100)
+    recent = make_session("bob", ["Quán phở gần đây"], days_ago=1)
+    
+    deleted = retention.purge_expired()
+    
+    assert deleted["sessions"] == 1
+    assert session_ids() == {recent}
+    assert db.get_session_messages(old) == []
+    # Bản lưu trữ chứa nội dung đã giải nén của phiên bị xóa
+    (archived,) = read_archive(database, "sessions")
+    assert archived["session_id"] == old
+    assert [message["content"] for message in archived["messages"]] == ["Tôi muốn ăn đồ nướng", "Có quán nào cay không? " * 20]
+
+def test_nothing_is_deleted_when_archive_fails(database, monkeypatch):
+    old = make_session("alice", ["Tôi muốn ăn đồ nướng"], days_ago=100)
+    
+    def fail(table, records):
+        raise OSError("disk full")
+    monkeypatch.setattr(retention, "_archive", fail)
+    
+    with pytest.raises(OSError):
+        retention.purge_expired()
+    assert session_ids() == {old}
+    assert len(db.get_session_messages(old)) == 1
+
+def test_session_resumed_while_archiving_is_kept(database, monkeypatch):
+    old = make_session("alice", ["Tôi muốn ăn đồ nướng"], days_ago=100)
+    archive = retention._archive
+    
+    def archive_then_resume(table, records):
+        archive(table, records)
+        # Người dùng quay lại phiên trong lúc đang ghi file lưu trữ
+        db.add_message(old, "alice", "user", "Còn quán nào khác không?")
+    monkeypatch.setattr(retention, "_archive", archive_then_resume)
+    
+    retention.purge_expired()
+    
+    assert session_ids() == {old}
+    assert [message["content"] for message in db.get_session_messages(old)] == ["Tôi muốn ăn đồ nướng", "Còn quán nào khác không?"]
+
+def test_summarized_messages_are_archived_then_deleted(database):
+    session_id = make_session("alice", ["một", "hai", "ba"], days_ago=40)
+    # Giữ phiên còn hoạt động, chỉ tin nhắn đã tóm tắt bị dọn
+    conn = db.get_connection()
+    conn.execute("UPDATE sessions SET last_updated = ? WHERE session_id = ?", (int(time.time()), session_id))
+    conn.commit()
+    conn.close()
+    seqs = [message["seq"] for message in db.get_session_messages(session_id)]
+    db.save_session_summary(session_id, {"criteria": ["nướng"]}, seqs[1])
+    
+    deleted = retention.purge_expired()
+    
+    assert deleted == {"sessions": 0, "messages": 2}
+    assert [message["content"] for message in db.get_session_messages(session_id)] == ["ba"]
+    assert [record["content"] for record in read_archive(database, "messages")] == ["một", "hai"]
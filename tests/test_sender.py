@@ -0,0 +1,74 @@
+"""OutboundScheduler khi gặp RetryAfter và việc sửa tin nhắn bằng văn bản thuần khi Telegram từ chối định dạng"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+from telegram.error import BadRequest, RetryAfter
+
+import bot.main as bot_main
+from bot.sender import OutboundScheduler
+
+def test_retry_after_pauses_every_chat():
+    async def scenario():
+        scheduler = OutboundScheduler(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1000)
+        sent = {}
+        attempts = []
+        
+        async def rate_limited():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0.3)
+            sent["a"] = time.monotonic()
+        
+        async def other_chat():
+            sent["b"] = time.monotonic()
+        
+        start = time.monotonic()
+        first = asyncio.ensure_future(scheduler.send("a", rate_limited))
+        # Đợi lần gửi đầu nhận RetryAfter rồi mới gửi đến cuộc trò chuyện khác
+        while not attempts:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        await scheduler.send("b", other_chat)
+        await first
+        return start, sent
+    
+    start, sent = asyncio.run(scenario())
+    # Cuộc trò chuyện khác cũng chờ hết thời gian Telegram yêu cầu
+    assert sent["b"] - start >= 0.25
+    assert sent["a"] - start >= 0.25
+
+def make_update(edits):
+    async def edit_message_text(text, parse_mode=None, reply_markup=None):
+        edits.append((text, parse_mode))
+        if parse_mode:
+            raise BadRequest("Can't parse entities: character '.' is reserved")
+    
+    return SimpleNamespace(
+        callback_query=SimpleNamespace(edit_message_text=edit_message_text),
+        effective_chat=SimpleNamespace(id=1)
+    )
+
+def test_edit_message_falls_back_to_plain_text(monkeypatch):
+    monkeypatch.setattr(bot_main, "TELEGRAM_PARSE_MODE", "MarkdownV2")
+    edits = []
+    
+    asyncio.run(bot_main.edit_message(make_update(edits), "Bạn muốn ăn **món nướng**."))
+    
+    assert [parse_mode for _, parse_mode in edits] == ["MarkdownV2", None]
+    assert edits[-1][0] == "Bạn muốn ăn món nướng."
+
+def test_edit_message_ignores_unchanged_content(monkeypatch):
+    monkeypatch.setattr(bot_main, "TELEGRAM_PARSE_MODE", "MarkdownV2")
+    edits = []
+    
+    async def edit_message_text(text, parse_mode=None, reply_markup=None):
+        edits.append(text)
+        raise BadRequest("Message is not modified")
+    
+    update = make_update([])
+    update.callback_query.edit_message_text = edit_message_text
+    asyncio.run(bot_main.edit_message(update, "Không đổi"))
+    
+    # Nội dung không đổi không phải lỗi định dạng, không sửa lại lần nữa
+    assert len(edits) == 1
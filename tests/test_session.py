@@ -0,0 +1,129 @@
+"""Phiên hội thoại: hết hạn, đóng khi /start và /reset, giữ nguyên khi xóa trạng thái; tóm tắt và thứ tự lịch sử"""
+import time
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot.main as bot_main
+import database.main as db
+from database.journal import journal
+from session.main import SessionManager, ConversationState
+from test_bot_flow import make_update
+
+def closed_at(session_id: int):
+    conn = db.get_connection()
+    try:
+        return conn.execute("SELECT closed_at FROM sessions WHERE session_id = ?", (session_id,)).fetchone()["closed_at"]
+    finally:
+        conn.close()
+
+def test_idle_session_is_replaced(monkeypatch):
+    monkeypatch.setattr(db, "SESSION_IDLE_TIMEOUT_S", 60)
+    session_id = SessionManager.get_or_create_session("idle-user")
+    assert db.get_active_session("idle-user") == session_id
+    
+    conn = db.get_connection()
+    conn.execute("UPDATE sessions SET last_updated = ? WHERE session_id = ?", (int(time.time()) - 61, session_id))
+    conn.commit()
+    conn.close()
+    
+    assert db.get_active_session("idle-user") is None
+    new_session_id = SessionManager.get_or_create_session("idle-user")
+    assert new_session_id != session_id
+    # Phiên mới đóng phiên cũ đã quá hạn
+    assert closed_at(session_id) is not None and closed_at(new_session_id) is None
+
+@pytest.fixture
+def replies(monkeypatch):
+    sent = []
+    
+    async def reply(update, text, **kwargs):
+        sent.append(text)
+    monkeypatch.setattr(bot_main, "reply", reply)
+    return sent
+
+@pytest.mark.parametrize("command", ["start", "reset_command"])
+def test_start_and_reset_open_a_new_session(command, replies):
+    user_id = f"{command}-user"
+    SessionManager.add_user_message(user_id, "Tôi muốn ăn đồ nướng")
+    session_id = db.get_active_session(user_id)
+    
+    asyncio.run(getattr(bot_main, command)(make_update(user_id, f"/{command}"), SimpleNamespace(user_data={})))
+    assert journal.flush(timeout=5)
+    
+    assert closed_at(session_id) is not None
+    new_session_id = db.get_active_session(user_id)
+    assert new_session_id not in (None, session_id)
+    # Lịch sử của phiên mới chỉ có câu trả lời cho lệnh
+    assert [message["role"] for message in db.get_session_messages(new_session_id)] == ["bot"]
+    assert SessionManager.get_state(user_id) == ConversationState.IDLE
+
+def test_clear_state_keeps_the_active_session():
+    SessionManager.add_user_message("clear-user", "Tôi muốn ăn đồ nướng")
+    SessionManager.set_state("clear-user", ConversationState.CONFIRMING_CRITERIA, ["nướng"])
+    session_id = db.get_active_session("clear-user")
+    
+    SessionManager.clear_state("clear-user")
+    assert SessionManager.get_criteria("clear-user") is None
+    assert journal.flush(timeout=5)
+    
+    state = db.get_user_state("clear-user")
+    assert state["current_state"] == "IDLE" and state["criteria"] is None
+    assert db.get_active_session("clear-user") == session_id
+
+@pytest.fixture
+def small_summaries(monkeypatch):
+    import session.main as session_module
+    monkeypatch.setattr(session_module, "SESSION_SUMMARY_TRIGGER", 4)
+    monkeypatch.setattr(session_module, "SESSION_SUMMARY_KEEP_RECENT", 2)
+    calls = []
+    
+    def summarize_conversation(previous, conversation):
+        calls.append((previous, conversation))
+        return {"summary": f"tóm tắt {len(conversation)} tin nhắn", "mentioned_foods": [], "mentioned_criteria": [], "user_preferences": []}
+    monkeypatch.setattr("llm.main.summarize_conversation", summarize_conversation)
+    return calls
+
+def add_messages(user_id: str, count: int, start: int = 0) -> None:
+    for index in range(start, start + count):
+        if index % 2 == 0:
+            SessionManager.add_user_message(user_id, f"tin nhắn {index}")
+        else:
+            SessionManager.add_bot_message(user_id, f"tin nhắn {index}")
+
+def test_summary_starts_only_above_the_trigger(small_summaries):
+    add_messages("summary-user", 4)
+    assert not SessionManager.needs_summary("summary-user")
+    SessionManager.summarize_history("summary-user")
+    assert small_summaries == []
+    
+    add_messages("summary-user", 1, start=4)
+    assert SessionManager.needs_summary("summary-user")
+    SessionManager.summarize_history("summary-user")
+    
+    # Ba tin nhắn cũ được tóm tắt, hai tin nhắn gần nhất được giữ nguyên
+    ((previous, conversation),) = small_summaries
+    assert previous is None
+    assert conversation == [
+        {"role": "user", "content": "tin nhắn 0"},
+        {"role": "assistant", "content": "tin nhắn 1"},
+        {"role": "user", "content": "tin nhắn 2"},
+    ]
+    assert not SessionManager.needs_summary("summary-user")
+    assert SessionManager.get_formatted_history("summary-user") == [
+        {"role": "assistant", "content": "Tóm tắt hội thoại trước đó: tóm tắt 3 tin nhắn"},
+        {"role": "assistant", "content": "tin nhắn 3"},
+        {"role": "user", "content": "tin nhắn 4"},
+    ]
+
+def test_formatted_history_keeps_message_order():
+    add_messages("history-user", 3)
+    assert journal.flush(timeout=5)
+    # Tin nhắn chưa được ghi nằm sau các tin nhắn đã ghi
+    add_messages("history-user", 2, start=3)
+    
+    assert SessionManager.get_formatted_history("history-user") == [
+        {"role": "user" if index % 2 == 0 else "assistant", "content": f"tin nhắn {index}"}
+        for index in range(5)
+    ]
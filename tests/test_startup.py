@@ -0,0 +1,39 @@
+"""Khởi động: các thư viện nặng và cơ sở dữ liệu chỉ được nạp khi dùng đến lần đầu"""
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("requests", "geopy", "openai")
+
+def loaded_after(code: str, tmp_path) -> dict:
+    """Chạy code trong tiến trình Python mới, trả về các module nặng đã nạp và cơ sở dữ liệu đã được tạo hay chưa"""
+    db_path = str(tmp_path / "startup.db")
+    script = code + f"""
+import os, sys, json
+print(json.dumps({{"modules": [name for name in {HEAVY_MODULES!r} if name in sys.modules],
+                  "database": os.path.exists({db_path!r})}}))
+"""
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True, cwd=ROOT,
+                            env={**os.environ, "DB_PATH": db_path, "TELEGRAM_TOKEN": "123456:test"}).stdout
+    return json.loads(output.splitlines()[-1])
+
+def test_importing_the_bot_loads_no_heavy_modules(tmp_path):
+    assert loaded_after("import bot.main, worker.main", tmp_path) == {"modules": [], "database": False}
+
+@pytest.mark.parametrize("code, modules, database", [
+    (
+        "from benchmark.fixtures import HOAN_KIEM, overpass_payload\n"
+        "from location.main import process_overpass_response\n"
+        "process_overpass_response(overpass_payload(HOAN_KIEM, 5), *HOAN_KIEM)",
+        # geopy tự import requests
+        ["requests", "geopy"], False,
+    ),
+    ("import llm.main\nllm.main.client", ["openai"], False),
+    ("from session.main import SessionManager\nSessionManager.get_state('startup')", [], True),
+])
+def test_each_dependency_is_loaded_on_first_use(code, modules, database, tmp_path):
+    assert loaded_after(code, tmp_path) == {"modules": modules, "database": database}
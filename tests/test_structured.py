@@ -0,0 +1,61 @@
+"""Kết quả JSON theo schema: _validate và lần yêu cầu sửa duy nhất của get_structured_response"""
+import json
+
+import pytest
+
+import llm.main as llm
+from llm.main import StructuredOutputError, CRITERIA_SCHEMA, RANKING_SCHEMA, _validate, get_structured_response
+from test_circuit_breaker import FakeClient, completion
+
+@pytest.mark.parametrize("value", [
+    {"criteria": ["nướng", "cay"]},
+    {"criteria": [], "thừa": 1},
+])
+def test_validate_accepts_matching_values(value):
+    _validate(value, CRITERIA_SCHEMA)
+
+@pytest.mark.parametrize("value, path", [
+    (["nướng"], "$"),
+    ({}, "$"),
+    ({"criteria": "nướng"}, "$.criteria"),
+    ({"criteria": ["nướng", 3]}, "$.criteria[1]"),
+])
+def test_validate_reports_the_failing_path(value, path):
+    with pytest.raises(StructuredOutputError) as error:
+        _validate(value, CRITERIA_SCHEMA)
+    assert str(error.value).startswith(f"{path}:")
+
+def test_validate_integers_exclude_booleans_and_checks_enum():
+    with pytest.raises(StructuredOutputError):
+        _validate({"ranked_ids": [0, True]}, RANKING_SCHEMA)
+    _validate("SUGGESTING", {"type": "string", "enum": ["SUGGESTING"]})
+    with pytest.raises(StructuredOutputError):
+        _validate("IDLE", {"type": "string", "enum": ["SUGGESTING"]})
+
+def test_invalid_json_is_repaired_once():
+    client = FakeClient(completion("nướng, cay"), completion(json.dumps({"criteria": ["nướng", "cay"]})))
+    
+    result = get_structured_response(client, "Trích xuất", "Tôi muốn ăn nướng cay", "criteria", CRITERIA_SCHEMA)
+    
+    assert result == {"criteria": ["nướng", "cay"]}
+    assert client.calls == 2
+
+def test_second_invalid_result_raises():
+    requests = []
+    client = FakeClient(completion('{"criteria": "nướng"}'), completion("vẫn sai"))
+    create = client.create
+    
+    def recording_create(**request):
+        requests.append(request)
+        return create(**request)
+    
+    client.chat.completions.create = recording_create
+    
+    with pytest.raises(StructuredOutputError):
+        get_structured_response(client, "Trích xuất", "nướng", "criteria", CRITERIA_SCHEMA)
+    
+    # Chỉ sửa một lần, lần sửa gửi lại câu trả lời sai kèm lỗi
+    assert client.calls == 2
+    repair = requests[1]["messages"]
+    assert repair[-2] == {"role": "assistant", "content": '{"criteria": "nướng"}'}
+    assert "$.criteria" in repair[-1]["content"]
@@ -0,0 +1,61 @@
+"""TASK_PROFILES: giá trị mặc định, ghi đè bằng biến môi trường và cách _complete dùng cấu hình của tác vụ"""
+import pytest
+
+import llm.main as llm
+from llm.main import _task_profile
+from test_circuit_breaker import FakeClient, completion
+
+def test_defaults_are_used_without_environment():
+    assert _task_profile("test_task", "model-a", 100, 0.2, 10) == {
+        "model": "model-a", "max_tokens": 100, "temperature": 0.2, "timeout": 10.0
+    }
+
+def test_environment_overrides_each_field(monkeypatch):
+    monkeypatch.setenv("LLM_TEST_TASK_MODEL", "model-b")
+    monkeypatch.setenv("LLM_TEST_TASK_MAX_TOKENS", "50")
+    monkeypatch.setenv("LLM_TEST_TASK_TEMPERATURE", "0.9")
+    monkeypatch.setenv("LLM_TEST_TASK_TIMEOUT", "3.5")
+    
+    assert _task_profile("test_task", "model-a", 100, 0.2, 10) == {
+        "model": "model-b", "max_tokens": 50, "temperature": 0.9, "timeout": 3.5
+    }
+
+def test_empty_values_remove_the_limit(monkeypatch):
+    monkeypatch.setenv("LLM_TEST_TASK_MAX_TOKENS", "")
+    monkeypatch.setenv("LLM_TEST_TASK_TEMPERATURE", "")
+    
+    profile = _task_profile("test_task", "model-a", 100, 0.2, 10)
+    assert profile["max_tokens"] is None and profile["temperature"] is None
+
+@pytest.fixture
+def recorded(monkeypatch):
+    monkeypatch.setitem(llm.TASK_PROFILES, "test_task", _task_profile("test_task", "model-a", 100, 0.2, 10))
+    monkeypatch.setattr(llm, "_breakers", {})
+    client = FakeClient(completion(), completion())
+    sent = []
+    create = client.create
+    
+    def recording_create(**request):
+        sent.append(request)
+        return create(**request)
+    
+    client.chat.completions.create = recording_create
+    return client, sent
+
+def test_complete_sends_the_task_profile(recorded):
+    client, sent = recorded
+    messages = [{"role": "user", "content": "xin chào"}]
+    
+    llm._complete(client, messages, "test_task")
+    llm._complete(client, messages, "test_task", batch_size=3)
+    
+    assert sent[0] == {"model": "model-a", "messages": messages, "max_tokens": 100, "temperature": 0.2, "timeout": 10.0}
+    # Prompt gộp: giới hạn đầu ra nhân theo số yêu cầu, thêm chỗ cho khung JSON
+    assert sent[1]["max_tokens"] == 3 * 100 + 20 * 3
+
+def test_unknown_task_uses_the_default_profile(recorded):
+    client, sent = recorded
+    
+    llm._complete(client, [{"role": "user", "content": "xin chào"}], "không-có-tác-vụ-này")
+    
+    assert sent[0]["model"] == llm.TASK_PROFILES["default"]["model"]
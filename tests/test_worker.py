@@ -0,0 +1,162 @@
+"""WorkerSupervisor: phân phối theo crc32, khởi động lại worker bị dừng, dừng worker và xử lý update đồng thời"""
+import os
+import sys
+import time
+import asyncio
+import subprocess
+import multiprocessing
+
+import pytest
+
+from worker.main import WorkerSupervisor, UpdateRunner, shard_for_user, _STOP
+from benchmark.fixtures import HOAN_KIEM
+from test_overpass import StubOverpass
+
+# Các hàm dưới đây chạy trong tiến trình worker (spawn), nên phải nằm ở cấp module
+
+def _echo_worker(index, update_queue, num_workers):
+    """Ghi lại các update nhận được vào file {index}.log cho đến khi nhận _STOP"""
+    with open(os.path.join(os.environ["WORKER_TEST_DIR"], f"{index}.log"), "a") as log:
+        while True:
+            item = update_queue.get()
+            if item is _STOP:
+                return
+            log.write(f"{item}\n")
+            log.flush()
+
+def _crash_once_worker(index, update_queue, num_workers):
+    """Dừng bất thường ở lần chạy đầu, các lần sau chạy như _echo_worker"""
+    marker = os.path.join(os.environ["WORKER_TEST_DIR"], f"{index}.started")
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(1)
+    _echo_worker(index, update_queue, num_workers)
+
+def _stubborn_worker(index, update_queue, num_workers):
+    """Không dừng khi nhận _STOP"""
+    while True:
+        time.sleep(1)
+
+def _search_worker(index, update_queue, num_workers):
+    """Tìm quán ăn bằng phiên bản bất đồng bộ, ghi số kết quả và loại executor vào file"""
+    import location.main as location
+    restaurants = asyncio.run(location.LocationService.search_restaurants_by_coordinates_async(*HOAN_KIEM, radius=5000))
+    with open(os.path.join(os.environ["WORKER_TEST_DIR"], f"{index}.result"), "w") as result:
+        result.write(f"{len(restaurants)} {type(location._get_executor()).__name__}")
+
+@pytest.fixture
+def worker_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("WORKER_TEST_DIR", str(tmp_path))
+    return tmp_path
+
+def wait_until(condition, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "hết thời gian chờ"
+        time.sleep(0.05)
+
+def read_log(worker_dir, index: int):
+    path = worker_dir / f"{index}.log"
+    return path.read_text().split() if path.exists() else []
+
+def test_shard_is_stable_across_processes():
+    users = [str(user_id) for user_id in range(1000, 1200)]
+    shards = [shard_for_user(user_id, 4) for user_id in users]
+    # hash() của chuỗi đổi theo tiến trình, crc32 thì không
+    code = "import sys; from worker.main import shard_for_user; print(*[shard_for_user(u, 4) for u in sys.argv[1:]])"
+    output = subprocess.run([sys.executable, "-c", code, *users], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            env={**os.environ, "PYTHONHASHSEED": "123"}).stdout
+    assert [int(shard) for shard in output.split()] == shards
+    # Người dùng được chia cho tất cả worker, update không gắn người dùng về worker 0
+    assert set(shards) == {0, 1, 2, 3}
+    assert shard_for_user(None, 4) == 0
+
+def test_drain_processes_queued_updates(worker_dir):
+    supervisor = WorkerSupervisor(2, drain_timeout=10, target=_echo_worker)
+    supervisor.start()
+    # Worker không phải daemon, để có thể tạo tiến trình con (LOCATION_EXECUTOR=process)
+    assert not any(process.daemon for process in supervisor._processes)
+    for item in range(20):
+        supervisor._queues[item % 2].put(item)
+
+    supervisor.stop()
+
+    assert supervisor._processes == [None, None]
+    assert read_log(worker_dir, 0) == [str(item) for item in range(0, 20, 2)]
+    assert read_log(worker_dir, 1) == [str(item) for item in range(1, 20, 2)]
+
+def test_drain_terminates_stuck_worker(worker_dir):
+    supervisor = WorkerSupervisor(1, drain_timeout=0.5, target=_stubborn_worker)
+    supervisor.start()
+    process = supervisor._processes[0]
+
+    supervisor.stop()
+
+    assert not process.is_alive()
+    assert supervisor._processes == [None]
+
+def test_crashed_worker_is_restarted(worker_dir):
+    supervisor = WorkerSupervisor(1, drain_timeout=10, target=_crash_once_worker)
+    supervisor.start()
+    crashed = supervisor._processes[0]
+    crashed.join(20)
+    assert crashed.exitcode == 1
+
+    supervisor.restart_crashed()
+
+    replacement = supervisor._processes[0]
+    assert replacement is not crashed and replacement.is_alive()
+    # Worker mới đọc tiếp cùng hàng đợi
+    supervisor._queues[0].put("sau-khi-khởi-động-lại")
+    wait_until(lambda: read_log(worker_dir, 0) == ["sau-khi-khởi-động-lại"])
+    supervisor.stop()
+    assert not replacement.is_alive()
+
+@pytest.fixture
+def overpass(monkeypatch):
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1")
+    server = StubOverpass()
+    # Tiến trình worker đọc cấu hình từ biến môi trường khi import location.main
+    monkeypatch.setenv("OVERPASS_API_URLS", server.url("/a"))
+    monkeypatch.setenv("LOCATION_EXECUTOR", "process")
+    yield server
+    server.close()
+
+def test_async_search_in_worker_process(worker_dir, overpass):
+    supervisor = WorkerSupervisor(1, drain_timeout=30, target=_search_worker)
+    supervisor.start()
+    supervisor._processes[0].join(60)
+    count, executor = (worker_dir / "0.result").read_text().split()
+    assert int(count) > 0
+    assert executor == "ProcessPoolExecutor"
+
+def test_async_search_in_daemon_process_falls_back_to_threads(worker_dir, overpass):
+    process = multiprocessing.get_context("spawn").Process(target=_search_worker, args=(0, None, 1), daemon=True)
+    process.start()
+    process.join(60)
+    count, executor = (worker_dir / "0.result").read_text().split()
+    assert int(count) > 0
+    assert executor == "ThreadPoolExecutor"
+
+def test_runner_keeps_user_order_without_blocking_others():
+    async def scenario():
+        runner = UpdateRunner()
+        events = []
+
+        async def handle(name: str, delay: float):
+            events.append(f"{name}:start")
+            await asyncio.sleep(delay)
+            events.append(f"{name}:end")
+
+        runner.submit("alice", lambda: handle("alice-1", 0.2))
+        runner.submit("alice", lambda: handle("alice-2", 0))
+        runner.submit("bob", lambda: handle("bob-1", 0))
+        await runner.join()
+        return events, runner
+
+    events, runner = asyncio.run(scenario())
+    # Lượt chậm của alice không chặn bob, tin nhắn thứ hai của alice chờ tin nhắn đầu
+    assert events.index("bob-1:end") < events.index("alice-1:end")
+    assert events.index("alice-1:end") < events.index("alice-2:start")
+    assert runner._locks == {} and runner._users == {}
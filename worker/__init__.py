@@ -0,0 +1 @@
+# Worker process package 
@@ -0,0 +1,292 @@
+import os
+import signal
+import asyncio
+import logging
+import zlib
+import threading
+import multiprocessing
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from telegram import Update
+from telegram.ext import Application, TypeHandler, ContextTypes
+from metrics.main import METRICS_PORT, start_metrics_server
+from database.retention import start_retention_thread
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình chế độ đa tiến trình
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "30"))
+WORKER_MONITOR_INTERVAL = float(os.getenv("WORKER_MONITOR_INTERVAL", "2"))
+# Số update được xử lý đồng thời trong mỗi worker (update của cùng người dùng vẫn chạy tuần tự)
+WORKER_CONCURRENT_UPDATES = int(os.getenv("WORKER_CONCURRENT_UPDATES", "64"))
+
+# Tín hiệu yêu cầu worker dừng sau khi xử lý hết các update đang chờ
+_STOP = None
+
+def shard_for_user(user_id: Optional[str], num_workers: int) -> int:
+    """
+    Xác định worker xử lý update của người dùng
+    
+    Dùng crc32 thay cho hash() vì hash() của chuỗi thay đổi giữa các tiến trình.
+    
+    Args:
+        user_id: ID người dùng (None nếu update không gắn với người dùng)
+        num_workers: Số lượng worker
+        
+    Returns:
+        Chỉ số của worker
+    """
+    if not user_id:
+        return 0
+    return zlib.crc32(str(user_id).encode("utf-8")) % num_workers
+
+class UpdateRunner:
+    """
+    Chạy các update đồng thời, mỗi update một task
+    
+    Update của cùng một người dùng chờ nhau theo đúng thứ tự nhận (asyncio.Lock trả lượt
+    theo thứ tự chờ), nên một lượt chậm (Overpass, LLM) chỉ làm chậm người dùng đó.
+    """
+    
+    def __init__(self, limit: int = WORKER_CONCURRENT_UPDATES):
+        self._semaphore = asyncio.Semaphore(max(1, limit))
+        # Khóa của từng người dùng và số update đang dùng khóa đó
+        self._locks: Dict[Optional[str], asyncio.Lock] = {}
+        self._users: Dict[Optional[str], int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+    
+    def submit(self, user_id: Optional[str], handle: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Tạo task xử lý một update của user_id (None nếu update không gắn với người dùng)"""
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        self._users[user_id] = self._users.get(user_id, 0) + 1
+        task = asyncio.create_task(self._run(user_id, lock, handle))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+    
+    async def _run(self, user_id: Optional[str], lock: asyncio.Lock, handle: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            async with lock:
+                async with self._semaphore:
+                    await handle()
+        finally:
+            self._users[user_id] -= 1
+            if not self._users[user_id]:
+                del self._users[user_id]
+                del self._locks[user_id]
+    
+    async def join(self) -> None:
+        """Chờ tất cả update đang xử lý xong"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+def _worker_main(index: int, update_queue: multiprocessing.Queue, num_workers: int = 1) -> None:
+    """Điểm vào của tiến trình worker."""
+    # Chỉ supervisor xử lý Ctrl-C, worker dừng khi nhận tín hiệu _STOP
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, update_queue, num_workers))
+
+async def _worker_loop(index: int, update_queue: multiprocessing.Queue, num_workers: int = 1) -> None:
+    """
+    Vòng lặp xử lý update của một worker
+    
+    Mỗi worker có ứng dụng, bộ nhớ đệm và kết nối cơ sở dữ liệu riêng.
+    Các update được xử lý đồng thời (UpdateRunner), update của mỗi người dùng vẫn
+    được xử lý tuần tự để giữ đúng thứ tự tin nhắn.
+    
+    Args:
+        index: Chỉ số của worker
+        update_queue: Hàng đợi update dành riêng cho worker này
+        num_workers: Tổng số worker
+    """
+    # Import trong tiến trình con để mỗi worker khởi tạo trạng thái riêng
+    from bot.main import build_application, flush_journal
+    from bot.sender import scheduler
+    
+    # Giới hạn gửi chung của bot được chia đều cho các worker; mỗi cuộc trò chuyện
+    # chỉ thuộc về một worker (shard_for_user) nên giữ nguyên giới hạn theo cuộc trò chuyện
+    scheduler.configure(
+        global_rate=scheduler.global_rate / num_workers,
+        global_burst=max(1, scheduler.global_burst // num_workers)
+    )
+    
+    application = build_application()
+    await application.initialize()
+    
+    # Mỗi worker xuất số liệu tại cổng riêng: METRICS_PORT + 1 + index
+    start_metrics_server(METRICS_PORT + 1 + index)
+    loop = asyncio.get_running_loop()
+    runner = UpdateRunner()
+    
+    async def handle(update: Update) -> None:
+        try:
+            await application.process_update(update)
+        except Exception as e:
+            logger.error(f"Worker {index} lỗi khi xử lý update: {e}")
+    
+    try:
+        while True:
+            data = await loop.run_in_executor(None, update_queue.get)
+            if data is _STOP:
+                break
+            try:
+                update = Update.de_json(data, application.bot)
+            except Exception as e:
+                logger.error(f"Worker {index} không đọc được update: {e}")
+                continue
+            user = update.effective_user
+            runner.submit(str(user.id) if user else None, lambda update=update: handle(update))
+        # Xử lý hết các update đã nhận trước khi dừng
+        await runner.join()
+    finally:
+        # Ghi nốt các tin nhắn và trạng thái còn trong journal trước khi tắt ứng dụng
+        await flush_journal(application)
+        await application.shutdown()
+
+class WorkerSupervisor:
+    """Quản lý các tiến trình worker và phân phối update theo user_id"""
+    
+    def __init__(self, num_workers: int, drain_timeout: float = WORKER_DRAIN_TIMEOUT,
+                 target: Callable[..., None] = _worker_main):
+        self.num_workers = num_workers
+        self.drain_timeout = drain_timeout
+        # Hàm chạy trong tiến trình worker, nhận (index, update_queue, num_workers)
+        self._target = target
+        self._context = multiprocessing.get_context("spawn")
+        self._queues: List[multiprocessing.Queue] = [self._context.Queue() for _ in range(num_workers)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * num_workers
+        # Bảo vệ _processes giữa _monitor (event loop) và restart/stop (luồng executor),
+        # để không có hai worker cùng đọc một hàng đợi
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._monitor_task: Optional[asyncio.Task] = None
+    
+    def _spawn(self, index: int) -> None:
+        """Khởi động worker tại vị trí index (gọi khi đang giữ _lock, không gọi trên event loop)"""
+        # Không dùng daemon: tiến trình daemon không tạo được tiến trình con, nên
+        # LOCATION_EXECUTOR=process sẽ lỗi. Worker được dừng trong _drain (stop/restart).
+        process = self._context.Process(
+            target=self._target,
+            args=(index, self._queues[index], self.num_workers),
+            name=f"food-chatbot-worker-{index}"
+        )
+        process.start()
+        self._processes[index] = process
+    
+    def _drain(self, index: int) -> None:
+        """Yêu cầu worker xử lý hết hàng đợi rồi dừng, buộc dừng nếu quá thời gian chờ"""
+        # Bỏ worker khỏi danh sách trước khi gửi _STOP, để _monitor không khởi động
+        # worker thay thế trong lúc worker cũ đang dừng
+        with self._lock:
+            process = self._processes[index]
+            self._processes[index] = None
+        if process is None:
+            return
+        
+        if process.is_alive():
+            self._queues[index].put(_STOP)
+            process.join(self.drain_timeout)
+            if process.is_alive():
+                logger.error(f"Worker {index} không dừng sau {self.drain_timeout}s, buộc dừng")
+                process.terminate()
+                process.join()
+    
+    def start(self) -> None:
+        """Khởi động tất cả worker"""
+        with self._lock:
+            for index in range(self.num_workers):
+                self._spawn(index)
+    
+    def stop(self) -> None:
+        """Dừng tất cả worker sau khi xử lý hết các update đang chờ"""
+        self._stopping = True
+        for index in range(self.num_workers):
+            self._drain(index)
+    
+    def restart(self) -> None:
+        """
+        Khởi động lại lần lượt từng worker
+        
+        Worker mới dùng lại hàng đợi của worker cũ nên các update đến trong lúc
+        khởi động lại vẫn được xử lý đúng thứ tự.
+        """
+        for index in range(self.num_workers):
+            self._drain(index)
+            with self._lock:
+                if not self._stopping and self._processes[index] is None:
+                    self._spawn(index)
+    
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Chuyển update đến worker phụ trách người dùng"""
+        user = update.effective_user
+        index = shard_for_user(str(user.id) if user else None, self.num_workers)
+        self._queues[index].put(update.to_dict())
+    
+    def restart_crashed(self) -> None:
+        """Khởi động lại các worker bị dừng bất thường"""
+        with self._lock:
+            for index, process in enumerate(self._processes):
+                if self._stopping:
+                    break
+                if process is not None and not process.is_alive():
+                    logger.error(f"Worker {index} đã dừng (exit code {process.exitcode}), đang khởi động lại")
+                    process.join()
+                    self._spawn(index)
+    
+    async def _monitor(self) -> None:
+        """Định kỳ kiểm tra và khởi động lại các worker bị dừng bất thường"""
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            await asyncio.sleep(WORKER_MONITOR_INTERVAL)
+            # Khởi động tiến trình (và chờ _lock) trong thread của executor, không chặn event loop
+            await loop.run_in_executor(None, self.restart_crashed)
+    
+    async def post_init(self, application: Application) -> None:
+        """Khởi động worker khi ứng dụng supervisor đã sẵn sàng"""
+        await asyncio.get_running_loop().run_in_executor(None, self.start)
+        self._monitor_task = asyncio.create_task(self._monitor())
+        
+        # SIGHUP: khởi động lại các worker mà không làm mất update
+        if hasattr(signal, "SIGHUP"):
+            loop = asyncio.get_running_loop()
+            loop.add_signal_handler(
+                signal.SIGHUP,
+                lambda: loop.run_in_executor(None, self.restart)
+            )
+    
+    async def post_shutdown(self, application: Application) -> None:
+        """Dừng worker khi supervisor tắt"""
+        self._stopping = True
+        if self._monitor_task:
+            self._monitor_task.cancel()
+        await asyncio.get_running_loop().run_in_executor(None, self.stop)
+
+def run_supervisor(num_workers: int) -> None:
+    """
+    Khởi động bot ở chế độ đa tiến trình
+    
+    Supervisor nhận update từ Telegram và chuyển cho worker theo user_id,
+    các worker xử lý update song song trên nhiều tiến trình.
+    
+    Args:
+        num_workers: Số lượng worker
+    """
+    supervisor = WorkerSupervisor(num_workers)
+    
+    application = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(supervisor.post_init)
+        .post_shutdown(supervisor.post_shutdown)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, supervisor.dispatch))
+    start_metrics_server()
+    
+    # Chỉ supervisor dọn dữ liệu quá hạn, các worker dùng chung cơ sở dữ liệu
+    start_retention_thread()
+    
+    # Chạy supervisor cho đến khi người dùng nhấn Ctrl-C
+    application.run_polling(allowed_updates=Update.ALL_TYPES)